@@ -1,21 +1,12 @@
-import google.generativeai as genai
-from config import settings
+from llms.providers import get_provider
 from utils.logger import logger
 
-# Force API key path (no ADC) and REST transport
-genai.configure(api_key=settings.GEMINI_API_KEY, transport="rest")
-
 
 def provide_feedback(summary: str, original_query: str = "") -> dict:
     """
     Reviews the response quality using Gemini 2.5 Flash
     """
     try:
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            generation_config={'temperature': 0.3, 'max_output_tokens': 100}
-        )
-
         prompt = f"""Evaluate this chatbot response for quality:
 
 User Query: {original_query}
@@ -32,36 +23,8 @@ Format:
 Score: X/5
 Evaluation: [one sentence]"""
 
-        try:
-            result = model.generate_content(prompt)
-        except Exception as e:
-            if '404' in str(e) or 'not found' in str(e).lower():
-                model = genai.GenerativeModel(
-                    model_name='gemini-1.5-pro',
-                    generation_config={'temperature': 0.3, 'max_output_tokens': 100}
-                )
-                result = model.generate_content(prompt)
-            else:
-                raise
-
-        # Safely extract text
-        feedback_text = None
-        try:
-            if getattr(result, 'text', None):
-                feedback_text = (result.text or "").strip()
-        except Exception:
-            feedback_text = None
-
-        if not feedback_text:
-            try:
-                candidates = getattr(result, 'candidates', None) or []
-                if candidates:
-                    parts = getattr(candidates[0], 'content', None)
-                    if parts and getattr(parts, 'parts', None):
-                        texts = [getattr(p, 'text', '') for p in parts.parts]
-                        feedback_text = "\n".join([t for t in texts if t]).strip()
-            except Exception:
-                feedback_text = None
+        feedback_text = get_provider().generate(
+            prompt, generation_config={'temperature': 0.3, 'max_output_tokens': 100})
 
         if not feedback_text:
             logger.warning("Critic produced no text; using default feedback")
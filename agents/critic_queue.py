@@ -0,0 +1,120 @@
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from agents.critic_agent import provide_feedback
+
+
+class CriticQueue:
+    """
+    Runs the critic off the request path on a bounded worker pool and keeps
+    recent critiques keyed by message id
+    """
+
+    def __init__(self, workers: int = None, sample_rate: float = None,
+                 max_pending: int = None, max_results: int = None):
+        self.workers = workers or settings.CRITIC_WORKERS
+        self.sample_rate = settings.CRITIC_SAMPLE_RATE if sample_rate is None else sample_rate
+        self.max_pending = max_pending or settings.CRITIC_MAX_PENDING
+        self.max_results = max_results or settings.CRITIC_MAX_RESULTS
+        self._executor = None
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+        self._pending = 0
+        # dedupe key -> [(message_id, on_done)] waiting on one in-flight critique
+        self._inflight = {}
+        self.stats = {"submitted": 0, "sampled_out": 0, "dropped": 0, "completed": 0, "failed": 0,
+                      "coalesced": 0}
+
+    def should_sample(self) -> bool:
+        if self.sample_rate >= 1:
+            return True
+        if self.sample_rate <= 0:
+            return False
+        return random.random() < self.sample_rate
+
+    def _remember(self, message_id: str, entry: dict) -> None:
+        # Caller holds self._lock, so a pending entry can never overwrite a finished one
+        self._results[message_id] = entry
+        self._results.move_to_end(message_id)
+        while len(self._results) > self.max_results:
+            self._results.popitem(last=False)
+
+    def submit(self, message_id: str, summary: str, query: str = "", on_done=None, key: str = None) -> str:
+        """
+        Queue a critique; returns "pending", or "skipped" when sampled out or the queue is full.
+        Messages submitted with the same key while one is in flight share its result.
+        """
+        if key is not None:
+            with self._lock:
+                waiters = self._inflight.get(key)
+                if waiters is not None:
+                    waiters.append((message_id, on_done))
+                    self.stats["coalesced"] += 1
+                    self._remember(message_id, {"status": "pending", "feedback": ""})
+                    return "pending"
+        if not self.should_sample():
+            with self._lock:
+                self.stats["sampled_out"] += 1
+            return "skipped"
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.stats["dropped"] += 1
+                logger.warning("Critic queue full; skipping critique")
+                return "skipped"
+            self._pending += 1
+            self.stats["submitted"] += 1
+            waiters = [] if key is not None else None
+            if key is not None:
+                self._inflight[key] = waiters
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="critic")
+            executor = self._executor
+            self._remember(message_id, {"status": "pending", "feedback": ""})
+        executor.submit(self._run, message_id, summary, query, on_done, key, waiters)
+        return "pending"
+
+    def _run(self, message_id: str, summary: str, query: str, on_done, key: str = None,
+             waiters: list = None) -> None:
+        feedback, status = "", "error"
+        try:
+            with metrics.track("critic"):
+                result = provide_feedback(summary, query)
+            feedback, status = result.get("feedback", ""), "done"
+        except Exception as e:
+            logger.error(f"Background critique failed for {message_id}: {e}")
+        with self._lock:
+            self._pending -= 1
+            self.stats["completed" if status == "done" else "failed"] += 1
+            # Only this flight's entry: a newer one for the same key keeps its waiters
+            if key is not None and self._inflight.get(key) is waiters:
+                del self._inflight[key]
+            targets = [(message_id, on_done)] + list(waiters or [])
+            for mid, _ in targets:
+                self._remember(mid, {"status": status, "feedback": feedback})
+        if status != "done":
+            return
+        for mid, callback in targets:
+            if callback:
+                try:
+                    callback(mid, feedback)
+                except Exception as e:
+                    logger.error(f"Critique callback failed for {mid}: {e}")
+
+    def get(self, message_id: str):
+        with self._lock:
+            entry = self._results.get(message_id)
+            return dict(entry) if entry else None
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+critic_queue = CriticQueue()
+metrics.register_collector(lambda: [("supportai_critic_queue_pending", {}, critic_queue._pending)])
@@ -1,38 +1,35 @@
-import json
-import os
+import sys
+import uuid
 from datetime import datetime
 from config import settings
 from utils.logger import logger
+from database.feedback_log import feedback_log
 
 
-def save_feedback(feedback_text: str, query: str = "", response: str = "") -> bool:
-    """
-    Save user feedback to a JSON file
-    """
-    try:
-        feedback_file = settings.FEEDBACK_STORE
+def make_feedback_entry(feedback_text: str, query: str = "", response: str = "") -> dict:
+    return {
+        # Lets log compaction drop duplicates left by retried writes
+        "id": uuid.uuid4().hex,
+        "timestamp": datetime.now().isoformat(),
+        "feedback": feedback_text,
+        "query": query,
+        "response": response
+    }
 
-        # Load existing feedback
-        if os.path.exists(feedback_file):
-            with open(feedback_file, 'r', encoding='utf-8') as f:
-                feedback_data = json.load(f)
-        else:
-            feedback_data = []
 
-        # Add new feedback entry
-        feedback_entry = {
-            "timestamp": datetime.now().isoformat(),
-            "feedback": feedback_text,
-            "query": query,
-            "response": response
-        }
-
-        feedback_data.append(feedback_entry)
+def save_feedback_entries(entries: list) -> None:
+    """
+    Append feedback entries to the log in one atomic write; raises on failure
+    """
+    feedback_log.append(entries)
 
-        # Save updated feedback
-        with open(feedback_file, 'w', encoding='utf-8') as f:
-            json.dump(feedback_data, f, indent=2, ensure_ascii=False)
 
+def save_feedback(feedback_text: str, query: str = "", response: str = "") -> bool:
+    """
+    Save user feedback to the feedback log
+    """
+    try:
+        save_feedback_entries([make_feedback_entry(feedback_text, query, response)])
         logger.info(f"Feedback saved successfully")
         return True
 
@@ -41,19 +38,58 @@ def save_feedback(feedback_text: str, query: str = "", response: str = "") -> bo
         return False
 
 
-def get_all_feedback() -> list:
+def build_feedback_guidance(feedbacks: list, max_items: int = None, ref_chars: int = None):
     """
-    Retrieve all stored feedback
+    Turn a chat's newest-first feedback entries into numbered guidance from its dislikes; None if there are none
     """
-    try:
-        feedback_file = settings.FEEDBACK_STORE
+    max_items = settings.FEEDBACK_GUIDANCE_MAX_ITEMS if max_items is None else max_items
+    ref_chars = settings.FEEDBACK_GUIDANCE_REF_CHARS if ref_chars is None else ref_chars
+    dislikes = [f for f in feedbacks if (f.get("rating") == "dislike")]
+    parts = []
+    for i, f in enumerate(dislikes[:max_items], 1):
+        fb_txt = (f.get("feedback") or "").strip()
+        msg = (f.get("message") or "").strip()
+        if msg:
+            msg = (msg[:ref_chars] + "…") if len(msg) > ref_chars else msg
+        if fb_txt:
+            parts.append(f"{i}. {fb_txt}{' | reference: ' + msg if msg else ''}")
+        elif msg:
+            parts.append(f"{i}. Avoid issues like: {msg}")
+    return "\n".join(parts) if parts else None
 
-        if os.path.exists(feedback_file):
-            with open(feedback_file, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        else:
-            return []
 
+def apply_feedback_guidance(query: str, guidance: str = None) -> str:
+    """
+    Append stored chat guidance to a user query
+    """
+    if not guidance:
+        return query
+    return f"{query}\n\n{settings.FEEDBACK_GUIDANCE_HEADER}\n{guidance}"
+
+
+def get_all_feedback():
+    """
+    Iterate over all stored feedback, oldest first (streamed from the log, not loaded at once)
+    """
+    try:
+        yield from feedback_log
     except Exception as e:
         logger.error(f"Error loading feedback: {e}")
-        return []
+
+
+def migrate_feedback_json() -> int:
+    """
+    Import the legacy feedback JSON file into the log (no-op once migrated)
+    """
+    return feedback_log.migrate_json(settings.FEEDBACK_STORE)
+
+
+if __name__ == "__main__":
+    # python -m agents.feedback_manager migrate|compact|stats
+    cmd = sys.argv[1] if len(sys.argv) > 1 else "stats"
+    if cmd == "migrate":
+        print(f"Migrated {migrate_feedback_json()} entries from {settings.FEEDBACK_STORE}")
+    elif cmd == "compact":
+        print(f"Compacted feedback log: {feedback_log.compact()} entries kept")
+    else:
+        print(feedback_log.get_stats())
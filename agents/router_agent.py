@@ -1,4 +1,4 @@
-from researchers.main_researcher import handle_universal_query
+from researchers.main_researcher import handle_universal_query, stream_universal_query
 from utils.logger import logger
 
 
@@ -22,3 +22,11 @@ def route_query(query: str, conversation_history: list = None) -> dict:
             "query": query,
             "status": "error"
         }
+
+
+def route_query_stream(query: str, conversation_history: list = None):
+    """
+    Streaming router - yields the universal researcher's answer chunk by chunk
+    """
+    logger.info(f"Streaming query to universal researcher: {query[:50]}...")
+    yield from stream_universal_query(query, conversation_history)
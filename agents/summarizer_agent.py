@@ -1,10 +1,77 @@
-import google.generativeai as genai
 from config import settings
+from llms.providers import get_provider
 from utils.logger import logger
+import re
+import threading
 import uuid
 
-# Force API key flow (not ADC) and use REST transport
-genai.configure(api_key=settings.GEMINI_API_KEY, transport="rest")
+# Heading line such as "## Summary", "**Tips/Notes**", "1. Key Points:" or "### 4. Next Steps / Resources"
+_HEADING_RE = re.compile(
+    r"^\s{0,3}(?:#{1,6}\s*)?(?:\*\*|__)?\s*(?:\d+[.)]\s*)?"
+    r"(summary|steps|key points|tips\s*/\s*notes|next steps(?:\s*/\s*resources)?)"
+    r"\s*:?\s*(?:\*\*|__)?\s*:?\s*$",
+    re.IGNORECASE,
+)
+# Expected section order; index 1 accepts either Steps or Key Points
+_SECTION_ORDER = ("summary", ("steps", "key points"), "tips/notes", "next steps")
+
+_stats_lock = threading.Lock()
+summarizer_stats = {"fast_path": 0, "two_pass": 0, "contract_failed": 0, "forced_two_pass": 0}
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        summarizer_stats[key] += 1
+
+
+def get_summarizer_stats() -> dict:
+    with _stats_lock:
+        stats = dict(summarizer_stats)
+    total = stats["fast_path"] + stats["two_pass"]
+    stats["fast_path_ratio"] = round(stats["fast_path"] / total, 4) if total else 0.0
+    return stats
+
+
+def _canonical_heading(name: str) -> str:
+    name = re.sub(r"\s+", " ", name.lower())
+    name = re.sub(r"\s*/\s*", "/", name)
+    if name.startswith("next steps"):
+        return "next steps"
+    return name
+
+
+def meets_format_contract(text: str) -> bool:
+    """
+    Fast local check that text already has the four required sections,
+    in order, each with some content
+    """
+    if not text:
+        return False
+    headings = []
+    in_fence = False
+    body_lines = 0
+    for line in text.splitlines():
+        if line.lstrip().startswith("```"):
+            in_fence = not in_fence
+            body_lines += 1
+            continue
+        m = None if in_fence else _HEADING_RE.match(line)
+        if m:
+            if headings and body_lines == 0:
+                return False
+            headings.append(_canonical_heading(m.group(1)))
+            body_lines = 0
+        elif line.strip():
+            body_lines += 1
+    if len(headings) != len(_SECTION_ORDER) or body_lines == 0:
+        return False
+    for found, expected in zip(headings, _SECTION_ORDER):
+        if isinstance(expected, tuple):
+            if found not in expected:
+                return False
+        elif found != expected:
+            return False
+    return True
 
 
 def summarize_output(routing_result: dict) -> str:
@@ -16,16 +83,23 @@ def summarize_output(routing_result: dict) -> str:
         is_resummarize = bool(routing_result.get("resummarize", False))
         feedback_guidance = routing_result.get("feedback_guidance")
 
-        # Always run through the formatter to enforce structure
+        # Single-pass: skip the formatter when the researcher already met the format contract
+        if not is_resummarize and not feedback_guidance:
+            if settings.SUMMARIZER_FORCE_TWO_PASS:
+                _count("forced_two_pass")
+            elif meets_format_contract(response_text):
+                _count("fast_path")
+                logger.info("Researcher output meets format contract; skipping summarizer")
+                return response_text.strip()
+            else:
+                _count("contract_failed")
+        _count("two_pass")
 
         # Ask Gemini to polish/summarize. Use higher temperature on resummarize to get variation
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            generation_config={
-                'temperature': 0.8 if is_resummarize else 0.3,
-                'max_output_tokens': 400,
-            }
-        )
+        generation_config = {
+            'temperature': 0.8 if is_resummarize else 0.3,
+            'max_output_tokens': 400,
+        }
 
         style_id = str(uuid.uuid4()) if is_resummarize else ""
         guidance_block = f"\n\nUser feedback to consider (address these explicitly and avoid previous issues):\n{feedback_guidance}" if feedback_guidance else ""
@@ -50,26 +124,7 @@ Original response:
 
 Return ONLY the final structured Markdown with those sections, nothing else."""
 
-        result = model.generate_content(prompt)
-
-        # Safely extract text, since result.text can fail when no valid Part exists
-        summary = None
-        try:
-            if getattr(result, 'text', None):
-                summary = (result.text or "").strip()
-        except Exception:
-            summary = None
-
-        if not summary:
-            try:
-                candidates = getattr(result, 'candidates', None) or []
-                if candidates:
-                    parts = getattr(candidates[0], 'content', None)
-                    if parts and getattr(parts, 'parts', None):
-                        texts = [getattr(p, 'text', '') for p in parts.parts]
-                        summary = "\n".join([t for t in texts if t]).strip()
-            except Exception:
-                summary = None
+        summary = get_provider().generate(prompt, generation_config=generation_config)
 
         if not summary:
             logger.warning("Summarizer produced no text; falling back to original response")
@@ -0,0 +1,146 @@
+import re
+import threading
+import time
+from collections import OrderedDict
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from llms.providers import get_provider
+
+# Per-conversation text sent to the title prompt; a title needs only the gist
+_PROMPT_CHARS = 300
+_NUMBERED = re.compile(r"^\s*(\d+)[.):]\s*(.+?)\s*$")
+
+
+def heuristic_title_from_text(text: str) -> str:
+    t = (text or "").strip()
+    if not t:
+        return "Untitled"
+    # Take first sentence or first ~6 words
+    for sep in ['.', '!', '?', '\n']:
+        if sep in t:
+            t = t.split(sep, 1)[0]
+            break
+    words = t.split()
+    t = " ".join(words[:8])
+    return t[:60] or "Untitled"
+
+
+def generate_chat_titles(conversations: list) -> list:
+    """
+    One LLM call titling several conversations; takes [(user_text, bot_text)] and
+    returns a title (or None when missing from the reply) for each, in order
+    """
+    blocks = []
+    for i, (user_text, bot_text) in enumerate(conversations, 1):
+        blocks.append(f"{i}. User: {(user_text or '')[:_PROMPT_CHARS]}\n"
+                      f"Assistant: {(bot_text or '')[:_PROMPT_CHARS]}")
+    prompt = ("Create a 3-6 word chat title for each conversation below.\n"
+              "Reply with one line per conversation, formatted as '<number>. <title>', and nothing else.\n\n"
+              + "\n\n".join(blocks) + "\n\nTitles:")
+    text = get_provider().generate(
+        prompt, generation_config={'temperature': 0.2, 'max_output_tokens': 16 * len(conversations)})
+    titles = [None] * len(conversations)
+    for line in (text or "").splitlines():
+        m = _NUMBERED.match(line)
+        if not m:
+            continue
+        idx = int(m.group(1)) - 1
+        title = m.group(2).strip().strip('"').strip()
+        if 0 <= idx < len(titles) and title:
+            titles[idx] = title[:60]
+    return titles
+
+
+class TitleQueue:
+    """
+    Collects chats that only have a heuristic title and titles them with the LLM in
+    periodic batches (several chats per prompt) on a background thread
+    """
+
+    def __init__(self, batch_size: int = None, interval: float = None, max_pending: int = None):
+        self.batch_size = batch_size or settings.TITLE_BATCH_SIZE
+        self.interval = settings.TITLE_BATCH_INTERVAL_MS / 1000.0 if interval is None else interval
+        self.max_pending = max_pending or settings.TITLE_MAX_PENDING
+        self._cond = threading.Condition()
+        # chat_id -> (user_text, bot_text, heuristic title, on_done)
+        self._pending = OrderedDict()
+        self._thread = None
+        self._closed = False
+        self.stats = {"submitted": 0, "dropped": 0, "batches": 0, "titled": 0, "failed": 0}
+
+    def submit(self, chat_id: str, user_text: str, bot_text: str, heuristic: str, on_done) -> bool:
+        """
+        Queue a chat for an LLM title; on_done(chat_id, heuristic, title) runs once it is generated.
+        Returns False when the queue is full (the heuristic title stays).
+        """
+        with self._cond:
+            if self._closed:
+                return False
+            if chat_id in self._pending:
+                return True
+            if len(self._pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                return False
+            self._pending[chat_id] = (user_text, bot_text, heuristic, on_done)
+            self.stats["submitted"] += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._loop, name="title-batcher", daemon=True)
+                self._thread.start()
+            # Wake the batcher when work arrives and again when a batch is full
+            if len(self._pending) == 1 or len(self._pending) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._pending and not self._closed:
+                    self._cond.wait()
+                # Let more chats join until the batch is full or the interval has passed
+                deadline = time.monotonic() + self.interval
+                while len(self._pending) < self.batch_size and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                if self._closed:
+                    return
+                batch = [self._pending.popitem(last=False) for _ in range(min(self.batch_size, len(self._pending)))]
+            self._run(batch)
+
+    def _run(self, batch: list) -> None:
+        try:
+            with metrics.track("title"):
+                titles = generate_chat_titles([(user, bot) for _, (user, bot, _, _) in batch])
+        except Exception as e:
+            logger.error(f"Background title generation failed for {len(batch)} chats: {e}")
+            with self._cond:
+                self.stats["failed"] += len(batch)
+            return
+        with self._cond:
+            self.stats["batches"] += 1
+        for (chat_id, (_, _, heuristic, on_done)), title in zip(batch, titles):
+            if not title or title == heuristic:
+                continue
+            try:
+                on_done(chat_id, heuristic, title)
+                with self._cond:
+                    self.stats["titled"] += 1
+            except Exception as e:
+                logger.error(f"Failed to store title for chat {chat_id}: {e}")
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {"pending": len(self._pending), **self.stats}
+
+    def shutdown(self) -> None:
+        # Pending chats keep their heuristic titles; no LLM calls during shutdown
+        with self._cond:
+            self._closed = True
+            self._pending.clear()
+            self._cond.notify_all()
+
+
+title_queue = TitleQueue()
+metrics.register_collector(lambda: [("supportai_title_queue_pending", {}, len(title_queue._pending))])
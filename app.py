@@ -1,234 +1,195 @@
 from __future__ import annotations
-def _heuristic_title_from_text(text: str) -> str:
-    t = (text or "").strip()
-    if not t:
-        return "Untitled"
-    # Take first sentence or first ~6 words
-    for sep in ['.', '!', '?', '\n']:
-        if sep in t:
-            t = t.split(sep, 1)[0]
-            break
-    words = t.split()
-    t = " ".join(words[:8])
-    return t[:60] or "Untitled"
-
-def _generate_chat_title(user_text: str, bot_text: str) -> str:
-    try:
-        # Best-effort: use Gemini via summarizer's model if available without heavy prompt
-        import google.generativeai as genai
-        genai.configure(api_key=settings.GEMINI_API_KEY)
-        model = genai.GenerativeModel(
-            model_name='models/gemini-2.5-flash',
-            generation_config={'temperature': 0.2, 'max_output_tokens': 12}
-        )
-        prompt = f"""Create a 3-6 word chat title for this conversation topic.
-User: {user_text}
-Assistant: {bot_text}
-Title:"""
-        res = model.generate_content(prompt)
-        title = None
-        try:
-            if getattr(res, 'text', None):
-                title = (res.text or '').strip().strip('"')
-        except Exception:
-            title = None
-        if not title:
-            cands = getattr(res, 'candidates', None) or []
-            if cands and getattr(cands[0], 'content', None) and getattr(cands[0].content, 'parts', None):
-                parts = cands[0].content.parts
-                texts = [getattr(p, 'text', '') for p in parts]
-                title = " ".join([t for t in texts if t]).strip().strip('"')
-        if title:
-            return title[:60]
-    except Exception:
-        pass
-
-# Placeholder; will initialize after imports are loaded
-fs = None
-attachments_col = None
-
-def _safe_mime(filename: str, content_type: str = None) -> str:
-    if content_type:
-        return content_type
-    guess = mimetypes.guess_type(filename or "")[0]
-    return guess or "application/octet-stream"
-
-def _extract_text_from_path(path: str, mime: str) -> str:
-    try:
-        text = ""
-        if mime.startswith("image/"):
-            try:
-                from PIL import Image
-                import pytesseract
-                with Image.open(path) as im:
-                    text = pytesseract.image_to_string(im)
-            except Exception as e:
-                logger.warning(f"Image OCR failed: {e}")
-        elif mime == "application/pdf" or (path.lower().endswith('.pdf')):
-            try:
-                import pdfplumber
-                with pdfplumber.open(path) as pdf:
-                    pages = pdf.pages[:10]
-                    parts = []
-                    for p in pages:
-                        try:
-                            parts.append(p.extract_text() or "")
-                        except Exception:
-                            continue
-                    text = "\n".join([t for t in parts if t])
-            except Exception as e:
-                logger.warning(f"PDF text extraction failed: {e}")
-        elif mime.startswith("text/") or path.lower().endswith(('.txt', '.md', '.csv', '.log')):
-            try:
-                with open(path, 'r', encoding='utf-8', errors='ignore') as f:
-                    text = f.read(200000)
-            except Exception as e:
-                logger.warning(f"Text read failed: {e}")
-        return (text or "").strip()
-    except Exception as e:
-        logger.error(f"Attachment OCR error: {e}")
-        return ""
-
-def _store_gridfs_and_ocr(upload: UploadFile, chat_id: str) -> dict:
-    if fs is None or attachments_col is None:
-        raise RuntimeError("Attachments storage not initialized")
-    fname = upload.filename or f"file-{uuid.uuid4()}"
-    mime = _safe_mime(fname, upload.content_type)
-    size = 0
-    # Save to GridFS
-    gridfs_id = None
-    tmp_path = None
-    try:
-        with tempfile.NamedTemporaryFile(delete=False) as tmp:
-            tmp_path = tmp.name
-            while True:
-                chunk = upload.file.read(1024 * 1024)
-                if not chunk:
-                    break
-                tmp.write(chunk)
-                size += len(chunk)
-        # Write from temp to GridFS stream
-        with open(tmp_path, 'rb') as f:
-            gridfs_id = fs.put(f, filename=fname, content_type=mime, metadata={"chat_id": chat_id, "size": size})
-        # OCR
-        ocr_text = _extract_text_from_path(tmp_path, mime)
-        meta_doc = {
-            "_id": gridfs_id,
-            "chat_id": chat_id,
-            "filename": fname,
-            "mime": mime,
-            "size": size,
-            "ocr_text": (ocr_text[:200000] if ocr_text else ""),
-            "createdAt": datetime.datetime.utcnow(),
-        }
-        attachments_col.replace_one({"_id": gridfs_id}, meta_doc, upsert=True)
-        return {
-            "id": str(gridfs_id),
-            "name": fname,
-            "mime": mime,
-            "size": size,
-        }
-    finally:
-        try:
-            if tmp_path and os.path.exists(tmp_path):
-                os.unlink(tmp_path)
-        except Exception:
-            pass
-
-def _get_attachment_snippets(chat_id: str, ids: list = None, limit: int = 3) -> str:
-    try:
-        if attachments_col is None:
-            return ""
-        q = {"chat_id": chat_id}
-        if ids:
-            try:
-                q["_id"] = {"$in": [ObjectId(i) for i in ids if i]}
-            except Exception:
-                pass
-        docs = list(attachments_col.find(q).sort("createdAt", -1).limit(limit))
-        parts = []
-        for d in docs:
-            name = d.get("filename")
-            mime = d.get("mime")
-            txt = (d.get("ocr_text") or "").strip()
-            if txt:
-                snippet = txt[:600]
-                parts.append(f"- {name} ({mime}):\n{snippet}")
-        if parts:
-            return "Attachment context:\n" + "\n\n".join(parts)
-        return ""
-    except Exception as e:
-        logger.error(f"Failed to build attachment snippets: {e}")
-        return ""
-
-import os
+import asyncio
+import time
 import uuid
-import datetime
-import tempfile
-import io
-import mimetypes
+from contextlib import asynccontextmanager
 from typing import List, Optional
 from fastapi import FastAPI, Request, UploadFile, File, Form
-from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse
+from fastapi.responses import JSONResponse, HTMLResponse, StreamingResponse, PlainTextResponse, Response
 from fastapi.staticfiles import StaticFiles
 from fastapi.templating import Jinja2Templates
 from utils.logger import logger
 from config import settings
 from database.db_manager import DatabaseManager
-from agents.router_agent import route_query
-from agents.summarizer_agent import summarize_output
+from database.attachment_store import create_attachment_store, safe_mime
+from database.ocr_queue import ocr_queue
+from database.pdf_extract import page_refs
+from database.chat_store import ChatStore, DEFAULT_TITLES, LIST_KEY, chat_key
+from database.write_behind import WriteBehind
+from database.versions import make_etag
+from agents.router_agent import route_query, route_query_stream
+from researchers.main_researcher import FALLBACK_ANSWER
+from agents.summarizer_agent import summarize_output, get_summarizer_stats
 from agents.critic_agent import provide_feedback
-from agents.feedback_manager import save_feedback
+from agents.critic_queue import critic_queue
+from agents.title_queue import title_queue, heuristic_title_from_text
+from agents.feedback_manager import (make_feedback_entry, save_feedback_entries, apply_feedback_guidance,
+                                     migrate_feedback_json)
+from database.feedback_log import feedback_log
+from database.feedback_stats import FeedbackStats, feedback_event, score_event
+from llms.providers import get_provider
+from utils.concurrency import run_llm, run_io, stream_llm, shutdown_executors
+from utils.response_cache import response_cache
+from utils.semantic_cache import semantic_cache
+from utils.session_store import session_store
+from utils.singleflight import SingleFlight
+from utils.metrics import metrics, MetricsMiddleware
 import json
 
-app = FastAPI(title="Customer Support AI Chatbot")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Extractions a stopped worker left unfinished; runs in the background
+    asyncio.create_task(_requeue_stale_ocr())
+    yield
+    if semantic_cache is not None:
+        semantic_cache.flush()
+    critic_queue.shutdown()
+    title_queue.shutdown()
+    ocr_queue.shutdown()
+    # Commit everything still queued before the storage pool goes away
+    writes.close()
+    shutdown_executors(wait=True)
+    metrics.write_snapshot()
+
+
+app = FastAPI(title="Customer Support AI Chatbot", lifespan=lifespan)
+if metrics.enabled:
+    app.add_middleware(MetricsMiddleware, registry=metrics)
 
 # Serve static files and templates
 app.mount("/static", StaticFiles(directory="frontend/static"), name="static")
 templates = Jinja2Templates(directory="frontend/templates")
 
-# Session storage for conversation history (in production, use Redis/DB)
-conversations = {}
-
-# Initialize Mongo/GridFS here (after imports and possibly settings/logger are loaded)
-try:
-    if 'settings' in globals():
-        import pymongo
-        import gridfs
-        from bson import ObjectId  # noqa: F401
-        mongo_client = pymongo.MongoClient(settings.MONGODB_URI)
-        mongo_db = mongo_client[settings.MONGO_DB_NAME]
-        fs = gridfs.GridFS(mongo_db)
-        attachments_col = mongo_db.get_collection("attachments_meta")
-except Exception as e:
+# Session history (last SESSION_MAX_TURNS exchanges) lives in utils.session_store
+
+# Coalesces identical in-flight pipeline runs (same answer key) within this worker
+pipeline_flights = SingleFlight()
+
+# Attachment storage (GridFS by default; ATTACHMENT_BACKEND=memory for local runs)
+attachments = create_attachment_store()
+
+async def _requeue_stale_ocr() -> None:
+    try:
+        await run_io(attachments.requeue_stale)
+    except Exception as e:
+        logger.error(f"Failed to requeue attachment extractions: {e}")
+
+
+async def _wait_for_attachment_text(chat_id: str, attachment_ids: list, deadline: float = None,
+                                    page_jobs: bool = True) -> None:
+    """
+    Give extractions of the attachments this query references up to OCR_QUERY_WAIT_MS;
+    whatever text is ready then is used. page_jobs=False ignores later PDF pages being
+    extracted in the background.
+    """
+    if deadline is None:
+        deadline = time.monotonic() + settings.OCR_QUERY_WAIT_MS / 1000.0
+    while await run_io(attachments.pending_count, chat_id, attachment_ids, page_jobs):
+        if time.monotonic() >= deadline:
+            logger.info("Answering before attachment text extraction finished")
+            return
+        await asyncio.sleep(settings.OCR_POLL_MS / 1000.0)
+
+
+def _get_attachment_snippets(chat_id: str, ids: list = None, limit: int = 3, query: str = "") -> str:
     try:
-        if 'logger' in globals():
-            logger.error(f"Mongo/GridFS init failed (deferred): {e}")
-    except Exception:
-        pass
+        with metrics.track("attachment_snippets"):
+            return attachments.snippets(chat_id, ids, limit, query)
+    except Exception as e:
+        logger.error(f"Failed to build attachment snippets: {e}")
+        return ""
 
 # Database manager for persistent history
 db = DatabaseManager()
 
-CHATS_FILE = "chats_data.json"
-
-def _load_chats() -> list:
+# Chats, messages and per-chat feedback (SQL tables; the legacy JSON file is imported once)
+chat_store = ChatStore()
+chat_store.import_json_once(settings.CHATS_FILE)
+
+# Feedback goes to an append-only JSONL log; the legacy JSON array is imported once
+migrate_feedback_json()
+
+# Running like/dislike and critic-score aggregates for /api/feedback/stats
+feedback_stats = FeedbackStats()
+
+# Write-behind persistence (WRITE_MODE=sync|batched|async); kinds flush in this order
+writes = WriteBehind()
+writes.register("chat_exchange", chat_store.append_exchanges)
+writes.register("chat_title", chat_store.set_titles)
+writes.register("chat_title_upgrade", chat_store.upgrade_titles)
+writes.register("message_critique", chat_store.set_message_critiques)
+writes.register("chat_feedback", chat_store.add_feedback_many)
+writes.register("conversation", db.add_conversations)
+writes.register("feedback_log", save_feedback_entries)
+writes.register("feedback_stats", feedback_stats.record_many)
+
+
+async def _persist_chat_exchange(chat_id: Optional[str], query: str, summary: str, message_id: str = None) -> str:
+    # If chat_id is missing, start a new chat; the write queue creates it on first append
+    chat_id = chat_id or str(uuid.uuid4())
+    title = await run_io(chat_store.get_title, chat_id)
+    needs_title = title is None or title.strip().lower() in DEFAULT_TITLES
+    await writes.submit("chat_exchange", (chat_id, query, summary, message_id))
+    # Auto-title if still default: a heuristic title now, the LLM title from a background batch
+    if needs_title:
+        heuristic = heuristic_title_from_text(query)
+        await writes.submit("chat_title", (chat_id, heuristic))
+        title_queue.submit(chat_id, query, summary, heuristic,
+                           lambda cid, old, new: writes.put("chat_title_upgrade", (cid, old, new)))
+    return chat_id
+
+
+async def _chat_guidance(chat_id: Optional[str]) -> Optional[str]:
+    """
+    Stored guidance for this chat (maintained on /feedback); None when there is none
+    """
+    if not chat_id:
+        return None
     try:
-        if os.path.exists(CHATS_FILE):
-            with open(CHATS_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-                if isinstance(data, list):
-                    return data
-        return []
-    except Exception:
-        return []
-
-def _save_chats(chats: list) -> None:
+        return await run_io(chat_store.get_guidance, chat_id)
+    except Exception as e:
+        # Non-fatal; proceed without guidance
+        logger.warning(f"Failed to load feedback guidance for chat {chat_id}: {e}")
+        return None
+
+
+async def _prepare_guided_query(query: str, chat_id: Optional[str], attachment_ids: list) -> tuple:
+    """
+    Decorate the user's query with recent dislike guidance and attachment context for this chat.
+    Returns (guided_query, guidance, complete); complete is False when some referenced
+    attachment text was not extracted yet, so the answer must not be cached.
+    """
+    # Precomputed guidance from recent dislikes in this chat
+    guidance = await _chat_guidance(chat_id)
+    guided_query = apply_feedback_guidance(query, guidance)
+    complete = True
+
+    # Inject attachment context if available
     try:
-        with open(CHATS_FILE, "w", encoding="utf-8") as f:
-            json.dump(chats, f, ensure_ascii=False, indent=2)
-    except Exception:
-        pass
+        if chat_id:
+            if attachment_ids:
+                # PDF pages past the eager ones that this question refers to or needs. Pages
+                # are only queued once the upload's eager pages are in, so check again after
+                # waiting for them. Only pages the question names are waited for; the next
+                # pages after a term miss are extracted in the background for later questions.
+                deadline = time.monotonic() + settings.OCR_QUERY_WAIT_MS / 1000.0
+                named = bool(page_refs(query))
+                queued = await run_io(attachments.ensure_pages, chat_id, attachment_ids, query)
+                if settings.OCR_QUERY_WAIT_MS > 0:
+                    pending = await run_io(attachments.pending_count, chat_id, attachment_ids, named)
+                    if pending:
+                        await _wait_for_attachment_text(chat_id, attachment_ids, deadline, named)
+                        if (not queued and await run_io(attachments.ensure_pages, chat_id, attachment_ids, query)
+                                and named):
+                            await _wait_for_attachment_text(chat_id, attachment_ids, deadline)
+                complete = not await run_io(attachments.pending_count, chat_id, attachment_ids)
+            actx = await run_io(_get_attachment_snippets, chat_id, attachment_ids, limit=3, query=query)
+            if actx:
+                guided_query = f"{actx}\n\n{guided_query}"
+    except Exception as _e:
+        complete = not attachment_ids
+    return guided_query, guidance, complete
 
 
 @app.get("/", response_class=HTMLResponse)
@@ -236,8 +197,136 @@ async def home(request: Request):
     return templates.TemplateResponse("index_modern.html", {"request": request})
 
 
+async def _record_exchange(session_id: str, chat_id: Optional[str], query: str, summary: str,
+                           message_id: str = None) -> Optional[str]:
+    """
+    Store a finished exchange in session history, the DB and the chats store; returns the chat id
+    """
+    # A missing chat_id starts a new chat; the id is also recorded on the conversation row
+    chat_id = chat_id or str(uuid.uuid4())
+
+    # Update session history (the store keeps only the last exchanges)
+    await run_io(session_store.append, session_id, query, summary)
+
+    # Persist to database
+    try:
+        with metrics.track("db_add_conversation"):
+            await writes.submit("conversation", (query, summary, chat_id, session_id, message_id))
+    except Exception as db_err:
+        logger.error(f"Failed to persist conversation: {db_err}")
+
+    # Persist to the chat store if chat_id is provided (or create a new one implicitly)
+    try:
+        chat_id = await _persist_chat_exchange(chat_id, query, summary, message_id)
+    except Exception as e:
+        logger.error(f"Error updating chats store: {e}")
+    return chat_id
+
+
+async def _critique(message_id: str, summary: str, query: str, persist: bool = True,
+                    cache_key: str = None, chat_id: str = None) -> tuple:
+    """
+    Run the critic according to CRITIC_MODE; returns (feedback, status).
+    In background mode feedback is empty and the critique is fetched later via /api/critique.
+    """
+    mode = settings.CRITIC_MODE
+    if mode == "off":
+        return "", "skipped"
+    if mode == "inline":
+        if not critic_queue.should_sample():
+            return "", "skipped"
+        # Identical concurrent answers share one critic call
+        with metrics.track("critic"):
+            critic_result = await pipeline_flights.do(
+                ("critic", cache_key) if cache_key else None,
+                lambda: run_llm(provide_feedback, summary, query),
+            )
+        feedback = critic_result.get("feedback", "")
+        if cache_key:
+            await run_io(response_cache.update, cache_key, feedback=feedback)
+        await _submit_score(feedback, query, chat_id)
+        return feedback, "done"
+
+    def on_done(mid, fb):
+        if persist:
+            writes.put("message_critique", (mid, fb))
+        _record_score(fb, query, chat_id)
+        if cache_key:
+            response_cache.update(cache_key, feedback=fb)
+
+    return "", critic_queue.submit(message_id, summary, query, on_done=on_done, key=cache_key)
+
+
+def _record_score(feedback: str, query: str, chat_id: Optional[str]) -> None:
+    # Critiques without a "Score: X/5" line leave the aggregates untouched
+    try:
+        event = score_event(feedback, query, chat_id)
+        if event:
+            writes.put("feedback_stats", event)
+    except Exception as e:
+        logger.error(f"Failed to record critic score: {e}")
+
+
+async def _submit_score(feedback: str, query: str, chat_id: Optional[str]) -> None:
+    # Inline critiques run on the event loop; writes.put could commit or wait for room there
+    try:
+        event = score_event(feedback, query, chat_id)
+        if event:
+            await writes.submit("feedback_stats", event)
+    except Exception as e:
+        logger.error(f"Failed to record critic score: {e}")
+
+
+def _cache_key_for(query: str, history: list, attachment_ids: list, guidance: Optional[str]) -> str:
+    # Identifies "the same answer": used for caching, request coalescing and critic dedupe
+    return response_cache.make_key(query, history, attachment_ids, guidance)
+
+
+def _cache_scope_for(history: list, attachment_ids: list, guidance: Optional[str]) -> str:
+    # Everything except the query text: semantic matches must share this context
+    return response_cache.make_key("", history, attachment_ids, guidance)
+
+
+async def _cached_answer(cache_key: Optional[str], query: str = "", scope: str = ""):
+    """
+    Exact-match cache first, then the semantic cache; returns the cached value or None
+    """
+    try:
+        if cache_key and settings.RESPONSE_CACHE_ENABLED:
+            cached = await run_io(response_cache.get, cache_key)
+            metrics.inc("supportai_cache_requests_total", cache="exact", result="hit" if cached else "miss")
+            if cached:
+                return cached
+        if semantic_cache is not None:
+            found = await run_io(semantic_cache.lookup, query, scope)
+            metrics.inc("supportai_cache_requests_total", cache="semantic", result="hit" if found else "miss")
+            if found:
+                value, score = found
+                logger.info(f"Semantic cache hit (similarity {score:.3f})")
+                return value
+    except Exception as e:
+        logger.warning(f"Response cache lookup failed: {e}")
+    return None
+
+
+async def _cache_answer(cache_key: Optional[str], query: str, scope: str, summary: str) -> None:
+    try:
+        if cache_key and settings.RESPONSE_CACHE_ENABLED:
+            await run_io(response_cache.set, cache_key, {"summary": summary})
+        if semantic_cache is not None:
+            await run_io(semantic_cache.add, query, scope, {"summary": summary})
+    except Exception as e:
+        logger.warning(f"Response cache store failed: {e}")
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 @app.post("/query")
 async def handle_query(request: Request):
+    if "text/event-stream" in (request.headers.get("accept") or ""):
+        return await handle_query_stream(request)
     try:
         logger.info("Handling query")
         data = await request.json()
@@ -249,107 +338,53 @@ async def handle_query(request: Request):
         if not query.strip():
             return JSONResponse({"summary": "", "feedback": "Empty query"}, status_code=400)
 
-        # Get conversation history (in-memory)
-        history = conversations.get(session_id, [])
-
-        # Load recent negative feedback for this chat to guide the next answer
-        guided_query = query
-        try:
-            if chat_id:
-                chats = _load_chats()
-                for c in chats:
-                    if c.get("id") == chat_id:
-                        fbs = list(reversed(c.get("feedback", [])))[:5]
-                        dislikes = [f for f in fbs if (f.get("rating") == "dislike")]
-                        if dislikes:
-                            parts = []
-                            for i, f in enumerate(dislikes[:3], 1):
-                                fb_txt = (f.get("feedback") or "").strip()
-                                msg = (f.get("message") or "").strip()
-                                if msg:
-                                    msg = (msg[:220] + "…") if len(msg) > 220 else msg
-                                if fb_txt:
-                                    parts.append(f"{i}. {fb_txt}{' | reference: ' + msg if msg else ''}")
-                                elif msg:
-                                    parts.append(f"{i}. Avoid issues like: {msg}")
-                            if parts:
-                                guidance = "\n".join(parts)
-                                guided_query = (
-                                    f"{query}\n\nUser feedback to consider in this chat (address these concerns explicitly and avoid repeating mistakes):\n{guidance}"
-                                )
-                        break
-        except Exception:
-            # Non-fatal; proceed without guidance
-            guided_query = query
+        # Get conversation history
+        history = await run_io(session_store.get, session_id)
 
-        # Inject attachment context if available
-        try:
-            if chat_id:
-                actx = _get_attachment_snippets(chat_id, attachment_ids, limit=3)
-                if actx:
-                    guided_query = f"{actx}\n\n{guided_query}"
-        except Exception as _e:
-            pass
+        guided_query, guidance, cacheable = await _prepare_guided_query(query, chat_id, attachment_ids)
 
-        # Route to universal researcher
-        routed = route_query(guided_query, history)
-
-        # Summarize
-        summary = summarize_output(routed)
-
-        # Get critic feedback
-        critic_result = provide_feedback(summary, query)
-        feedback = critic_result.get("feedback", "")
-
-        # Update in-memory conversation history
-        if session_id not in conversations:
-            conversations[session_id] = []
-        conversations[session_id].append({"user": query, "bot": summary})
-
-        # Keep only last 10 exchanges
-        if len(conversations[session_id]) > 10:
-            conversations[session_id] = conversations[session_id][-10:]
-
-        # Persist to database
-        try:
-            db.add_conversation(query, summary)
-        except Exception as db_err:
-            logger.error(f"Failed to persist conversation: {db_err}")
-
-        # Persist to chats JSON if chat_id is provided (or create a new one implicitly)
-        try:
-            chats = _load_chats()
-            target = None
-            if chat_id:
-                for c in chats:
-                    if c.get("id") == chat_id:
-                        target = c
-                        break
-            if not target:
-                # If chat_id missing or not found, create a new chat
-                new_id = str(uuid.uuid4())
-                now = datetime.datetime.utcnow().isoformat()
-                target = {"id": new_id, "title": "New Chat", "createdAt": now, "messages": [], "feedback": []}
-                chats.insert(0, target)
-                chat_id = new_id
-            # Ensure keys
-            target.setdefault("messages", [])
-            target.setdefault("feedback", [])
-            # Append messages (store original query)
-            target["messages"].append({"role": "user", "content": query})
-            target["messages"].append({"role": "assistant", "content": summary})
-            # Auto-title if still default
-            title = (target.get("title") or "").strip()
-            if title.lower() in ("new chat", "", "untitled") and len(target["messages"]) >= 2:
-                new_title = _generate_chat_title(query, summary)
-                if new_title:
-                    target["title"] = new_title
-            _save_chats(chats)
-        except Exception as e:
-            logger.error(f"Error updating chats store: {e}")
+        cache_key = _cache_key_for(query, history, attachment_ids, guidance)
+        cache_scope = _cache_scope_for(history, attachment_ids, guidance)
+        cached = await _cached_answer(cache_key, query, cache_scope)
+        if cached:
+            summary = cached.get("summary", "")
+        else:
+            async def run_pipeline():
+                # Route to universal researcher
+                with metrics.track("researcher"):
+                    routed = await run_llm(route_query, guided_query, history)
+
+                # Summarize
+                with metrics.track("summarizer"):
+                    result = await run_llm(summarize_output, routed)
+
+                # An answer built before its attachments' text was ready is not cached
+                if routed.get("status") == "success" and result and cacheable:
+                    await _cache_answer(cache_key, query, cache_scope, result)
+                return result
+
+            # Concurrent identical queries await one shared pipeline run
+            summary = await pipeline_flights.do(cache_key, run_pipeline)
+
+        message_id = str(uuid.uuid4())
+        chat_id = await _record_exchange(session_id, chat_id, query, summary, message_id)
+
+        # Critic runs after persistence so a background critique can attach to the stored message
+        if cached and cached.get("feedback"):
+            feedback, critique_status = cached["feedback"], "cached"
+            await writes.submit("message_critique", (message_id, feedback))
+        else:
+            feedback, critique_status = await _critique(message_id, summary, query,
+                                                        cache_key=cache_key if cacheable else None, chat_id=chat_id)
 
         logger.info("Query handled successfully")
-        return JSONResponse({"summary": summary, "feedback": feedback, "chat_id": chat_id})
+        return JSONResponse({
+            "summary": summary,
+            "feedback": feedback,
+            "chat_id": chat_id,
+            "message_id": message_id,
+            "critique": critique_status,
+        })
 
     except Exception as e:
         logger.error(f"Error handling /query request: {e}", exc_info=True)
@@ -359,6 +394,110 @@ async def handle_query(request: Request):
         )
 
 
+@app.post("/query/stream")
+async def handle_query_stream(request: Request):
+    """
+    Server-sent-event variant of /query: streams researcher tokens as Gemini produces them,
+    then the formatted answer, then a final event with the chat id
+    """
+    try:
+        data = await request.json()
+    except Exception as e:
+        logger.warning(f"Invalid JSON in /query/stream request: {e}")
+        data = None
+    if not isinstance(data, dict):
+        return JSONResponse({"summary": "", "feedback": "Invalid JSON"}, status_code=400)
+    query = data.get("query", "")
+    session_id = data.get("session_id", "default")
+    chat_id = data.get("chat_id")
+    attachment_ids = data.get("attachments") or []
+
+    if not query.strip():
+        return JSONResponse({"summary": "", "feedback": "Empty query"}, status_code=400)
+
+    async def events():
+        try:
+            logger.info("Handling streamed query")
+            history = await run_io(session_store.get, session_id)
+            guided_query, guidance, cacheable = await _prepare_guided_query(query, chat_id, attachment_ids)
+
+            cache_key = _cache_key_for(query, history, attachment_ids, guidance)
+            cache_scope = _cache_scope_for(history, attachment_ids, guidance)
+            cached = await _cached_answer(cache_key, query, cache_scope)
+            leader = False
+            if cached:
+                summary = cached.get("summary", "")
+                yield _sse("stage", {"stage": "cached"})
+            else:
+                coalesced = False
+                while True:
+                    flight, leader = pipeline_flights.begin(cache_key)
+                    if leader:
+                        break
+                    # An identical query is already running; share its answer, or run it here
+                    # when that run was cancelled (e.g. its streaming client disconnected)
+                    if not coalesced:
+                        coalesced = True
+                        yield _sse("stage", {"stage": "coalesced"})
+                    found, summary = await pipeline_flights.follow(flight)
+                    if found:
+                        break
+            if leader:
+                try:
+                    yield _sse("stage", {"stage": "researching"})
+                    chunks = []
+                    # A provider failure after some tokens raises here: the partial text is not
+                    # an answer, so it is not summarized, cached, recorded or shared with followers
+                    with metrics.track("researcher"):
+                        async for chunk in stream_llm(route_query_stream, guided_query, history):
+                            chunks.append(chunk)
+                            yield _sse("token", {"text": chunk})
+                    answer = "".join(chunks).strip()
+                    routed = {
+                        "response": answer,
+                        "query": guided_query,
+                        "status": "error" if answer == FALLBACK_ANSWER else "success",
+                    }
+
+                    yield _sse("stage", {"stage": "formatting"})
+                    with metrics.track("summarizer"):
+                        summary = await run_llm(summarize_output, routed)
+                    if routed["status"] == "success" and summary and cacheable:
+                        await _cache_answer(cache_key, query, cache_scope, summary)
+                except BaseException as e:
+                    pipeline_flights.finish(cache_key, flight, error=e)
+                    raise
+                pipeline_flights.finish(cache_key, flight, result=summary)
+            yield _sse("answer", {"summary": summary})
+
+            # Persist only once the answer is complete
+            message_id = str(uuid.uuid4())
+            final_chat_id = await _record_exchange(session_id, chat_id, query, summary, message_id)
+            if cached and cached.get("feedback"):
+                feedback, critique_status = cached["feedback"], "cached"
+                await writes.submit("message_critique", (message_id, feedback))
+            else:
+                feedback, critique_status = await _critique(message_id, summary, query,
+                                                            cache_key=cache_key if cacheable else None,
+                                                            chat_id=final_chat_id)
+            yield _sse("done", {
+                "stage": "done",
+                "chat_id": final_chat_id,
+                "message_id": message_id,
+                "feedback": feedback,
+                "critique": critique_status,
+            })
+            logger.info("Streamed query handled successfully")
+        except Exception as e:
+            logger.error(f"Error handling /query/stream request: {e}", exc_info=True)
+            yield _sse("error", {"detail": "I encountered an error. Please try again."})
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
+
+
 @app.post("/feedback")
 async def handle_feedback(request: Request):
     try:
@@ -370,23 +509,32 @@ async def handle_feedback(request: Request):
         query = data.get("query", "")
         chat_id = data.get("chat_id")
 
-        success = save_feedback(feedback_text, query, message)
+        try:
+            await writes.submit("feedback_log", make_feedback_entry(feedback_text, query, message))
+            success = True
+        except Exception as e:
+            logger.error(f"Error saving feedback: {e}")
+            success = False
+
+        # A disliked answer must not be served again from cache
+        if rating == "dislike" and message:
+            try:
+                await run_io(response_cache.invalidate_answer, message)
+                if semantic_cache is not None:
+                    await run_io(semantic_cache.invalidate_answer, message)
+            except Exception as e:
+                logger.error(f"Failed to invalidate cached answer: {e}")
+
+        # Running aggregates for /api/feedback/stats
+        try:
+            await writes.submit("feedback_stats", feedback_event(rating, query, message, chat_id))
+        except Exception as e:
+            logger.error(f"Failed to update feedback stats: {e}")
 
-        # Also persist into chats JSON for per-chat learning context
+        # Also persist into the chat store for per-chat learning context
         try:
             if chat_id:
-                chats = _load_chats()
-                for c in chats:
-                    if c.get("id") == chat_id:
-                        fb_list = c.setdefault("feedback", [])
-                        fb_list.append({
-                            "rating": rating or "",
-                            "feedback": feedback_text,
-                            "message": message,
-                            "createdAt": datetime.datetime.utcnow().isoformat(),
-                        })
-                        _save_chats(chats)
-                        break
+                await writes.submit("chat_feedback", (chat_id, rating, feedback_text, message))
         except Exception as e:
             logger.error(f"Failed to persist feedback to chat store: {e}")
 
@@ -400,10 +548,37 @@ async def handle_feedback(request: Request):
         return JSONResponse({"status": "error"}, status_code=500)
 
 
+def _page_size(limit: Optional[int], default: int) -> int:
+    return max(1, min(limit or default, settings.PAGE_MAX))
+
+
+# Browsers may keep these responses but must revalidate them (If-None-Match) before reuse
+REVALIDATE_HEADERS = {"Cache-Control": "no-cache"}
+
+
+def _etag_matches(request: Request, etag: str) -> bool:
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = {t.strip() for t in header.split(",")}
+    return "*" in tags or etag in tags or f"W/{etag}" in tags
+
+
+def _not_modified(etag: str) -> Response:
+    return Response(status_code=304, headers={"ETag": etag, **REVALIDATE_HEADERS})
+
+
 @app.get("/api/history")
-async def get_history():
+async def get_history(request: Request, limit: Optional[int] = None, before: Optional[int] = None):
     try:
-        records = db.get_history(limit=20)
+        size = _page_size(limit, settings.HISTORY_PAGE_SIZE)
+        # The version counter is read first: a write landing meanwhile just costs one extra fetch later
+        etag = make_etag(await run_io(db.get_versions), "history", size, before)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        # One extra row tells whether an older page exists
+        records = await db.get_history_async(size + 1, before)
+        next_cursor = records[size - 1].id if len(records) > size else None
         history = [
             {
                 "id": r.id,
@@ -411,13 +586,12 @@ async def get_history():
                 "bot_response": r.bot_response,
                 "timestamp": r.timestamp.isoformat() if getattr(r, "timestamp", None) else None,
             }
-            for r in records
+            for r in records[:size]
         ][::-1]
-        return JSONResponse({"history": history}, headers={
-            "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
-            "Pragma": "no-cache",
-            "Expires": "0"
-        })
+        headers = {"ETag": etag, **REVALIDATE_HEADERS}
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = str(next_cursor)
+        return JSONResponse({"history": history, "next_cursor": next_cursor}, headers=headers)
     except Exception as e:
         logger.error(f"Error fetching history: {e}")
         return JSONResponse({"history": []}, status_code=500)
@@ -426,7 +600,7 @@ async def get_history():
 @app.delete("/api/history/{item_id}")
 async def delete_history_item(item_id: int):
     try:
-        ok = db.delete_conversation(item_id)
+        ok = await db.delete_conversation_async(item_id)
         status = 200 if ok else 404
         return JSONResponse({"deleted": ok}, status_code=status, headers={
             "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
@@ -441,7 +615,7 @@ async def delete_history_item(item_id: int):
 @app.delete("/api/history")
 async def clear_history():
     try:
-        count = db.clear_history()
+        count = await db.clear_history_async()
         return JSONResponse({"cleared": True, "count": count}, headers={
             "Cache-Control": "no-store, no-cache, must-revalidate, max-age=0",
             "Pragma": "no-cache",
@@ -462,20 +636,16 @@ async def resummarize(request: Request):
         if not query:
             return JSONResponse({"summary": "", "feedback": "Empty query"}, status_code=400)
 
-        # Try to find the most recent bot response for this query from DB
+        # The answer being resummarized: by message id, else the latest answer to this query (indexed)
         base_response = None
         try:
-            records = db.get_history(limit=50)
-            for r in records:
-                if (r.user_query or "").strip() == query:
-                    base_response = r.bot_response
-                    break
+            base_response = await run_io(db.find_response, query, data.get("message_id"), chat_id, session_id)
         except Exception as db_err:
             logger.error(f"Failed loading history for resummarize: {db_err}")
 
-        # Fallback to in-memory conversation
+        # Fallback to session history
         if not base_response:
-            history = conversations.get(session_id, [])
+            history = await run_io(session_store.get, session_id)
             for h in reversed(history):
                 if h.get("user") == query:
                     base_response = h.get("bot")
@@ -484,53 +654,34 @@ async def resummarize(request: Request):
         if not base_response:
             return JSONResponse({"summary": "", "feedback": "No prior response found to resummarize."}, status_code=404)
 
-        # Build guidance from recent dislikes for this chat
-        guidance = None
-        try:
-            if chat_id:
-                chats = _load_chats()
-                for c in chats:
-                    if c.get("id") == chat_id:
-                        fbs = list(reversed(c.get("feedback", [])))[:5]
-                        dislikes = [f for f in fbs if (f.get("rating") == "dislike")]
-                        if dislikes:
-                            parts = []
-                            for i, f in enumerate(dislikes[:3], 1):
-                                fb_txt = (f.get("feedback") or "").strip()
-                                msg = (f.get("message") or "").strip()
-                                if msg:
-                                    msg = (msg[:220] + "…") if len(msg) > 220 else msg
-                                if fb_txt:
-                                    parts.append(f"{i}. {fb_txt}{' | reference: ' + msg if msg else ''}")
-                                elif msg:
-                                    parts.append(f"{i}. Avoid issues like: {msg}")
-                            if parts:
-                                guidance = "\n".join(parts)
-                        break
-        except Exception:
-            guidance = None
+        # Guidance from recent dislikes for this chat
+        guidance = await _chat_guidance(chat_id)
 
         # Re-run summarizer on the last response with resummarize flag and optional guidance
         payload = {"response": base_response, "resummarize": True}
         if guidance:
             payload["feedback_guidance"] = guidance
             payload["query"] = query
-        summary = summarize_output(payload)
-        critic_result = provide_feedback(summary, query)
-        feedback = critic_result.get("feedback", "")
+        with metrics.track("summarizer"):
+            summary = await run_llm(summarize_output, payload)
+        message_id = str(uuid.uuid4())
+        feedback, critique_status = await _critique(message_id, summary, query, persist=False, chat_id=chat_id)
 
         # Persist as a new conversation entry
         try:
-            db.add_conversation(query, summary)
+            await writes.submit("conversation", (query, summary, chat_id, session_id, message_id))
         except Exception as db_err:
             logger.error(f"Failed to persist resummarized conversation: {db_err}")
 
-        # Update in-memory history as well
-        conversations.setdefault(session_id, []).append({"user": query, "bot": summary})
-        if len(conversations[session_id]) > 10:
-            conversations[session_id] = conversations[session_id][-10:]
+        # Update session history as well
+        await run_io(session_store.append, session_id, query, summary)
 
-        return JSONResponse({"summary": summary, "feedback": feedback})
+        return JSONResponse({
+            "summary": summary,
+            "feedback": feedback,
+            "message_id": message_id,
+            "critique": critique_status,
+        })
 
     except Exception as e:
         logger.error(f"Error in /resummarize: {e}")
@@ -547,94 +698,147 @@ async def reresearch(request: Request):
         if not query:
             return JSONResponse({"summary": "", "feedback": "Empty query"}, status_code=400)
 
-        history = conversations.get(session_id, [])
+        history = await run_io(session_store.get, session_id)
 
         # Build guided query from recent dislikes
-        guided_query = query
-        try:
-            if chat_id:
-                chats = _load_chats()
-                for c in chats:
-                    if c.get("id") == chat_id:
-                        fbs = list(reversed(c.get("feedback", [])))[:5]
-                        dislikes = [f for f in fbs if (f.get("rating") == "dislike")]
-                        if dislikes:
-                            parts = []
-                            for i, f in enumerate(dislikes[:3], 1):
-                                fb_txt = (f.get("feedback") or "").strip()
-                                msg = (f.get("message") or "").strip()
-                                if msg:
-                                    msg = (msg[:220] + "…") if len(msg) > 220 else msg
-                                if fb_txt:
-                                    parts.append(f"{i}. {fb_txt}{' | reference: ' + msg if msg else ''}")
-                                elif msg:
-                                    parts.append(f"{i}. Avoid issues like: {msg}")
-                            if parts:
-                                guidance = "\n".join(parts)
-                                guided_query = (
-                                    f"{query}\n\nUser feedback to consider in this chat (address these concerns explicitly and avoid repeating mistakes):\n{guidance}"
-                                )
-                        break
-        except Exception:
-            guided_query = query
+        guided_query = apply_feedback_guidance(query, await _chat_guidance(chat_id))
 
         # Re-run the full pipeline to generate a fresh answer
-        routed = route_query(guided_query, history)
+        with metrics.track("researcher"):
+            routed = await run_llm(route_query, guided_query, history)
         # Mark as resummarize to encourage alternate phrasing/style in summarizer
         try:
             routed["resummarize"] = True
         except Exception:
             pass
-        summary = summarize_output(routed)
-        critic_result = provide_feedback(summary, query)
-        feedback = critic_result.get("feedback", "")
+        with metrics.track("summarizer"):
+            summary = await run_llm(summarize_output, routed)
+        message_id = str(uuid.uuid4())
+        feedback, critique_status = await _critique(message_id, summary, query, persist=False, chat_id=chat_id)
 
         # Persist
         try:
-            db.add_conversation(query, summary)
+            await writes.submit("conversation", (query, summary, chat_id, session_id, message_id))
         except Exception as db_err:
             logger.error(f"Failed to persist reresearch conversation: {db_err}")
 
-        # Update in-memory history
-        conversations.setdefault(session_id, []).append({"user": query, "bot": summary})
-        if len(conversations[session_id]) > 10:
-            conversations[session_id] = conversations[session_id][-10:]
+        # Update session history
+        await run_io(session_store.append, session_id, query, summary)
 
-        return JSONResponse({"summary": summary, "feedback": feedback})
+        return JSONResponse({
+            "summary": summary,
+            "feedback": feedback,
+            "message_id": message_id,
+            "critique": critique_status,
+        })
 
     except Exception as e:
         logger.error(f"Error in /reresearch: {e}")
         return JSONResponse({"summary": "", "feedback": "Error while re-researching"}, status_code=500)
 
 
-# ----- Chat sidebar API (JSON store) -----
+@app.get("/api/critique/{message_id}")
+async def get_critique(message_id: str):
+    try:
+        entry = critic_queue.get(message_id)
+        if entry:
+            return JSONResponse({"message_id": message_id, **entry})
+        # Another worker may have produced it; fall back to the persisted copy
+        stored = await run_io(chat_store.find_message_critique, message_id)
+        if stored is not None:
+            return JSONResponse({"message_id": message_id, "status": "done", "feedback": stored})
+        return JSONResponse({"message_id": message_id, "status": "unknown", "feedback": ""}, status_code=404)
+    except Exception as e:
+        logger.error(f"Error fetching critique {message_id}: {e}")
+        return JSONResponse({"detail": "Server error"}, status_code=500)
+
+
+@app.get("/api/feedback/stats")
+async def get_feedback_stats(request: Request, windows: Optional[int] = None, chat_id: Optional[str] = None,
+                             topic: Optional[str] = None, top: Optional[int] = None):
+    """
+    Like/dislike rates, critic scores and disliked hot spots from the running aggregates;
+    windows= sets how many time buckets to return, chat_id= or topic= narrows the series
+    """
+    try:
+        now = time.time()
+        etag = make_etag(await run_io(feedback_stats.get_versions), "feedback_stats",
+                         feedback_stats.bucket_of(now), windows, chat_id, topic, top)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        stats = await run_io(feedback_stats.get_stats, windows, chat_id, topic, top, now)
+        return JSONResponse(stats, headers={"ETag": etag, **REVALIDATE_HEADERS})
+    except Exception as e:
+        logger.error(f"Error computing feedback stats: {e}")
+        return JSONResponse({"detail": "Server error"}, status_code=500)
+
+
+@app.get("/api/pipeline/stats")
+async def pipeline_stats():
+    return JSONResponse({
+        "summarizer": get_summarizer_stats(),
+        "llm": {"provider": get_provider().name, **get_provider().get_stats()},
+        "critic": dict(critic_queue.stats),
+        "titles": title_queue.get_stats(),
+        "coalescing": pipeline_flights.get_stats(),
+        "response_cache": response_cache.get_stats(),
+        "semantic_cache": semantic_cache.get_stats() if semantic_cache is not None else {"enabled": False},
+        "writes": writes.get_stats(),
+        "feedback_log": feedback_log.get_stats(),
+        "ocr": ocr_queue.get_stats(),
+        "sessions": session_store.get_stats(),
+    })
+
+
+@app.get("/metrics")
+async def get_metrics():
+    """
+    Prometheus text exposition; merges every worker's snapshot when METRICS_MULTIPROC_DIR is set
+    """
+    if not metrics.enabled:
+        return JSONResponse({"detail": "Metrics disabled"}, status_code=404)
+    try:
+        body = await run_io(metrics.render)
+        return PlainTextResponse(body, media_type="text/plain; version=0.0.4")
+    except Exception as e:
+        logger.error(f"Error rendering metrics: {e}")
+        return JSONResponse({"detail": "Server error"}, status_code=500)
+
+
+# ----- Chat sidebar API (chat store) -----
 @app.get("/api/chats")
-async def list_chats():
+async def list_chats(request: Request, limit: Optional[int] = None, before: Optional[int] = None):
     try:
-        chats = _load_chats()
-        # Return only summaries
-        summaries = [
-            {"id": c.get("id"), "title": c.get("title", "Untitled"), "createdAt": c.get("createdAt")}
-            for c in chats
-        ]
-        return JSONResponse(summaries)
+        size = _page_size(limit, settings.CHATS_PAGE_SIZE)
+        etag = make_etag(await run_io(chat_store.get_versions, LIST_KEY), LIST_KEY, size, before)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        # Return only summaries, newest first; the cursor for the next page goes in X-Next-Cursor
+        summaries, next_cursor = await run_io(chat_store.list_chats_page, size, before)
+        headers = {"ETag": etag, **REVALIDATE_HEADERS}
+        if next_cursor is not None:
+            headers["X-Next-Cursor"] = str(next_cursor)
+        return JSONResponse(summaries, headers=headers)
     except Exception as e:
         logger.error(f"Error listing chats: {e}")
         return JSONResponse([], status_code=500)
 
 
 @app.get("/api/chat/{chat_id}")
-async def get_chat(chat_id: str):
+async def get_chat(request: Request, chat_id: str, after: Optional[int] = None, limit: Optional[int] = None):
     try:
-        chats = _load_chats()
-        for c in chats:
-            if c.get("id") == chat_id:
-                return JSONResponse({
-                    "id": c.get("id"),
-                    "title": c.get("title", "Untitled"),
-                    "createdAt": c.get("createdAt"),
-                    "messages": c.get("messages", []),
-                })
+        # ?after=<message seq> returns only newer messages
+        size = _page_size(limit, settings.PAGE_MAX) if limit is not None else None
+        key = chat_key(chat_id)
+        etag = make_etag(await run_io(chat_store.get_versions, key), key, after, size)
+        if _etag_matches(request, etag):
+            return _not_modified(etag)
+        chat = await run_io(chat_store.get_chat, chat_id, after, size)
+        if chat:
+            headers = {"ETag": etag, **REVALIDATE_HEADERS}
+            if "next_after" in chat:
+                headers["X-Next-Cursor"] = str(chat["next_after"])
+            return JSONResponse(chat, headers=headers)
         return JSONResponse({"detail": "Not found"}, status_code=404)
     except Exception as e:
         logger.error(f"Error getting chat {chat_id}: {e}")
@@ -644,17 +848,8 @@ async def get_chat(chat_id: str):
 @app.post("/api/chat/new")
 async def new_chat():
     try:
-        chats = _load_chats()
-        new_id = str(uuid.uuid4())
-        now = datetime.datetime.utcnow().isoformat()
-        chat = {
-            "id": new_id,
-            "title": "New Chat",
-            "createdAt": now,
-            "messages": [],
-        }
-        chats.insert(0, chat)
-        _save_chats(chats)
+        chat = await run_io(chat_store.create_chat)
+        chat["messages"] = []
         return JSONResponse(chat)
     except Exception as e:
         logger.error(f"Error creating new chat: {e}")
@@ -664,27 +859,13 @@ async def new_chat():
 @app.delete("/api/chat/{chat_id}")
 async def delete_chat(chat_id: str):
     try:
-        chats = _load_chats()
-        before = len(chats)
-        chats = [c for c in chats if c.get("id") != chat_id]
-        deleted = len(chats) < before
+        # Queued appends would otherwise recreate the chat after the delete
+        await run_io(writes.flush, 10.0)
+        deleted = await run_io(chat_store.delete_chat, chat_id)
         if deleted:
-            _save_chats(chats)
             # Purge attachments in GridFS for this chat
             try:
-                if attachments_col is not None and fs is not None:
-                    from bson import ObjectId
-                    cur = attachments_col.find({"chat_id": chat_id}, {"_id": 1})
-                    ids = [doc["_id"] for doc in cur]
-                    for oid in ids:
-                        try:
-                            fs.delete(ObjectId(str(oid)))
-                        except Exception:
-                            try:
-                                fs.delete(oid)
-                            except Exception:
-                                pass
-                    attachments_col.delete_many({"chat_id": chat_id})
+                await run_io(attachments.delete_chat, chat_id)
             except Exception as e:
                 logger.error(f"Failed purging attachments for chat {chat_id}: {e}")
         return JSONResponse({"deleted": deleted}, status_code=(200 if deleted else 404), headers={
@@ -701,27 +882,37 @@ async def delete_chat(chat_id: str):
 @app.post("/api/upload")
 async def upload_files(chat_id: str = Form(...), files: List[UploadFile] = File(...)):
     try:
-        if fs is None:
+        if not attachments.available:
             return JSONResponse({"detail": "Attachments storage not configured"}, status_code=500)
-        results = []
-        for up in files:
-            meta = _store_gridfs_and_ocr(up, chat_id)
-            results.append(meta)
-        return JSONResponse({"attachments": results})
+        # Files are stored side by side; text extraction continues on the OCR pool and
+        # each attachment reports "pending" until /api/attachment/{id}/status says "done"
+        results = await asyncio.gather(*[run_io(attachments.save, up.file, up.filename, up.content_type, chat_id)
+                                         for up in files])
+        return JSONResponse({"attachments": list(results)})
     except Exception as e:
         logger.error(f"Upload failed: {e}")
         return JSONResponse({"detail": "Upload failed"}, status_code=500)
 
 
+@app.get("/api/attachment/{file_id}/status")
+async def get_attachment_status(file_id: str):
+    try:
+        status = await run_io(attachments.status, file_id)
+        if status is None:
+            return JSONResponse({"detail": "Not found"}, status_code=404)
+        return JSONResponse(status)
+    except Exception as e:
+        logger.error(f"Status lookup failed for {file_id}: {e}")
+        return JSONResponse({"detail": "Not found"}, status_code=404)
+
+
 @app.get("/api/attachment/{file_id}")
 async def get_attachment(file_id: str):
     try:
-        if fs is None:
+        if not attachments.available:
             return JSONResponse({"detail": "Attachments storage not configured"}, status_code=500)
-        from bson import ObjectId
-        oid = ObjectId(file_id)
-        gf = fs.get(oid)
-        ct = getattr(gf, 'content_type', None) or _safe_mime(gf.filename)
+        gf = await run_io(attachments.open, file_id)
+        ct = getattr(gf, 'content_type', None) or safe_mime(gf.filename)
         return StreamingResponse(iter(lambda: gf.read(8192), b''), media_type=ct, headers={
             'Content-Disposition': f'inline; filename="{gf.filename}"'
         })
@@ -0,0 +1,257 @@
+"""
+End-to-end load benchmark for the FastAPI app.
+
+Boots app:app in-process (no network) with the fake LLM provider and the
+in-memory attachment store, seeds the chats store at several sizes and
+drives the main endpoints with a fixed concurrency. Prints a table and
+writes machine-readable JSON for comparing commits.
+
+    python benchmarks/bench_app.py --sizes 100,1000,10000 --requests 200 --concurrency 16
+    python benchmarks/bench_app.py --json bench.json --compare baseline.json
+"""
+import argparse
+import asyncio
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+ENDPOINTS = ("query", "feedback", "chats", "chat", "upload")
+
+
+def _configure_env(workdir: str, args) -> None:
+    # Must run before the app (and config) is imported
+    os.environ.update({
+        "LLM_PROVIDER": "fake",
+        "FAKE_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "FAKE_LLM_LATENCY_DIST": args.llm_latency_dist,
+        "FAKE_LLM_TOKEN_MS": "0",
+        "ATTACHMENT_BACKEND": "memory",
+        "DATABASE_URL": f"sqlite:///{os.path.join(workdir, 'bench.db')}",
+        "CHATS_FILE": os.path.join(workdir, "chats_data.json"),
+        "FEEDBACK_STORE": os.path.join(workdir, "feedback_data.json"),
+        "RESPONSE_CACHE_ENABLED": "true" if args.cache else "false",
+        "CRITIC_MODE": args.critic_mode,
+    })
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def seed_chats(app_module, n: int, rng: random.Random) -> list:
+    """
+    Replace the chats store with n synthetic chats; returns their ids
+    """
+    now = datetime.datetime.utcnow()
+    chats = []
+    for i in range(n):
+        turns = rng.randint(1, 3)
+        messages = []
+        for t in range(turns):
+            messages.append({"role": "user", "content": f"Question {i}.{t} about billing and refunds"})
+            messages.append({"role": "assistant", "content": "## Summary\nSeeded answer.\n" * 3})
+        chats.append({
+            "id": str(uuid.UUID(int=rng.getrandbits(128))),
+            "title": f"Seeded chat {i}",
+            "createdAt": (now - datetime.timedelta(seconds=i)).isoformat(),
+            "messages": messages,
+            "feedback": [{"rating": "dislike", "feedback": "too long", "message": "Seeded answer.",
+                          "createdAt": now.isoformat()}] if i % 10 == 0 else [],
+        })
+    app_module.chat_store.clear()
+    app_module.chat_store.import_chats(chats)
+    return [c["id"] for c in chats]
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    # Nearest rank: the smallest value with at least pct% of the samples at or below it
+    k = max(0, min(len(sorted_values) - 1, math.ceil(pct * len(sorted_values) / 100.0) - 1))
+    return sorted_values[k]
+
+
+def summarize(latencies: list, errors: int, wall: float) -> dict:
+    lat = sorted(latencies)
+    n = len(lat)
+    return {
+        "requests": n + errors,
+        "errors": errors,
+        "throughput_rps": round(n / wall, 2) if wall > 0 else 0.0,
+        "p50_ms": round(percentile(lat, 50) * 1000, 2),
+        "p95_ms": round(percentile(lat, 95) * 1000, 2),
+        "p99_ms": round(percentile(lat, 99) * 1000, 2),
+        "mean_ms": round(sum(lat) / n * 1000, 2) if n else 0.0,
+    }
+
+
+async def run_endpoint(client, name: str, chat_ids: list, total: int, concurrency: int,
+                       rng: random.Random, repeat_ratio: float) -> dict:
+    sem = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    def request_for(i: int):
+        chat_id = rng.choice(chat_ids) if chat_ids else None
+        if name == "query":
+            q = "How do I get a refund?" if rng.random() < repeat_ratio else f"Question {uuid.uuid4().hex[:8]}"
+            return client.post("/query", json={"query": q, "session_id": f"bench-{i % 50}", "chat_id": chat_id})
+        if name == "feedback":
+            return client.post("/feedback", json={"rating": rng.choice(["like", "dislike"]),
+                                                  "feedback": "bench", "message": "Seeded answer.",
+                                                  "chat_id": chat_id})
+        if name == "chats":
+            return client.get("/api/chats")
+        if name == "chat":
+            return client.get(f"/api/chat/{chat_id}")
+        if name == "upload":
+            body = f"invoice {i}\n".encode() * 64
+            return client.post("/api/upload", data={"chat_id": chat_id or "bench"},
+                               files=[("files", (f"note-{i}.txt", body, "text/plain"))])
+        raise ValueError(name)
+
+    async def one(i: int):
+        nonlocal errors
+        async with sem:
+            start = time.perf_counter()
+            try:
+                resp = await request_for(i)
+                ok = resp.status_code < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            if ok:
+                latencies.append(elapsed)
+            else:
+                errors += 1
+
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    return summarize(latencies, errors, time.perf_counter() - wall_start)
+
+
+async def run_suite(args) -> dict:
+    import logging
+    import httpx
+    import app as app_module
+
+    logging.getLogger("supportai").setLevel(args.log_level.upper())
+
+    rng = random.Random(args.seed)
+    transport = httpx.ASGITransport(app=app_module.app)
+    results = []
+    # Run under the app's lifespan so queued writes, critiques, titles and OCR jobs are
+    # flushed and their workers stopped when the run ends
+    async with app_module.app.router.lifespan_context(app_module.app), \
+            httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for size in args.sizes:
+            t0 = time.perf_counter()
+            chat_ids = seed_chats(app_module, size, rng)
+            seed_s = time.perf_counter() - t0
+            app_module.response_cache.clear()
+            row = {"chats": size, "seed_seconds": round(seed_s, 3), "endpoints": {}}
+            for name in args.endpoints:
+                row["endpoints"][name] = await run_endpoint(
+                    client, name, chat_ids, args.requests, args.concurrency, rng, args.repeat_ratio)
+                print(_format_row(size, name, row["endpoints"][name]), flush=True)
+            results.append(row)
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "config": {
+            "sizes": args.sizes,
+            "endpoints": args.endpoints,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "llm_latency_ms": args.llm_latency_ms,
+            "llm_latency_dist": args.llm_latency_dist,
+            "repeat_ratio": args.repeat_ratio,
+            "cache": args.cache,
+            "critic_mode": args.critic_mode,
+            "seed": args.seed,
+        },
+        "results": results,
+    }
+
+
+def _format_row(size: int, name: str, r: dict) -> str:
+    return (f"{size:>7} chats  {name:<9} {r['throughput_rps']:>9.1f} req/s  "
+            f"p50 {r['p50_ms']:>8.2f}  p95 {r['p95_ms']:>8.2f}  p99 {r['p99_ms']:>8.2f} ms  "
+            f"errors {r['errors']}")
+
+
+def compare(current: dict, baseline: dict) -> None:
+    """
+    Print p95 and throughput deltas against a previous results file
+    """
+    base = {(r["chats"], ep): v for r in baseline.get("results", []) for ep, v in r["endpoints"].items()}
+    print(f"\nCompared with {baseline.get('commit', '?')}:")
+    for r in current["results"]:
+        for ep, v in r["endpoints"].items():
+            b = base.get((r["chats"], ep))
+            if not b:
+                continue
+            dp95 = (v["p95_ms"] - b["p95_ms"]) / b["p95_ms"] * 100 if b["p95_ms"] else 0.0
+            drps = (v["throughput_rps"] - b["throughput_rps"]) / b["throughput_rps"] * 100 if b["throughput_rps"] else 0.0
+            print(f"{r['chats']:>7} chats  {ep:<9} p95 {dp95:+7.1f}%  throughput {drps:+7.1f}%")
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", default="100,1000,10000,100000",
+                   help="comma-separated chats-store sizes to sweep")
+    p.add_argument("--endpoints", default=",".join(ENDPOINTS),
+                   help=f"comma-separated subset of {','.join(ENDPOINTS)}")
+    p.add_argument("--requests", type=int, default=200, help="requests per endpoint per size")
+    p.add_argument("--concurrency", type=int, default=16)
+    p.add_argument("--llm-latency-ms", type=float, default=0.0,
+                   help="mean fake LLM latency; 0 measures pure server overhead")
+    p.add_argument("--llm-latency-dist", default="fixed")
+    p.add_argument("--repeat-ratio", type=float, default=0.0,
+                   help="fraction of /query calls that repeat one popular question")
+    p.add_argument("--cache", action="store_true", help="enable the response cache")
+    p.add_argument("--critic-mode", default="background", choices=("inline", "background", "off"))
+    p.add_argument("--seed", type=int, default=42)
+    p.add_argument("--log-level", default="warning", help="app log level during the run")
+    p.add_argument("--json", dest="json_path", help="write results to this file")
+    p.add_argument("--compare", help="previous results file to diff against")
+    args = p.parse_args(argv)
+    args.sizes = [int(s) for s in args.sizes.split(",") if s.strip()]
+    args.endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip() in ENDPOINTS]
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    with tempfile.TemporaryDirectory(prefix="csai-bench-") as workdir:
+        _configure_env(workdir, args)
+        # The app resolves templates/static relative to the repo root
+        os.chdir(ROOT)
+        sys.path.insert(0, ROOT)
+        results = asyncio.run(run_suite(args))
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(results, json.load(f))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
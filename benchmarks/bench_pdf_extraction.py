@@ -0,0 +1,174 @@
+"""
+PDF text extraction benchmark: serial vs page-parallel.
+
+Generates a PDF (100 pages by default, no files or network needed) and extracts
+every page twice: serially in this process, then in page chunks on a process
+pool the way OCRQueue does, for each worker count. Prints pages/s and the
+speedup over serial and writes machine-readable JSON for comparing commits.
+
+    python benchmarks/bench_pdf_extraction.py --pages 100 --workers 1,2,4
+    python benchmarks/bench_pdf_extraction.py --scanned-every 5 --json pdf.json
+
+Pages made with --scanned-every have no text layer, so they go through the
+rasterize + OCR fallback (Tesseract must be installed for them to yield text).
+"""
+import argparse
+import datetime
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+WORDS = ("invoice", "refund", "shipping", "warranty", "account", "password", "order", "delivery",
+         "billing", "support", "return", "payment", "subscription", "upgrade", "cancel", "device")
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return "unknown"
+
+
+def make_pdf(pages: int, lines_per_page: int = 40, scanned_every: int = 0) -> bytes:
+    """
+    A minimal multi-page PDF written by hand; every scanned_every-th page has no text layer
+    """
+    objs = ["<< /Type /Catalog /Pages 2 0 R >>",
+            "<< /Type /Pages /Kids [%s] /Count %d >>" % (" ".join(f"{3 + 2 * i} 0 R" for i in range(pages)), pages)]
+    font = 3 + 2 * pages
+    for i in range(pages):
+        n = i + 1
+        objs.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] "
+                    f"/Resources << /Font << /F1 {font} 0 R >> >> /Contents {4 + 2 * i} 0 R >>")
+        if scanned_every and n % scanned_every == 0:
+            stream = ""
+        else:
+            lines = []
+            for j in range(lines_per_page):
+                words = " ".join(WORDS[(n * 7 + j * 3 + k) % len(WORDS)] for k in range(10))
+                lines.append(f"({'Page %d line %d %s' % (n, j + 1, words)}) Tj 0 -16 Td")
+            stream = "BT /F1 10 Tf 54 740 Td " + " ".join(lines) + " ET"
+        objs.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+    objs.append("<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for i, obj in enumerate(objs, 1):
+        offsets.append(len(out))
+        out += f"{i} 0 obj\n{obj}\nendobj\n".encode()
+    xref = len(out)
+    out += f"xref\n0 {len(objs) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{o:010d} 00000 n \n" for o in offsets).encode()
+    out += f"trailer\n<< /Size {len(objs) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def run_serial(data: bytes, pages: list, ocr: bool) -> tuple:
+    from database.pdf_extract import extract_pdf_pages
+    start = time.perf_counter()
+    out = extract_pdf_pages(data, pages, ocr)
+    return time.perf_counter() - start, out
+
+
+def run_parallel(data: bytes, pages: list, ocr: bool, workers: int, pages_per_job: int, start_method: str) -> tuple:
+    """
+    Page chunks on a fresh process pool, as OCRQueue submits them. Pool start-up is
+    timed separately so the result is steady-state throughput.
+    """
+    from database.pdf_extract import extract_pdf_pages
+    chunks = [pages[i:i + pages_per_job] for i in range(0, len(pages), pages_per_job)]
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(start_method)) as pool:
+        t0 = time.perf_counter()
+        # Warm every worker (interpreter start + imports) before timing
+        list(pool.map(extract_pdf_pages, [data] * workers, [[1]] * workers, [ocr] * workers))
+        startup = time.perf_counter() - t0
+        start = time.perf_counter()
+        out = {}
+        for part in pool.map(extract_pdf_pages, [data] * len(chunks), chunks, [ocr] * len(chunks)):
+            out.update(part)
+        return time.perf_counter() - start, startup, out
+
+
+def run_suite(args) -> dict:
+    data = make_pdf(args.pages, args.lines_per_page, args.scanned_every)
+    pages = list(range(1, args.pages + 1))
+    print(f"{args.pages}-page PDF, {len(data) / 1024:.0f} KiB, "
+          f"{args.pages // args.scanned_every if args.scanned_every else 0} pages without a text layer", flush=True)
+
+    serial_s, serial_out = run_serial(data, pages, not args.no_ocr)
+    chars = sum(len(t) for t in serial_out.values())
+    serial = {"seconds": round(serial_s, 4), "pages_per_s": round(args.pages / serial_s, 1), "chars": chars}
+    print(f"serial      {serial['pages_per_s']:>8.1f} pages/s  {serial_s * 1000:>9.1f} ms", flush=True)
+
+    parallel = []
+    for workers in args.workers:
+        seconds, startup, out = run_parallel(data, pages, not args.no_ocr, workers, args.pages_per_job,
+                                             args.start_method)
+        row = {
+            "workers": workers,
+            "seconds": round(seconds, 4),
+            "startup_seconds": round(startup, 4),
+            "pages_per_s": round(args.pages / seconds, 1),
+            "speedup": round(serial_s / seconds, 2),
+            "matches_serial": out == serial_out,
+        }
+        parallel.append(row)
+        print(f"{workers:>2} workers  {row['pages_per_s']:>8.1f} pages/s  {seconds * 1000:>9.1f} ms  "
+              f"speedup {row['speedup']:>5.2f}x  (pool start {startup * 1000:.0f} ms)"
+              f"{'' if row['matches_serial'] else '  OUTPUT DIFFERS'}", flush=True)
+    return {
+        "commit": _git_commit(),
+        "timestamp": datetime.datetime.utcnow().isoformat() + "Z",
+        "python": platform.python_version(),
+        "cpus": os.cpu_count(),
+        "config": {
+            "pages": args.pages,
+            "lines_per_page": args.lines_per_page,
+            "scanned_every": args.scanned_every,
+            "ocr": not args.no_ocr,
+            "workers": args.workers,
+            "pages_per_job": args.pages_per_job,
+            "start_method": args.start_method,
+        },
+        "serial": serial,
+        "parallel": parallel,
+    }
+
+
+def parse_args(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--pages", type=int, default=100)
+    p.add_argument("--lines-per-page", type=int, default=40)
+    p.add_argument("--scanned-every", type=int, default=0,
+                   help="make every Nth page a page without a text layer (0: none)")
+    p.add_argument("--no-ocr", action="store_true", help="skip the OCR fallback for pages without text")
+    p.add_argument("--workers", default="1,2,4", help="comma-separated process pool sizes to sweep")
+    p.add_argument("--pages-per-job", type=int, default=4)
+    p.add_argument("--start-method", default="spawn", choices=("spawn", "forkserver", "fork"))
+    p.add_argument("--json", dest="json_path", help="write results to this file")
+    args = p.parse_args(argv)
+    args.workers = [int(w) for w in args.workers.split(",") if w.strip()]
+    args.pages_per_job = max(args.pages_per_job, 1)
+    return args
+
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    sys.path.insert(0, ROOT)
+    results = run_suite(args)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -10,16 +10,140 @@ class Settings:
 
     # Gemini API Configuration
     GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
+    # Models tried in order; the next one is used when a model returns 404
+    GEMINI_MODEL_CHAIN = [
+        m.strip() for m in os.getenv("GEMINI_MODEL_CHAIN", "gemini-2.5-flash,gemini-1.5-pro").split(",")
+        if m.strip()
+    ]
+    GEMINI_HTTP_POOL_SIZE = int(os.getenv("GEMINI_HTTP_POOL_SIZE", os.getenv("LLM_MAX_CONCURRENCY", 32)))
+
+    # LLM backend: "gemini" or "fake" (offline, for load tests and profiling)
+    LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini").lower()
+    FAKE_LLM_LATENCY_MS = float(os.getenv("FAKE_LLM_LATENCY_MS", 800))
+    FAKE_LLM_LATENCY_DIST = os.getenv("FAKE_LLM_LATENCY_DIST", "lognormal")  # fixed|uniform|lognormal|exponential
+    FAKE_LLM_LATENCY_SIGMA = float(os.getenv("FAKE_LLM_LATENCY_SIGMA", 0.5))
+    FAKE_LLM_ERROR_RATE = float(os.getenv("FAKE_LLM_ERROR_RATE", 0.0))
+    FAKE_LLM_429_RATE = float(os.getenv("FAKE_LLM_429_RATE", 0.0))
+    FAKE_LLM_TOKEN_MS = float(os.getenv("FAKE_LLM_TOKEN_MS", 15))
+    FAKE_LLM_SEED = int(os.getenv("FAKE_LLM_SEED", 1234))
 
     LANGGRAPH_API_KEY = os.getenv("LANGGRAPH_API_KEY", "")
 
     DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///supportai.db")
-    FEEDBACK_STORE = "feedback_data.json"
+    # Shared SQL engine: pool sizing (per process) and SQLite durability (NORMAL is safe with WAL)
+    DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+    DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+    DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+    DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+    DB_SQLITE_SYNCHRONOUS = os.getenv("DB_SQLITE_SYNCHRONOUS", "NORMAL").upper()
+    # Legacy feedback JSON array; migrated once into the append-only log below
+    FEEDBACK_STORE = os.getenv("FEEDBACK_STORE", "feedback_data.json")
+    FEEDBACK_LOG = os.getenv("FEEDBACK_LOG", os.path.splitext(FEEDBACK_STORE)[0] + ".jsonl")
+    FEEDBACK_LOG_MAX_BYTES = int(os.getenv("FEEDBACK_LOG_MAX_BYTES", 16 * 1024 * 1024))
+    FEEDBACK_LOG_MAX_SEGMENTS = int(os.getenv("FEEDBACK_LOG_MAX_SEGMENTS", 8))
+    FEEDBACK_LOG_FSYNC = os.getenv("FEEDBACK_LOG_FSYNC", "false").lower() in ("1", "true", "yes")
+    # Per-chat guidance built from recent dislikes (recomputed whenever feedback is recorded)
+    FEEDBACK_GUIDANCE_WINDOW = int(os.getenv("FEEDBACK_GUIDANCE_WINDOW", 5))
+    FEEDBACK_GUIDANCE_MAX_ITEMS = int(os.getenv("FEEDBACK_GUIDANCE_MAX_ITEMS", 3))
+    FEEDBACK_GUIDANCE_REF_CHARS = int(os.getenv("FEEDBACK_GUIDANCE_REF_CHARS", 220))
+    FEEDBACK_GUIDANCE_HEADER = os.getenv(
+        "FEEDBACK_GUIDANCE_HEADER",
+        "User feedback to consider in this chat (address these concerns explicitly and avoid repeating mistakes):")
+
+    # Legacy chats JSON; imported once into the chat store tables on startup
+    CHATS_FILE = os.getenv("CHATS_FILE", "chats_data.json")
+    CHAT_DB_URL = os.getenv("CHAT_DB_URL", DATABASE_URL)
+    # Page sizes for /api/history and /api/chats (keyset pagination; ?limit= up to PAGE_MAX)
+    HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", 20))
+    CHATS_PAGE_SIZE = int(os.getenv("CHATS_PAGE_SIZE", 100))
+    PAGE_MAX = int(os.getenv("PAGE_MAX", 500))
+    # Running feedback/critic aggregates behind /api/feedback/stats (stored next to the chats)
+    FEEDBACK_STATS_DB_URL = os.getenv("FEEDBACK_STATS_DB_URL", CHAT_DB_URL)
+    FEEDBACK_STATS_BUCKET_SECONDS = int(os.getenv("FEEDBACK_STATS_BUCKET_SECONDS", 3600))
+    FEEDBACK_STATS_WINDOWS = int(os.getenv("FEEDBACK_STATS_WINDOWS", 24))
+    FEEDBACK_STATS_MAX_WINDOWS = int(os.getenv("FEEDBACK_STATS_MAX_WINDOWS", 24 * 31))
+    FEEDBACK_STATS_TOP = int(os.getenv("FEEDBACK_STATS_TOP", 10))
     DEBUG = True
 
+    # Per-session conversation history (last SESSION_MAX_TURNS exchanges); set SESSION_DB_PATH
+    # to share it across gunicorn workers through a SQLite file in WAL mode
+    SESSION_MAX_TURNS = int(os.getenv("SESSION_MAX_TURNS", 10))
+    SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 24 * 3600))
+    SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", 10000))
+    SESSION_MAX_BYTES = int(os.getenv("SESSION_MAX_BYTES", 64 * 1024 * 1024))
+    SESSION_DB_PATH = os.getenv("SESSION_DB_PATH", "")
+
+    # Write-behind persistence: "sync" (commit before responding), "batched" (wait for a
+    # group commit) or "async" (respond at once; committed within WRITE_FLUSH_INTERVAL_MS)
+    WRITE_MODE = os.getenv("WRITE_MODE", "async").lower()
+    WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", 256))
+    WRITE_FLUSH_INTERVAL_MS = float(os.getenv("WRITE_FLUSH_INTERVAL_MS", 50))
+    WRITE_MAX_PENDING = int(os.getenv("WRITE_MAX_PENDING", 10000))
+
+    # Concurrency: bounded pools for blocking LLM calls and storage I/O
+    LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", 32))
+    STORAGE_MAX_WORKERS = int(os.getenv("STORAGE_MAX_WORKERS", 8))
+
+    # Critic: "inline" (in the response), "background" (fetched later) or "off"
+    CRITIC_MODE = os.getenv("CRITIC_MODE", "background").lower()
+    CRITIC_SAMPLE_RATE = float(os.getenv("CRITIC_SAMPLE_RATE", 1.0))
+    CRITIC_WORKERS = int(os.getenv("CRITIC_WORKERS", 4))
+    CRITIC_MAX_PENDING = int(os.getenv("CRITIC_MAX_PENDING", 256))
+    CRITIC_MAX_RESULTS = int(os.getenv("CRITIC_MAX_RESULTS", 5000))
+
+    # Chat titles: heuristic title at once, LLM titles generated in background batches
+    TITLE_BATCH_SIZE = int(os.getenv("TITLE_BATCH_SIZE", 8))
+    TITLE_BATCH_INTERVAL_MS = int(os.getenv("TITLE_BATCH_INTERVAL_MS", 2000))
+    TITLE_MAX_PENDING = int(os.getenv("TITLE_MAX_PENDING", 1000))
+
+    # Summarizer: skip the second Gemini pass when the researcher output is already well-formed
+    SUMMARIZER_FORCE_TWO_PASS = os.getenv("SUMMARIZER_FORCE_TWO_PASS", "false").lower() in ("1", "true", "yes")
+
+    # Exact-match response cache (set RESPONSE_CACHE_DB_PATH to share a SQLite tier across workers)
+    RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", 2000))
+    RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024))
+    RESPONSE_CACHE_TTL_SECONDS = float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", 3600))
+    RESPONSE_CACHE_CONTEXT_TURNS = int(os.getenv("RESPONSE_CACHE_CONTEXT_TURNS", 3))
+    RESPONSE_CACHE_DB_PATH = os.getenv("RESPONSE_CACHE_DB_PATH", "")
+    RESPONSE_CACHE_DB_MAX_ENTRIES = int(os.getenv("RESPONSE_CACHE_DB_MAX_ENTRIES", 50000))
+
+    # Semantic (near-duplicate) answer cache; SEMANTIC_CACHE_PATH persists the vector matrix via mmap
+    # and shares dislike invalidations between workers. Matches must also agree on negation and content words.
+    SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", 0.6))
+    SEMANTIC_CACHE_CAPACITY = int(os.getenv("SEMANTIC_CACHE_CAPACITY", 5000))
+    SEMANTIC_CACHE_DIM = int(os.getenv("SEMANTIC_CACHE_DIM", 1024))
+    SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", "")
+    SEMANTIC_CACHE_FLUSH_EVERY = int(os.getenv("SEMANTIC_CACHE_FLUSH_EVERY", 50))
+
+    # Prometheus-style metrics at /metrics; under multi-worker gunicorn point METRICS_MULTIPROC_DIR
+    # at a shared directory so every worker's snapshot is merged into one scrape
+    METRICS_ENABLED = os.getenv("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+    METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", os.getenv("PROMETHEUS_MULTIPROC_DIR", ""))
+    METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", 5))
+
     # MongoDB (GridFS) for attachments
     MONGODB_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
     MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "CSAI")
+    # "gridfs" (default) or "memory" (process-local, for development and benchmarks)
+    ATTACHMENT_BACKEND = os.getenv("ATTACHMENT_BACKEND", "gridfs").lower()
+    # Text extraction / OCR for uploads runs on a process pool, off the request path
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", max(1, min(4, os.cpu_count() or 1))))
+    OCR_MAX_PENDING = int(os.getenv("OCR_MAX_PENDING", 200))
+    OCR_START_METHOD = os.getenv("OCR_START_METHOD", "spawn")
+    # A pending extraction not finished after this long (e.g. its worker died) is queued again
+    OCR_STALE_SECONDS = int(os.getenv("OCR_STALE_SECONDS", 600))
+    # How long /query waits for the text of attachments it references (0 = use what is ready)
+    OCR_QUERY_WAIT_MS = int(os.getenv("OCR_QUERY_WAIT_MS", 3000))
+    OCR_POLL_MS = int(os.getenv("OCR_POLL_MS", 100))
+    # PDFs: the first PDF_EAGER_PAGES pages are extracted on upload, PDF_PAGES_PER_JOB pages per
+    # worker job; later pages are extracted PDF_LAZY_PAGES at a time when a question needs them.
+    # Pages without a text layer are rendered at OCR_PDF_DPI and OCR'd.
+    PDF_EAGER_PAGES = int(os.getenv("PDF_EAGER_PAGES", 10))
+    PDF_PAGES_PER_JOB = int(os.getenv("PDF_PAGES_PER_JOB", 4))
+    PDF_LAZY_PAGES = int(os.getenv("PDF_LAZY_PAGES", 20))
+    OCR_PDF_DPI = int(os.getenv("OCR_PDF_DPI", 200))
 
     # Client API settings
     API_BASE_URL = os.getenv("API_BASE_URL", f"http://localhost:{PORT}")
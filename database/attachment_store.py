@@ -0,0 +1,659 @@
+import datetime
+import hashlib
+import io
+import mimetypes
+import threading
+import uuid
+from config import settings
+from utils.logger import logger
+from database.ocr_queue import ocr_queue
+from database.pdf_extract import (eager_pages, extract_pdf_pages, join_pages, page_excerpt, pages_to_extract,
+                                  pdf_page_count)
+
+
+def safe_mime(filename: str, content_type: str = None) -> str:
+    if content_type:
+        return content_type
+    guess = mimetypes.guess_type(filename or "")[0]
+    return guess or "application/octet-stream"
+
+
+TEXT_EXTENSIONS = ('.txt', '.md', '.csv', '.log')
+
+# Streaming chunk size for uploads (hashing and blob writes happen chunk by chunk)
+CHUNK_BYTES = 1024 * 1024
+
+
+def extract_text(source, mime: str, name: str = "") -> str:
+    """
+    OCR / text extraction from a path or a seekable binary file object
+    """
+    name = (name or (source if isinstance(source, str) else "")).lower()
+    try:
+        text = ""
+        if mime.startswith("image/"):
+            try:
+                from PIL import Image
+                import pytesseract
+                with Image.open(source) as im:
+                    text = pytesseract.image_to_string(im)
+            except Exception as e:
+                logger.warning(f"Image OCR failed: {e}")
+        elif mime == "application/pdf" or name.endswith('.pdf'):
+            try:
+                if isinstance(source, str):
+                    with open(source, 'rb') as f:
+                        data = f.read()
+                else:
+                    data = source.read()
+                pages = extract_pdf_pages(data, list(range(1, settings.PDF_EAGER_PAGES + 1)))
+                text = join_pages(pages)
+            except Exception as e:
+                logger.warning(f"PDF text extraction failed: {e}")
+        elif mime.startswith("text/") or name.endswith(TEXT_EXTENSIONS):
+            try:
+                if isinstance(source, str):
+                    with open(source, 'rb') as f:
+                        raw = f.read(200000)
+                else:
+                    raw = source.read(200000)
+                text = raw.decode('utf-8', errors='ignore')
+            except Exception as e:
+                logger.warning(f"Text read failed: {e}")
+        return (text or "").strip()
+    except Exception as e:
+        logger.error(f"Attachment OCR error: {e}")
+        return ""
+
+
+def _format_snippets(docs: list, query: str = "") -> str:
+    parts = []
+    for d in docs:
+        name = d.get("filename")
+        mime = d.get("mime")
+        # Paged documents (PDFs) contribute the pages that fit the question best
+        txt = (page_excerpt(d["pages"], query) if d.get("pages") else d.get("ocr_text") or "").strip()
+        if txt:
+            snippet = txt[:600]
+            parts.append(f"- {name} ({mime}):\n{snippet}")
+    if parts:
+        return "Attachment context:\n" + "\n\n".join(parts)
+    return ""
+
+
+def _stream_upload(fileobj, sink) -> tuple:
+    """
+    Copy fileobj into sink chunk by chunk, hashing on the way; returns (sha256 hex, size)
+    """
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = fileobj.read(CHUNK_BYTES)
+        if not chunk:
+            break
+        digest.update(chunk)
+        sink.write(chunk)
+        size += len(chunk)
+    return digest.hexdigest(), size
+
+
+def _rewind(fileobj) -> bool:
+    try:
+        fileobj.seek(0)
+        return True
+    except Exception:
+        return False
+
+
+def _is_text(mime: str, name: str) -> bool:
+    return mime.startswith("text/") or (name or "").lower().endswith(TEXT_EXTENSIONS)
+
+
+def _is_pdf(mime: str, name: str) -> bool:
+    return mime == "application/pdf" or (name or "").lower().endswith('.pdf')
+
+
+def _needs_ocr(mime: str, name: str) -> bool:
+    return mime.startswith("image/") or _is_pdf(mime, name)
+
+
+def _start_extraction(key: str, fileobj, mime: str, name: str, store_result, store_pages) -> str:
+    """
+    Text files are decoded at once; images and PDFs go to the OCR process pool and
+    store_result(text, error, pages) runs when they finish. PDFs record their page count
+    and the first PDF_EAGER_PAGES pages through store_pages(pages, page_count) as they land.
+    Returns the extraction status.
+    """
+    if not _needs_ocr(mime, name):
+        text = ""
+        if _is_text(mime, name) and _rewind(fileobj):
+            text = fileobj.read(200000).decode("utf-8", errors="ignore").strip()
+        store_result(text, None)
+        return "done"
+    if not _rewind(fileobj):
+        store_result("", "upload is not seekable")
+        return "failed"
+    data = fileobj.read()
+    pages = None
+    if _is_pdf(mime, name):
+        count = pdf_page_count(data)
+        if count:
+            store_pages({}, count)
+            pages = eager_pages(count)
+    if ocr_queue.submit(key, data, mime, name, store_result, pages=pages, on_pages=store_pages):
+        return "pending"
+    store_result("", "OCR queue full")
+    return "failed"
+
+
+def _queue_pages(sha: str, data: bytes, pages: list, store_result, store_pages) -> bool:
+    # Later PDF pages, extracted when a question needs them
+    return ocr_queue.submit(f"{sha}:pages:{pages[0]}-{pages[-1]}:{len(pages)}", data, "application/pdf", "",
+                            store_result, pages=pages, on_pages=store_pages)
+
+
+def _status_doc(file_id: str, status: str, chars: int = 0, error: str = None,
+                page_count: int = 0, pages_extracted: int = 0) -> dict:
+    out = {"id": file_id, "status": status, "chars": chars}
+    if page_count:
+        out["pages"] = {"total": page_count, "extracted": pages_extracted}
+    if error:
+        out["error"] = error
+    return out
+
+
+class _AttachmentFile:
+    """
+    A stored blob read under one attachment's own filename and content type
+    """
+
+    def __init__(self, stream, filename: str, content_type: str):
+        self._stream = stream
+        self.filename = filename
+        self.content_type = content_type
+
+    def read(self, size: int = -1) -> bytes:
+        return self._stream.read(size)
+
+    def close(self) -> None:
+        self._stream.close()
+
+
+class GridFSAttachmentStore:
+    """
+    Attachments in MongoDB, content-addressed: each distinct file is stored once in GridFS
+    and described by an attachment_blobs document (_id = SHA-256, OCR text, reference count);
+    every upload adds an attachments_meta document linking a chat to a blob
+    """
+
+    def __init__(self, uri: str = None, db_name: str = None):
+        self.fs = None
+        self.meta = None
+        self.blobs = None
+        self.pages = None
+        try:
+            import pymongo
+            import gridfs
+            client = pymongo.MongoClient(uri or settings.MONGODB_URI)
+            mongo_db = client[db_name or settings.MONGO_DB_NAME]
+            self.fs = gridfs.GridFS(mongo_db)
+            self.meta = mongo_db.get_collection("attachments_meta")
+            self.blobs = mongo_db.get_collection("attachment_blobs")
+            # Per-page text of PDFs: {_id: "<sha256>:<page>", sha256, page, text}
+            self.pages = mongo_db.get_collection("attachment_pages")
+            self.pages.create_index([("sha256", 1), ("page", 1)])
+            self.meta.create_index([("chat_id", 1), ("createdAt", -1)])
+            self.meta.create_index("sha256")
+        except Exception as e:
+            logger.error(f"Mongo/GridFS init failed (deferred): {e}")
+
+    @property
+    def available(self) -> bool:
+        return self.fs is not None and self.meta is not None and self.blobs is not None and self.pages is not None
+
+    def save(self, fileobj, filename: str, content_type: str, chat_id: str) -> dict:
+        if not self.available:
+            raise RuntimeError("Attachments storage not initialized")
+        from pymongo import ReturnDocument
+        fname = filename or f"file-{uuid.uuid4()}"
+        mime = safe_mime(fname, content_type)
+        # One pass: the upload streams into GridFS while it is hashed
+        grid_in = self.fs.new_file(filename=fname, content_type=mime)
+        try:
+            sha, size = _stream_upload(fileobj, grid_in)
+        except Exception:
+            grid_in.abort()
+            raise
+        grid_in.close()
+        # Claim the hash; whoever inserts the blob document owns the GridFS file and its OCR
+        now = datetime.datetime.utcnow()
+        existing = self.blobs.find_one_and_update(
+            {"_id": sha},
+            {"$inc": {"refcount": 1},
+             "$setOnInsert": {"gridfs_id": grid_in._id, "size": size, "mime": mime, "filename": fname,
+                              "ocr_text": "", "ocr_status": "pending", "ocr_jobs": 1, "ocr_queued_at": now,
+                              "createdAt": now}},
+            upsert=True, return_document=ReturnDocument.BEFORE)
+        if existing is not None:
+            # Same bytes already stored: drop the copy just written and reuse the blob and its OCR
+            self.fs.delete(grid_in._id)
+            status = existing.get("ocr_status", "done")
+            if status == "failed":
+                status = self._retry_failed(existing)
+        else:
+            status = self._extract(sha, fileobj, mime, fname)
+        meta_doc = {
+            "chat_id": chat_id,
+            "filename": fname,
+            "mime": mime,
+            "size": size,
+            "sha256": sha,
+            "createdAt": datetime.datetime.utcnow(),
+        }
+        file_id = self.meta.insert_one(meta_doc).inserted_id
+        return {"id": str(file_id), "name": fname, "mime": mime, "size": size, "sha256": sha,
+                "deduplicated": existing is not None, "status": status}
+
+    def _retry_failed(self, blob: dict) -> str:
+        # A new upload of bytes whose extraction failed runs it again; one uploader claims the retry
+        claimed = self.blobs.update_one(
+            {"_id": blob["_id"], "ocr_status": "failed"},
+            {"$set": {"ocr_status": "pending", "ocr_error": None, "ocr_jobs": 1, "pages_queued": [],
+                      "ocr_queued_at": datetime.datetime.utcnow()}})
+        if not claimed.modified_count:
+            current = self.blobs.find_one({"_id": blob["_id"]}, {"ocr_status": 1})
+            return (current or {}).get("ocr_status", "pending")
+        try:
+            with self.fs.get(blob["gridfs_id"]) as f:
+                return self._extract(blob["_id"], f, blob.get("mime") or "", blob.get("filename") or "")
+        except Exception as e:
+            logger.error(f"Could not retry extraction for blob {blob['_id']}: {e}")
+            self._store_text(blob["_id"], "", str(e))
+            return "failed"
+
+    def _extract(self, sha: str, fileobj, mime: str, name: str) -> str:
+        return _start_extraction(sha, fileobj, mime, name,
+                                 lambda text, error, pages=None: self._store_text(sha, text, error, pages),
+                                 lambda pages, page_count=None: self._store_pages(sha, pages, page_count))
+
+    def _store_pages(self, sha: str, pages: dict, page_count: int = None) -> None:
+        from pymongo import UpdateOne
+        if pages:
+            self.pages.bulk_write([
+                UpdateOne({"_id": f"{sha}:{n}"}, {"$set": {"sha256": sha, "page": n, "text": text}}, upsert=True)
+                for n, text in pages.items()], ordered=False)
+        update = {"pages_extracted": self.pages.count_documents({"sha256": sha})}
+        if page_count is not None:
+            update["page_count"] = page_count
+        self.blobs.update_one({"_id": sha}, {"$set": update})
+
+    def _load_pages(self, sha: str, numbers: list = None) -> dict:
+        q = {"sha256": sha}
+        if numbers is not None:
+            q["page"] = {"$in": list(numbers)}
+        return {p["page"]: p.get("text") or "" for p in self.pages.find(q, {"page": 1, "text": 1})}
+
+    def _store_text(self, sha: str, text: str, error: str = None, pages: dict = None, job_pages=()) -> None:
+        from pymongo import ReturnDocument
+        if pages is not None:
+            self._store_pages(sha, pages)
+        blob = self.blobs.find_one_and_update(
+            {"_id": sha}, {"$inc": {"ocr_jobs": -1}, "$pullAll": {"pages_queued": list(job_pages)}},
+            projection={"ocr_jobs": 1}, return_document=ReturnDocument.AFTER)
+        if blob is None:
+            return
+        if pages is not None:
+            # Paged (PDF) text: the document text is every page extracted so far, in order
+            text = join_pages(self._load_pages(sha))
+            error = None if text else error
+        text = (text or "")[:200000]
+        fields = {"ocr_text": text, "ocr_chars": len(text)}
+        if blob.get("ocr_jobs", 0) > 0:
+            # Other page jobs are still running: the blob stays pending until the last one lands
+            self.blobs.update_one({"_id": sha, "ocr_jobs": {"$gt": 0}}, {"$set": fields})
+            return
+        fields.update(ocr_status="failed" if error else "done", ocr_error=error)
+        self.blobs.update_one({"_id": sha, "ocr_jobs": {"$lte": 0}}, {"$set": fields, "$max": {"ocr_jobs": 0}})
+
+    def status(self, file_id: str):
+        """
+        Extraction status of one upload: {"id", "status": pending|done|failed, "chars"[, "error"]}
+        """
+        if not self.available:
+            return None
+        from bson import ObjectId
+        doc = self.meta.find_one({"_id": ObjectId(file_id)}, {"sha256": 1, "ocr_text": 1})
+        if doc is None:
+            return None
+        if not doc.get("sha256"):
+            return _status_doc(file_id, "done", len(doc.get("ocr_text") or ""))
+        blob = self.blobs.find_one({"_id": doc["sha256"]}, {"ocr_status": 1, "ocr_chars": 1, "ocr_error": 1,
+                                                            "page_count": 1, "pages_extracted": 1})
+        if blob is None:
+            return None
+        return _status_doc(file_id, blob.get("ocr_status", "done"), blob.get("ocr_chars", 0), blob.get("ocr_error"),
+                           blob.get("page_count", 0), blob.get("pages_extracted", 0))
+
+    def _shas_for(self, chat_id: str, ids: list) -> list:
+        from bson import ObjectId
+        try:
+            oids = [ObjectId(i) for i in ids if i]
+        except Exception:
+            return []
+        return list({d["sha256"] for d in self.meta.find({"_id": {"$in": oids}, "chat_id": chat_id}, {"sha256": 1})
+                     if d.get("sha256")})
+
+    def pending_count(self, chat_id: str, ids: list, page_jobs: bool = True) -> int:
+        """
+        How many of these uploads still wait for their text; with page_jobs=False, uploads
+        only waiting for later PDF pages (ensure_pages) are not counted
+        """
+        if not self.available or not ids:
+            return 0
+        shas = self._shas_for(chat_id, ids)
+        if not shas:
+            return 0
+        query = {"_id": {"$in": shas}, "ocr_status": "pending"}
+        if not page_jobs:
+            query["pages_queued.0"] = {"$exists": False}
+        return self.blobs.count_documents(query)
+
+    def ensure_pages(self, chat_id: str, ids: list, query: str) -> int:
+        """
+        Queue extraction of PDF pages past the eager ones when the question needs them
+        (see pdf_extract.pages_to_extract); returns how many documents were queued
+        """
+        if not self.available or not ids:
+            return 0
+        shas = self._shas_for(chat_id, ids)
+        queued = 0
+        # While the eager pages (or an earlier page job) are still extracting, the pages it
+        # covers are unknown, so nothing is queued until it lands
+        for blob in self.blobs.find({"_id": {"$in": shas}, "page_count": {"$gt": 0}, "ocr_status": {"$ne": "pending"}},
+                                    {"gridfs_id": 1, "page_count": 1, "pages_extracted": 1, "pages_queued": 1}):
+            if blob.get("pages_extracted", 0) >= blob["page_count"]:
+                continue
+            sha = blob["_id"]
+            skip = eager_pages(blob["page_count"]) + blob.get("pages_queued", [])
+            wanted = pages_to_extract(query, self._load_pages(sha), blob["page_count"], skip)
+            if not wanted:
+                continue
+            # Claim the blob so one worker queues these pages
+            claimed = self.blobs.update_one(
+                {"_id": sha, "ocr_status": {"$ne": "pending"}},
+                {"$set": {"ocr_status": "pending", "ocr_queued_at": datetime.datetime.utcnow()},
+                 "$inc": {"ocr_jobs": 1}, "$addToSet": {"pages_queued": {"$each": wanted}}})
+            if not claimed.modified_count:
+                continue
+            finish = (lambda text, error, pages=None, sha=sha, wanted=wanted:
+                      self._store_text(sha, text, error, pages, wanted))
+            try:
+                with self.fs.get(blob["gridfs_id"]) as f:
+                    data = f.read()
+                ok = _queue_pages(sha, data, wanted, finish,
+                                  lambda pages, page_count=None, sha=sha: self._store_pages(sha, pages, page_count))
+            except Exception as e:
+                logger.error(f"Could not queue PDF pages for blob {sha}: {e}")
+                ok = False
+            if ok:
+                queued += 1
+            else:
+                finish(None, "OCR queue full", {})
+        return queued
+
+    def requeue_stale(self, older_than: float = None) -> int:
+        """
+        Queue again extractions left pending longer than OCR_STALE_SECONDS (e.g. by a worker
+        that stopped); each stale blob is claimed by one worker only
+        """
+        if not self.available:
+            return 0
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(
+            seconds=settings.OCR_STALE_SECONDS if older_than is None else older_than)
+        count = 0
+        for blob in list(self.blobs.find({"ocr_status": "pending", "ocr_queued_at": {"$lt": cutoff}},
+                                         {"gridfs_id": 1, "mime": 1, "filename": 1, "ocr_queued_at": 1})):
+            claimed = self.blobs.update_one({"_id": blob["_id"], "ocr_queued_at": blob["ocr_queued_at"]},
+                                            {"$set": {"ocr_queued_at": datetime.datetime.utcnow(),
+                                                      "ocr_jobs": 1, "pages_queued": []}})
+            if not claimed.modified_count:
+                continue
+            try:
+                with self.fs.get(blob["gridfs_id"]) as f:
+                    self._extract(blob["_id"], f, blob.get("mime") or "", blob.get("filename") or "")
+                count += 1
+            except Exception as e:
+                logger.error(f"Could not requeue extraction for blob {blob['_id']}: {e}")
+        if count:
+            logger.info(f"Requeued {count} stale attachment extractions")
+        return count
+
+    def _with_blob_text(self, docs: list) -> list:
+        # Deduplicated uploads keep their OCR text (and PDF pages) on the shared blob
+        shas = [d["sha256"] for d in docs if d.get("sha256")]
+        if not shas:
+            return docs
+        blobs = {b["_id"]: b for b in self.blobs.find({"_id": {"$in": shas}}, {"ocr_text": 1, "page_count": 1})}
+        for d in docs:
+            blob = blobs.get(d.get("sha256"))
+            if blob is None:
+                continue
+            d["ocr_text"] = blob.get("ocr_text", "")
+            if blob.get("page_count"):
+                d["pages"] = self._load_pages(d["sha256"])
+        return docs
+
+    def snippets(self, chat_id: str, ids: list = None, limit: int = 3, query: str = "") -> str:
+        if not self.available:
+            return ""
+        from bson import ObjectId
+        q = {"chat_id": chat_id}
+        if ids:
+            try:
+                q["_id"] = {"$in": [ObjectId(i) for i in ids if i]}
+            except Exception:
+                pass
+        docs = list(self.meta.find(q).sort("createdAt", -1).limit(limit))
+        return _format_snippets(self._with_blob_text(docs), query)
+
+    def open(self, file_id: str):
+        """
+        Return a readable file object with .filename and .content_type
+        """
+        from bson import ObjectId
+        oid = ObjectId(file_id)
+        doc = self.meta.find_one({"_id": oid}, {"filename": 1, "mime": 1, "sha256": 1})
+        if doc is None or not doc.get("sha256"):
+            # Uploads stored before deduplication share their id with the GridFS file
+            return self.fs.get(oid)
+        blob = self.blobs.find_one({"_id": doc["sha256"]}, {"gridfs_id": 1})
+        if blob is None:
+            raise FileNotFoundError(file_id)
+        return _AttachmentFile(self.fs.get(blob["gridfs_id"]), doc["filename"], doc["mime"])
+
+    def _release(self, sha: str) -> None:
+        from pymongo import ReturnDocument
+        blob = self.blobs.find_one_and_update({"_id": sha}, {"$inc": {"refcount": -1}},
+                                              return_document=ReturnDocument.AFTER)
+        # Conditional delete: an upload that re-linked the blob meanwhile keeps it alive
+        if blob is not None and blob.get("refcount", 0) <= 0 and \
+                self.blobs.delete_one({"_id": sha, "refcount": {"$lte": 0}}).deleted_count:
+            self.fs.delete(blob["gridfs_id"])
+            self.pages.delete_many({"sha256": sha})
+
+    def delete_chat(self, chat_id: str) -> None:
+        if not self.available:
+            return
+        for doc in list(self.meta.find({"chat_id": chat_id}, {"_id": 1, "sha256": 1})):
+            try:
+                if self.meta.delete_one({"_id": doc["_id"]}).deleted_count == 0:
+                    continue
+                if doc.get("sha256"):
+                    self._release(doc["sha256"])
+                else:
+                    self.fs.delete(doc["_id"])
+            except Exception as e:
+                logger.warning(f"Failed to delete attachment {doc['_id']}: {e}")
+
+
+class _MemoryFile(io.BytesIO):
+    def __init__(self, data: bytes, filename: str, content_type: str):
+        super().__init__(data)
+        self.filename = filename
+        self.content_type = content_type
+
+
+class MemoryAttachmentStore:
+    """
+    Process-local attachment store for development, tests and benchmarks; deduplicates
+    by content hash and counts references like the GridFS store
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._files = {}
+        # sha256 -> {"data", "ocr_text", "ocr_status", "ocr_error", "pages", "page_count", "jobs", "queued",
+        #            "refcount"}
+        self._blobs = {}
+
+    @property
+    def available(self) -> bool:
+        return True
+
+    def save(self, fileobj, filename: str, content_type: str, chat_id: str) -> dict:
+        fname = filename or f"file-{uuid.uuid4()}"
+        mime = safe_mime(fname, content_type)
+        buf = io.BytesIO()
+        sha, size = _stream_upload(fileobj, buf)
+        with self._lock:
+            blob = self._blobs.get(sha)
+            deduplicated = blob is not None
+            if blob is None:
+                blob = self._blobs[sha] = {"data": buf.getvalue(), "ocr_text": "", "ocr_status": "pending",
+                                           "ocr_error": None, "pages": {}, "page_count": 0, "jobs": 1,
+                                           "queued": set(), "refcount": 0}
+            # A new upload of bytes whose extraction failed runs it again
+            extract = not deduplicated or blob["ocr_status"] == "failed"
+            if deduplicated and extract:
+                blob.update(ocr_status="pending", ocr_error=None, jobs=1)
+                blob["queued"].clear()
+            blob["refcount"] += 1
+            file_id = uuid.uuid4().hex[:24]
+            self._files[file_id] = {
+                "_id": file_id,
+                "chat_id": chat_id,
+                "filename": fname,
+                "mime": mime,
+                "size": size,
+                "sha256": sha,
+                "createdAt": datetime.datetime.utcnow(),
+            }
+        if extract:
+            status = _start_extraction(sha, buf, mime, fname,
+                                       lambda text, error, pages=None: self._store_text(sha, text, error, pages),
+                                       lambda pages, page_count=None: self._store_pages(sha, pages, page_count))
+        else:
+            status = blob["ocr_status"]
+        return {"id": file_id, "name": fname, "mime": mime, "size": size, "sha256": sha,
+                "deduplicated": deduplicated, "status": status}
+
+    def _store_pages(self, sha: str, pages: dict, page_count: int = None) -> None:
+        with self._lock:
+            blob = self._blobs.get(sha)
+            if blob is not None:
+                blob["pages"].update(pages)
+                if page_count is not None:
+                    blob["page_count"] = page_count
+
+    def _store_text(self, sha: str, text: str, error: str = None, pages: dict = None, job_pages=()) -> None:
+        with self._lock:
+            blob = self._blobs.get(sha)
+            if blob is None:
+                return
+            blob["jobs"] = max(blob["jobs"] - 1, 0)
+            blob["queued"].difference_update(job_pages)
+            if pages is not None:
+                blob["pages"].update(pages)
+                text = join_pages(blob["pages"])
+                error = None if text else error
+            blob["ocr_text"] = (text or "")[:200000]
+            if not blob["jobs"]:
+                blob.update(ocr_status="failed" if error else "done", ocr_error=error)
+
+    def status(self, file_id: str):
+        with self._lock:
+            doc = self._files.get(file_id)
+            if doc is None:
+                return None
+            blob = self._blobs[doc["sha256"]]
+            return _status_doc(file_id, blob["ocr_status"], len(blob["ocr_text"]), blob["ocr_error"],
+                               blob["page_count"], len(blob["pages"]))
+
+    def pending_count(self, chat_id: str, ids: list, page_jobs: bool = True) -> int:
+        with self._lock:
+            blobs = [self._blobs[self._files[i]["sha256"]] for i in ids or []
+                     if i in self._files and self._files[i]["chat_id"] == chat_id]
+            return sum(1 for b in blobs if b["ocr_status"] == "pending" and (page_jobs or not b["queued"]))
+
+    def ensure_pages(self, chat_id: str, ids: list, query: str) -> int:
+        jobs = []
+        with self._lock:
+            shas = {self._files[i]["sha256"] for i in ids or [] if i in self._files
+                    and self._files[i]["chat_id"] == chat_id}
+            for sha in shas:
+                blob = self._blobs[sha]
+                if (not blob["page_count"] or blob["ocr_status"] == "pending"
+                        or len(blob["pages"]) >= blob["page_count"]):
+                    continue
+                skip = set(eager_pages(blob["page_count"])) | blob["queued"]
+                wanted = pages_to_extract(query, blob["pages"], blob["page_count"], skip)
+                if wanted:
+                    blob["ocr_status"] = "pending"
+                    blob["jobs"] += 1
+                    blob["queued"].update(wanted)
+                    jobs.append((sha, blob["data"], wanted))
+        queued = 0
+        for sha, data, wanted in jobs:
+            finish = (lambda text, error, pages=None, sha=sha, wanted=wanted:
+                      self._store_text(sha, text, error, pages, wanted))
+            if _queue_pages(sha, data, wanted, finish,
+                            lambda pages, page_count=None, sha=sha: self._store_pages(sha, pages, page_count)):
+                queued += 1
+            else:
+                finish(None, "OCR queue full", {})
+        return queued
+
+    def requeue_stale(self, older_than: float = None) -> int:
+        # Nothing survives a restart of the in-memory store
+        return 0
+
+    def snippets(self, chat_id: str, ids: list = None, limit: int = 3, query: str = "") -> str:
+        with self._lock:
+            docs = []
+            for d in self._files.values():
+                if d["chat_id"] == chat_id and (not ids or d["_id"] in ids):
+                    blob = self._blobs[d["sha256"]]
+                    docs.append(dict(d, ocr_text=blob["ocr_text"], pages=dict(blob["pages"])))
+        docs.sort(key=lambda d: d["createdAt"], reverse=True)
+        return _format_snippets(docs[:limit], query)
+
+    def open(self, file_id: str):
+        with self._lock:
+            doc = self._files[file_id]
+            data = self._blobs[doc["sha256"]]["data"]
+        return _MemoryFile(data, doc["filename"], doc["mime"])
+
+    def delete_chat(self, chat_id: str) -> None:
+        with self._lock:
+            for fid in [k for k, d in self._files.items() if d["chat_id"] == chat_id]:
+                sha = self._files.pop(fid)["sha256"]
+                blob = self._blobs[sha]
+                blob["refcount"] -= 1
+                if blob["refcount"] <= 0:
+                    del self._blobs[sha]
+
+
+def create_attachment_store():
+    if settings.ATTACHMENT_BACKEND == "memory":
+        return MemoryAttachmentStore()
+    return GridFSAttachmentStore()
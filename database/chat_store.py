@@ -0,0 +1,402 @@
+import datetime
+import json
+import os
+import sys
+import uuid
+from sqlalchemy import func, select, Column, Integer, String, Text, ForeignKey, Index
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import declarative_base
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from agents.feedback_manager import build_feedback_guidance
+from database.engine import get_engine, get_sessionmaker
+from database.migrations import ensure_columns
+from database import versions
+
+Base = declarative_base()
+
+# Version keys (database/versions.py) for the chat list and for one chat
+LIST_KEY = "chats"
+
+
+def chat_key(chat_id: str) -> str:
+    return f"chat:{chat_id}"
+
+
+DEFAULT_TITLES = ("new chat", "", "untitled")
+
+
+class Chat(Base):
+    __tablename__ = 'chats'
+    # seq orders the sidebar (newest first); id is the public identifier
+    seq = Column(Integer, primary_key=True, autoincrement=True)
+    id = Column(String(64), nullable=False, unique=True, index=True)
+    title = Column(Text, default="New Chat")
+    created_at = Column(String(40))
+    # Guidance text from recent dislikes, rebuilt whenever feedback is recorded
+    guidance = Column(Text)
+
+
+class ChatMessage(Base):
+    __tablename__ = 'chat_messages'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String(64), ForeignKey('chats.id', ondelete='CASCADE'), nullable=False)
+    message_id = Column(String(64), unique=True)
+    role = Column(String(16), nullable=False)
+    content = Column(Text)
+    critique = Column(Text)
+    __table_args__ = (Index('ix_chat_messages_chat_id_id', 'chat_id', 'id'),)
+
+
+class ChatFeedback(Base):
+    __tablename__ = 'chat_feedback'
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    chat_id = Column(String(64), ForeignKey('chats.id', ondelete='CASCADE'), nullable=False)
+    rating = Column(String(16))
+    feedback = Column(Text)
+    message = Column(Text)
+    created_at = Column(String(40))
+    __table_args__ = (Index('ix_chat_feedback_chat_id_id', 'chat_id', 'id'),)
+
+
+class ChatStoreMeta(Base):
+    __tablename__ = 'chat_store_meta'
+    key = Column(String(64), primary_key=True)
+    value = Column(Text)
+
+
+def _now() -> str:
+    return datetime.datetime.utcnow().isoformat()
+
+
+def _message_dict(m: ChatMessage) -> dict:
+    # Same shape the JSON store used: id/critique only when present; seq is the ?after= cursor
+    out = {"role": m.role, "content": m.content, "seq": m.id}
+    if m.message_id:
+        out["id"] = m.message_id
+    if m.critique is not None:
+        out["critique"] = m.critique
+    return out
+
+
+class ChatStore:
+    """
+    Chats, messages and per-chat feedback in SQL tables: indexed lookups by chat id,
+    append-only message inserts and one transaction per update
+    """
+
+    def __init__(self, url: str = None):
+        url = url or settings.CHAT_DB_URL
+        # Shares the engine and pool (WAL, foreign keys) with the other stores on this URL
+        self.url = url
+        self.engine = get_engine(url)
+        Base.metadata.create_all(self.engine)
+        ensure_columns(self.engine, "chats", {"guidance": "TEXT"})
+        versions.ensure_versions_table(self.engine)
+        self.Session = get_sessionmaker(url)
+
+    # ----- reads -----
+    def list_chats(self, limit: int = None, before: int = None) -> list:
+        """
+        Chat summaries, newest first; see list_chats_page for paging
+        """
+        return self.list_chats_page(limit, before)[0]
+
+    def list_chats_page(self, limit: int = None, before: int = None) -> tuple:
+        """
+        (summaries, next cursor): newest first, keyset-paged on the chat sequence number.
+        The cursor is None on the last page.
+        """
+        with metrics.track("chat_store_read"), self.Session() as session:
+            # Plain column tuples: no ORM identity map for what can be a very long list
+            q = select(Chat.seq, Chat.id, Chat.title, Chat.created_at).order_by(Chat.seq.desc())
+            if before is not None:
+                q = q.where(Chat.seq < before)
+            if limit is not None:
+                q = q.limit(limit + 1)
+            rows = session.execute(q).all()
+        next_cursor = None
+        if limit is not None and len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = rows[-1].seq
+        return [{"id": cid, "title": title or "Untitled", "createdAt": created}
+                for _, cid, title, created in rows], next_cursor
+
+    def get_chat(self, chat_id: str, after: int = None, limit: int = None):
+        """
+        A chat with its messages. after=<message seq> returns only the messages after that
+        one so clients can fetch just what is new; limit caps the page and next_after is
+        the cursor for the next one.
+        """
+        with metrics.track("chat_store_read"), self.Session() as session:
+            chat = session.query(Chat).filter(Chat.id == chat_id).one_or_none()
+            if chat is None:
+                return None
+            # Keyset page: a range seek on ix_chat_messages_chat_id_id, whatever the chat's length
+            q = (session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id)
+                 .order_by(ChatMessage.id))
+            if after is not None:
+                q = q.filter(ChatMessage.id > after)
+            if limit is not None:
+                q = q.limit(limit + 1)
+            messages = q.all()
+            next_after = None
+            if limit is not None and len(messages) > limit:
+                messages = messages[:limit]
+                next_after = messages[-1].id
+            out = {
+                "id": chat.id,
+                "title": chat.title or "Untitled",
+                "createdAt": chat.created_at,
+                "messages": [_message_dict(m) for m in messages],
+            }
+            if next_after is not None:
+                out["next_after"] = next_after
+            return out
+
+    def get_guidance(self, chat_id: str):
+        """
+        Precomputed feedback guidance for a chat, or None
+        """
+        with metrics.track("chat_store_read"), self.Session() as session:
+            row = session.query(Chat.guidance).filter(Chat.id == chat_id).one_or_none()
+            return row.guidance if row else None
+
+    def get_title(self, chat_id: str):
+        """
+        The chat's title, or None if the chat does not exist (yet)
+        """
+        with metrics.track("chat_store_read"), self.Session() as session:
+            row = session.query(Chat.title).filter(Chat.id == chat_id).one_or_none()
+            return (row.title or "") if row else None
+
+    def get_versions(self, *keys) -> tuple:
+        """
+        (epoch, version of each key) for ETags, e.g. get_versions("chats") or get_versions(chat_key(id))
+        """
+        with metrics.track("chat_store_read"), self.Session() as session:
+            return versions.read(session, *keys)
+
+    def find_message_critique(self, message_id: str):
+        with metrics.track("chat_store_read"), self.Session() as session:
+            row = session.query(ChatMessage.critique).filter(ChatMessage.message_id == message_id).one_or_none()
+            return row.critique if row else None
+
+    # ----- writes -----
+    def create_chat(self, chat_id: str = None, title: str = "New Chat", created_at: str = None) -> dict:
+        chat = {"id": chat_id or str(uuid.uuid4()), "title": title, "createdAt": created_at or _now()}
+        with metrics.track("chat_store_write"), self.Session() as session:
+            session.add(Chat(id=chat["id"], title=title, created_at=chat["createdAt"]))
+            versions.bump(session, LIST_KEY, chat_key(chat["id"]))
+            session.commit()
+        return chat
+
+    def append_exchanges(self, items: list) -> None:
+        """
+        Append (chat_id, query, summary, message_id) exchanges in one transaction,
+        creating chats that do not exist yet
+        """
+        with metrics.track("chat_store_write"), self.Session() as session:
+            ids = {chat_id for chat_id, _, _, _ in items}
+            existing = {r.id for r in session.query(Chat.id).filter(Chat.id.in_(ids))}
+            new_chats, rows = [], []
+            for chat_id, query, summary, message_id in items:
+                if chat_id not in existing:
+                    existing.add(chat_id)
+                    new_chats.append({"id": chat_id, "title": "New Chat", "created_at": _now(), "guidance": None})
+                rows.append({"chat_id": chat_id, "role": "user", "content": query,
+                             "message_id": None, "critique": None})
+                rows.append({"chat_id": chat_id, "role": "assistant", "content": summary,
+                             "message_id": message_id, "critique": None})
+            if new_chats:
+                session.execute(Chat.__table__.insert(), new_chats)
+            session.execute(ChatMessage.__table__.insert(), rows)
+            versions.bump(session, *[chat_key(cid) for cid in ids], *([LIST_KEY] if new_chats else []))
+            session.commit()
+
+    def set_titles(self, items: list) -> None:
+        """
+        Apply (chat_id, title) pairs; only default titles are replaced, since a
+        concurrent request may have titled the chat already
+        """
+        with metrics.track("chat_store_write"), self.Session() as session:
+            changed = []
+            for chat_id, title in items:
+                if (session.query(Chat)
+                        .filter(Chat.id == chat_id,
+                                func.lower(func.trim(func.coalesce(Chat.title, ""))).in_(DEFAULT_TITLES))
+                        .update({Chat.title: title}, synchronize_session=False)):
+                    changed.append(chat_key(chat_id))
+            if changed:
+                versions.bump(session, LIST_KEY, *changed)
+            session.commit()
+
+    def upgrade_titles(self, items: list) -> None:
+        """
+        Apply (chat_id, heuristic, title) triples; a title is replaced only while it is
+        still the heuristic one it was generated for
+        """
+        with metrics.track("chat_store_write"), self.Session() as session:
+            changed = []
+            for chat_id, heuristic, title in items:
+                if (session.query(Chat).filter(Chat.id == chat_id, Chat.title == heuristic)
+                        .update({Chat.title: title}, synchronize_session=False)):
+                    changed.append(chat_key(chat_id))
+            if changed:
+                versions.bump(session, LIST_KEY, *changed)
+            session.commit()
+
+    def set_message_critiques(self, items: list) -> None:
+        """
+        Apply (message_id, critique) pairs in one transaction
+        """
+        with metrics.track("chat_store_write"), self.Session() as session:
+            for message_id, feedback in items:
+                (session.query(ChatMessage).filter(ChatMessage.message_id == message_id)
+                 .update({ChatMessage.critique: feedback}, synchronize_session=False))
+            chat_ids = {r.chat_id for r in session.query(ChatMessage.chat_id)
+                        .filter(ChatMessage.message_id.in_([mid for mid, _ in items]))}
+            if chat_ids:
+                versions.bump(session, *[chat_key(cid) for cid in chat_ids])
+            session.commit()
+
+    def add_feedback_many(self, items: list) -> None:
+        """
+        Insert (chat_id, rating, feedback, message) entries; entries for unknown chats are ignored
+        """
+        with metrics.track("chat_store_write"), self.Session() as session:
+            ids = {item[0] for item in items}
+            existing = {r.id for r in session.query(Chat.id).filter(Chat.id.in_(ids))}
+            rows = [{"chat_id": chat_id, "rating": rating or "", "feedback": feedback, "message": message,
+                     "created_at": _now()}
+                    for chat_id, rating, feedback, message in items if chat_id in existing]
+            if rows:
+                session.execute(ChatFeedback.__table__.insert(), rows)
+                for chat_id in {r["chat_id"] for r in rows}:
+                    self._refresh_guidance(session, chat_id)
+            session.commit()
+
+    @staticmethod
+    def _refresh_guidance(session, chat_id: str) -> None:
+        window = (session.query(ChatFeedback.rating, ChatFeedback.feedback, ChatFeedback.message)
+                  .filter(ChatFeedback.chat_id == chat_id)
+                  .order_by(ChatFeedback.id.desc()).limit(settings.FEEDBACK_GUIDANCE_WINDOW).all())
+        guidance = build_feedback_guidance(
+            [{"rating": r.rating, "feedback": r.feedback, "message": r.message} for r in window])
+        session.query(Chat).filter(Chat.id == chat_id).update({Chat.guidance: guidance}, synchronize_session=False)
+
+    def rebuild_guidance(self) -> int:
+        """
+        Recompute guidance for every chat with feedback (e.g. after changing the guidance settings)
+        """
+        with self.Session() as session:
+            ids = [r.chat_id for r in session.query(ChatFeedback.chat_id).distinct()]
+            for chat_id in ids:
+                self._refresh_guidance(session, chat_id)
+            session.commit()
+            return len(ids)
+
+    def delete_chat(self, chat_id: str) -> bool:
+        with metrics.track("chat_store_write"), self.Session() as session:
+            session.query(ChatMessage).filter(ChatMessage.chat_id == chat_id).delete(synchronize_session=False)
+            session.query(ChatFeedback).filter(ChatFeedback.chat_id == chat_id).delete(synchronize_session=False)
+            count = session.query(Chat).filter(Chat.id == chat_id).delete(synchronize_session=False)
+            if count:
+                versions.bump(session, LIST_KEY, chat_key(chat_id))
+            session.commit()
+            return bool(count)
+
+    def clear(self) -> None:
+        with self.Session() as session:
+            session.query(ChatMessage).delete()
+            session.query(ChatFeedback).delete()
+            session.query(Chat).delete()
+            # New epoch: no ETag handed out before the wipe can match again
+            versions.reset_epoch(session)
+            session.commit()
+
+    # ----- import from the legacy JSON file -----
+    def import_chats(self, chats: list, session=None) -> int:
+        """
+        Bulk-insert chats in the JSON store's shape (newest first); existing ids are skipped
+        """
+        own = session is None
+        session = session or self.Session()
+        try:
+            existing = {r.id for r in session.query(Chat.id).all()}
+            chat_rows, message_rows, feedback_rows = [], [], []
+            # The JSON list is newest first; insert oldest first so seq keeps that order
+            for c in reversed(chats):
+                cid = c.get("id")
+                if not cid or cid in existing:
+                    continue
+                existing.add(cid)
+                feedback = c.get("feedback", []) or []
+                recent = list(reversed(feedback))[:settings.FEEDBACK_GUIDANCE_WINDOW]
+                chat_rows.append({"id": cid, "title": c.get("title") or "New Chat",
+                                  "created_at": c.get("createdAt"), "guidance": build_feedback_guidance(recent)})
+                for m in c.get("messages", []) or []:
+                    message_rows.append({"chat_id": cid, "role": m.get("role", ""), "content": m.get("content"),
+                                         "message_id": m.get("id"), "critique": m.get("critique")})
+                for f in feedback:
+                    feedback_rows.append({"chat_id": cid, "rating": f.get("rating") or "",
+                                          "feedback": f.get("feedback"), "message": f.get("message"),
+                                          "created_at": f.get("createdAt")})
+            if chat_rows:
+                session.execute(Chat.__table__.insert(), chat_rows)
+            if message_rows:
+                session.execute(ChatMessage.__table__.insert(), message_rows)
+            if feedback_rows:
+                session.execute(ChatFeedback.__table__.insert(), feedback_rows)
+            if chat_rows:
+                versions.bump(session, LIST_KEY)
+            if own:
+                session.commit()
+            return len(chat_rows)
+        except Exception:
+            if own:
+                session.rollback()
+            raise
+        finally:
+            if own:
+                session.close()
+
+    def import_json_once(self, path: str) -> int:
+        """
+        Import a legacy chats JSON file the first time the store sees it.
+        The marker row makes this safe when several workers start at once.
+        """
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            if not isinstance(data, list):
+                return 0
+        except Exception as e:
+            logger.error(f"Could not read chats file {path}: {e}")
+            return 0
+        marker = f"imported:{os.path.abspath(path)}"
+        with self.Session() as session:
+            try:
+                session.add(ChatStoreMeta(key=marker, value=_now()))
+                session.flush()
+                count = self.import_chats(data, session=session)
+                session.commit()
+            except IntegrityError:
+                session.rollback()
+                return 0
+        logger.info(f"Imported {count} chats from {path}")
+        return count
+
+
+if __name__ == "__main__":
+    # python -m database.chat_store chats_data.json
+    # python -m database.chat_store --rebuild-guidance
+    store = ChatStore()
+    if len(sys.argv) > 1 and sys.argv[1] == "--rebuild-guidance":
+        print(f"Rebuilt guidance for {store.rebuild_guidance()} chats")
+    else:
+        src = sys.argv[1] if len(sys.argv) > 1 else settings.CHATS_FILE
+        print(f"Imported {store.import_json_once(src)} chats from {src}")
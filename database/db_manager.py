@@ -1,6 +1,12 @@
-from sqlalchemy import create_engine, Column, Integer, String, Text, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import Column, Integer, String, Text, DateTime, Index
+from sqlalchemy.orm import declarative_base
 from config import settings
+from utils.helpers import normalize_query, hash_text
+from utils.logger import logger
+from utils.concurrency import run_io
+from database.engine import get_engine, get_sessionmaker, session_scope, run_in_session, bulk_insert, bulk_delete
+from database.migrations import ensure_columns, ensure_indexes
+from database import versions
 import datetime
 
 Base = declarative_base()
@@ -10,51 +16,176 @@ class Conversation(Base):
     id = Column(Integer, primary_key=True)
     user_query = Column(Text)
     bot_response = Column(Text)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
+    # SHA-256 of the normalized query, so earlier answers can be found without scanning
+    query_hash = Column(String(64))
+    chat_id = Column(String(64))
+    session_id = Column(String(128))
+    message_id = Column(String(64), index=True)
+
+    __table_args__ = (
+        Index("ix_conversations_query_hash", "query_hash", "id"),
+        Index("ix_conversations_chat_query", "chat_id", "query_hash", "id"),
+        Index("ix_conversations_session_query", "session_id", "query_hash", "id"),
+    )
+
+
+# Version key (database/versions.py) bumped by every change to the conversations table
+HISTORY_KEY = "history"
+
+
+def query_hash(query):
+    return hash_text(normalize_query(query))
+
+
+def _conversation_row(user_query, bot_response, chat_id=None, session_id=None, message_id=None):
+    return {"user_query": user_query, "bot_response": bot_response, "query_hash": query_hash(user_query),
+            "chat_id": chat_id, "session_id": session_id, "message_id": message_id,
+            "timestamp": datetime.datetime.utcnow()}
+
 
 class DatabaseManager:
     def __init__(self):
-        self.engine = create_engine(settings.DATABASE_URL)
+        self.url = settings.DATABASE_URL
+        self.engine = get_engine(self.url)
         Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        added = ensure_columns(self.engine, "conversations", {
+            "query_hash": "VARCHAR(64)", "chat_id": "VARCHAR(64)",
+            "session_id": "VARCHAR(128)", "message_id": "VARCHAR(64)",
+        })
+        ensure_indexes(self.engine, Conversation.__table__)
+        versions.ensure_versions_table(self.engine)
+        self.Session = get_sessionmaker(self.url)
+        if "query_hash" in added:
+            self.backfill_query_hashes()
 
-    def add_conversation(self, user_query, bot_response):
-        session = self.Session()
-        convo = Conversation(user_query=user_query, bot_response=bot_response)
-        session.add(convo)
-        session.commit()
-        session.close()
+    def add_conversation(self, user_query, bot_response, chat_id=None, session_id=None, message_id=None):
+        self.add_conversations([(user_query, bot_response, chat_id, session_id, message_id)])
 
-    def get_history(self, limit=20):
-        session = self.Session()
-        history = session.query(Conversation).order_by(Conversation.timestamp.desc()).limit(limit).all()
-        session.close()
-        return history
+    def add_conversations(self, rows):
+        """
+        Insert (user_query, bot_response[, chat_id, session_id, message_id]) rows in one transaction
+        """
+        with session_scope(self.url) as session:
+            bulk_insert(session, Conversation, [_conversation_row(*row) for row in rows])
+            versions.bump(session, HISTORY_KEY)
 
-    def delete_conversation(self, conv_id: int) -> bool:
+    def get_history(self, limit=20, before=None):
+        """
+        Newest-first page of conversations; before=<id> continues after the previous page
+        (keyset on the primary key, so every page costs the same at any depth)
+        """
+        with self.Session() as session:
+            q = session.query(Conversation)
+            if before is not None:
+                q = q.filter(Conversation.id < before)
+            return q.order_by(Conversation.id.desc()).limit(limit).all()
+
+    def find_response(self, query, message_id=None, chat_id=None, session_id=None):
+        """
+        The stored answer to resummarize: by message id when given, otherwise the latest
+        answer to the same (normalized) query in this chat, then this session, then anywhere
+        """
         session = self.Session()
         try:
-            obj = session.query(Conversation).filter(Conversation.id == conv_id).one_or_none()
-            if not obj:
-                session.close()
-                return False
-            session.delete(obj)
-            session.commit()
+            if message_id:
+                row = (session.query(Conversation.bot_response)
+                       .filter(Conversation.message_id == message_id).first())
+                if row:
+                    return row.bot_response
+            qh = query_hash(query)
+            scopes = []
+            if chat_id:
+                scopes.append(Conversation.chat_id == chat_id)
+            if session_id:
+                scopes.append(Conversation.session_id == session_id)
+            scopes.append(None)
+            for scope in scopes:
+                q = session.query(Conversation.bot_response).filter(Conversation.query_hash == qh)
+                if scope is not None:
+                    q = q.filter(scope)
+                row = q.order_by(Conversation.id.desc()).first()
+                if row:
+                    return row.bot_response
+            return None
+        finally:
             session.close()
-            return True
-        except Exception:
+
+    def backfill_query_hashes(self, chunk=1000):
+        """
+        Hash queries of rows stored before query_hash existed
+        """
+        session = self.Session()
+        total = 0
+        try:
+            while True:
+                rows = (session.query(Conversation.id, Conversation.user_query)
+                        .filter(Conversation.query_hash.is_(None)).limit(chunk).all())
+                if not rows:
+                    break
+                session.bulk_update_mappings(Conversation, [
+                    {"id": r.id, "query_hash": query_hash(r.user_query)} for r in rows])
+                session.commit()
+                total += len(rows)
+            if total:
+                logger.info(f"Backfilled query hashes for {total} conversations")
+        except Exception as e:
             session.rollback()
+            logger.error(f"Query hash backfill failed: {e}")
+        finally:
             session.close()
+        return total
+
+    def delete_conversation(self, conv_id: int) -> bool:
+        try:
+            with session_scope(self.url) as session:
+                return self._delete_conversations(session, [conv_id]) > 0
+        except Exception as e:
+            logger.error(f"Failed to delete conversation {conv_id}: {e}")
             return False
 
     def clear_history(self) -> int:
-        session = self.Session()
         try:
-            count = session.query(Conversation).delete()
-            session.commit()
-            session.close()
-            return int(count or 0)
-        except Exception:
-            session.rollback()
-            session.close()
+            with session_scope(self.url) as session:
+                return self._clear(session)
+        except Exception as e:
+            logger.error(f"Failed to clear history: {e}")
+            return 0
+
+    @staticmethod
+    def _delete_conversations(session, ids) -> int:
+        count = bulk_delete(session, Conversation, Conversation.id.in_(list(ids)))
+        if count:
+            versions.bump(session, HISTORY_KEY)
+        return count
+
+    @staticmethod
+    def _clear(session) -> int:
+        count = bulk_delete(session, Conversation)
+        versions.bump(session, HISTORY_KEY)
+        return count
+
+    def get_versions(self) -> tuple:
+        """
+        (epoch, history version) for ETags on /api/history
+        """
+        with self.Session() as session:
+            return versions.read(session, HISTORY_KEY)
+
+    # ----- async API (runs on the storage pool; safe to await from request handlers) -----
+    async def get_history_async(self, limit=20, before=None):
+        return await run_io(self.get_history, limit, before)
+
+    async def delete_conversation_async(self, conv_id: int) -> bool:
+        try:
+            return await run_in_session(self._delete_conversations, [conv_id], url=self.url) > 0
+        except Exception as e:
+            logger.error(f"Failed to delete conversation {conv_id}: {e}")
+            return False
+
+    async def clear_history_async(self) -> int:
+        try:
+            return await run_in_session(self._clear, url=self.url)
+        except Exception as e:
+            logger.error(f"Failed to clear history: {e}")
             return 0
@@ -0,0 +1,129 @@
+import threading
+from contextlib import contextmanager
+from sqlalchemy import create_engine, delete, event, insert
+from sqlalchemy.orm import sessionmaker
+from config import settings
+from utils.logger import logger
+from utils.concurrency import run_io
+
+# One engine (and connection pool) per database URL, shared by every store in the process
+_engines = {}
+_sessionmakers = {}
+_lock = threading.Lock()
+
+
+def _is_sqlite(url: str) -> bool:
+    return url.startswith("sqlite")
+
+
+def _is_memory_sqlite(url: str) -> bool:
+    return _is_sqlite(url) and (":memory:" in url or url.rstrip("/") in ("sqlite:", "sqlite:/"))
+
+
+def _sqlite_pragmas(dbapi_conn, _record):
+    # WAL lets readers (and other workers) proceed while one connection writes;
+    # synchronous=NORMAL is durable across app crashes in WAL mode and much cheaper than FULL
+    cur = dbapi_conn.cursor()
+    cur.execute("PRAGMA journal_mode=WAL")
+    cur.execute(f"PRAGMA synchronous={settings.DB_SQLITE_SYNCHRONOUS}")
+    cur.execute("PRAGMA foreign_keys=ON")
+    cur.execute(f"PRAGMA busy_timeout={int(settings.DB_POOL_TIMEOUT * 1000)}")
+    cur.execute("PRAGMA temp_store=MEMORY")
+    cur.close()
+
+
+def _create(url: str):
+    kwargs = {}
+    if _is_sqlite(url):
+        # Pooled connections move between storage threads
+        kwargs["connect_args"] = {"timeout": settings.DB_POOL_TIMEOUT, "check_same_thread": False}
+    if not _is_memory_sqlite(url):
+        kwargs.update(pool_size=settings.DB_POOL_SIZE, max_overflow=settings.DB_MAX_OVERFLOW,
+                      pool_timeout=settings.DB_POOL_TIMEOUT, pool_recycle=settings.DB_POOL_RECYCLE,
+                      pool_pre_ping=not _is_sqlite(url))
+    engine = create_engine(url, **kwargs)
+    if _is_sqlite(url):
+        event.listen(engine, "connect", _sqlite_pragmas)
+    logger.info(f"Created database engine for {engine.url.render_as_string(hide_password=True)}")
+    return engine
+
+
+def get_engine(url: str = None):
+    """
+    The shared engine for url (default DATABASE_URL)
+    """
+    url = url or settings.DATABASE_URL
+    engine = _engines.get(url)
+    if engine is None:
+        with _lock:
+            engine = _engines.get(url)
+            if engine is None:
+                engine = _engines[url] = _create(url)
+    return engine
+
+
+def get_sessionmaker(url: str = None):
+    url = url or settings.DATABASE_URL
+    maker = _sessionmakers.get(url)
+    if maker is None:
+        with _lock:
+            maker = _sessionmakers.get(url)
+            if maker is None:
+                # expire_on_commit=False: rows stay readable after the session closes
+                maker = _sessionmakers[url] = sessionmaker(bind=get_engine(url), expire_on_commit=False)
+    return maker
+
+
+@contextmanager
+def session_scope(url: str = None):
+    """
+    A session that commits on success and rolls back on error
+    """
+    session = get_sessionmaker(url)()
+    try:
+        yield session
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
+
+
+def _run_in_session(fn, url, args, kwargs):
+    with session_scope(url) as session:
+        return fn(session, *args, **kwargs)
+
+
+async def run_in_session(fn, *args, url: str = None, **kwargs):
+    """
+    Async session API for the FastAPI handlers: fn(session, *args, **kwargs) runs in one
+    transaction on the storage pool, so the event loop never waits on the database
+    """
+    return await run_io(_run_in_session, fn, url, args, kwargs)
+
+
+def bulk_insert(session, model, rows: list) -> int:
+    """
+    Insert a list of column dicts with one executemany
+    """
+    if not rows:
+        return 0
+    session.execute(insert(model), rows)
+    return len(rows)
+
+
+def bulk_delete(session, model, *criteria) -> int:
+    """
+    DELETE ... WHERE criteria as one statement (no rows loaded); returns the row count
+    """
+    result = session.execute(delete(model).where(*criteria) if criteria else delete(model))
+    return int(result.rowcount or 0)
+
+
+def dispose_engines() -> None:
+    with _lock:
+        for engine in _engines.values():
+            engine.dispose()
+        _engines.clear()
+        _sessionmakers.clear()
@@ -0,0 +1,266 @@
+import glob
+import json
+import os
+import re
+import threading
+from config import settings
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: appends are still serialized within the process
+    fcntl = None
+
+
+class _FileLock:
+    """
+    flock() on a side file so rotation and compaction are safe across gunicorn workers
+    """
+
+    def __init__(self, path: str, shared: bool = False, blocking: bool = True):
+        self.path = path
+        self.shared = shared
+        self.blocking = blocking
+        self.fd = None
+
+    def __enter__(self):
+        if fcntl is None:
+            return True
+        self.fd = os.open(self.path, os.O_CREAT | os.O_RDWR, 0o644)
+        flags = fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX
+        if not self.blocking:
+            flags |= fcntl.LOCK_NB
+        try:
+            fcntl.flock(self.fd, flags)
+            return True
+        except BlockingIOError:
+            os.close(self.fd)
+            self.fd = None
+            return False
+
+    def __exit__(self, exc_type, exc, tb):
+        if self.fd is not None:
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            os.close(self.fd)
+            self.fd = None
+        return False
+
+
+class FeedbackLog:
+    """
+    Append-only JSON-lines feedback log. Each write is one O_APPEND write of whole lines;
+    the active file rotates into numbered segments at max_bytes, and rotated segments are
+    compacted (merged, torn lines and duplicate ids dropped) on a background thread.
+
+    Files: <path> (active), <path>.000001, <path>.000002, ... (rotated, oldest first)
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None, max_segments: int = None, fsync: bool = None):
+        self.path = path or settings.FEEDBACK_LOG
+        self.max_bytes = max_bytes or settings.FEEDBACK_LOG_MAX_BYTES
+        self.max_segments = max_segments or settings.FEEDBACK_LOG_MAX_SEGMENTS
+        self.fsync = settings.FEEDBACK_LOG_FSYNC if fsync is None else fsync
+        self._lock = threading.Lock()
+        self._compacting = False
+        self.stats = {"appended": 0, "rotations": 0, "compactions": 0, "skipped_lines": 0}
+
+    # ----- files -----
+    def _segment_path(self, n: int) -> str:
+        return f"{self.path}.{n:06d}"
+
+    def segments(self) -> list:
+        """
+        Rotated segment paths, oldest first
+        """
+        pattern = re.compile(re.escape(os.path.basename(self.path)) + r"\.(\d{6})$")
+        found = []
+        for p in glob.glob(glob.escape(self.path) + ".*"):
+            m = pattern.match(os.path.basename(p))
+            if m:
+                found.append((int(m.group(1)), p))
+        return [p for _, p in sorted(found)]
+
+    def _ensure_dir(self) -> None:
+        d = os.path.dirname(self.path)
+        if d:
+            os.makedirs(d, exist_ok=True)
+
+    # ----- writes -----
+    def append(self, entries: list) -> None:
+        """
+        Append entries as JSON lines in one write; raises on failure
+        """
+        if not entries:
+            return
+        data = "".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8")
+        self._ensure_dir()
+        with self._lock:
+            # Shared lock: many appenders at once, but never while another worker rotates the file
+            with _FileLock(self.path + ".lock", shared=True):
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    os.write(fd, data)
+                    if self.fsync:
+                        os.fsync(fd)
+                    size = os.fstat(fd).st_size
+                finally:
+                    os.close(fd)
+            self.stats["appended"] += len(entries)
+        if size >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self) -> bool:
+        """
+        Move the active file to the next numbered segment (if it is still over the limit)
+        """
+        with self._lock, _FileLock(self.path + ".lock"):
+            try:
+                if not os.path.exists(self.path) or os.path.getsize(self.path) < self.max_bytes:
+                    return False
+                segs = self.segments()
+                last = int(segs[-1].rsplit(".", 1)[1]) if segs else 0
+                os.replace(self.path, self._segment_path(last + 1))
+                self.stats["rotations"] += 1
+                logger.info(f"Rotated feedback log to {self._segment_path(last + 1)}")
+            except Exception as e:
+                logger.error(f"Feedback log rotation failed: {e}")
+                return False
+        if len(self.segments()) > self.max_segments:
+            self.compact_in_background()
+        return True
+
+    # ----- compaction -----
+    def compact_in_background(self) -> None:
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+        threading.Thread(target=run, name="feedback-compact", daemon=True).start()
+
+    def compact(self) -> int:
+        """
+        Merge all rotated segments into the oldest one, dropping torn lines and duplicate
+        entry ids (e.g. from retried writes). Returns the number of entries kept.
+        Rotated segments are never written to, so appends continue meanwhile.
+        """
+        with _FileLock(self.path + ".compact.lock", blocking=False) as acquired:
+            if not acquired:
+                return 0
+            # Holding the lock, any temp file left here is from a worker that died mid-compaction
+            for stale in glob.glob(glob.escape(self.path) + ".*.tmp"):
+                os.remove(stale)
+            segs = self.segments()
+            if len(segs) < 2:
+                return 0
+            target = segs[0]
+            tmp_path = f"{target}.{os.getpid()}.tmp"
+            seen = set()
+            kept = 0
+            try:
+                with open(tmp_path, "w", encoding="utf-8") as out:
+                    for entry in self._iter_files(segs):
+                        key = entry.get("id") or json.dumps(entry, sort_keys=True, ensure_ascii=False)
+                        if key in seen:
+                            continue
+                        seen.add(key)
+                        out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+                        kept += 1
+                    out.flush()
+                    os.fsync(out.fileno())
+                os.replace(tmp_path, target)
+                for p in segs[1:]:
+                    os.remove(p)
+            except Exception as e:
+                logger.error(f"Feedback log compaction failed: {e}")
+                if os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+                return 0
+            with self._lock:
+                self.stats["compactions"] += 1
+            logger.info(f"Compacted {len(segs)} feedback segments into {target} ({kept} entries)")
+            return kept
+
+    # ----- reads -----
+    def _iter_files(self, paths: list):
+        # Open every file up front: a compaction that removes segments mid-read cannot
+        # hide their entries from this iteration (open files stay readable after unlink)
+        files = []
+        for p in paths:
+            try:
+                files.append(open(p, "r", encoding="utf-8"))
+            except FileNotFoundError:
+                continue
+        try:
+            for f in files:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        # A torn write from a crash; compaction drops it for good
+                        self.stats["skipped_lines"] += 1
+        finally:
+            for f in files:
+                f.close()
+
+    def __iter__(self):
+        """
+        Stream every entry, oldest first, without loading the log into memory
+        """
+        return self._iter_files(self.segments() + [self.path])
+
+    # ----- migration -----
+    def migrate_json(self, json_path: str) -> int:
+        """
+        One-time import of the legacy feedback JSON array as the oldest segment; the JSON
+        file is renamed to <name>.migrated. Safe to call from every worker at startup.
+        """
+        if not json_path or not os.path.exists(json_path):
+            return 0
+        self._ensure_dir()
+        with _FileLock(self.path + ".compact.lock"):
+            if not os.path.exists(json_path):
+                return 0  # another worker migrated it first
+            try:
+                with open(json_path, "r", encoding="utf-8") as f:
+                    entries = json.load(f)
+                if not isinstance(entries, list):
+                    raise ValueError("expected a JSON array")
+                target = self._segment_path(0)
+                tmp_path = f"{target}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as out:
+                    for e in entries:
+                        out.write(json.dumps(e, ensure_ascii=False) + "\n")
+                # Older than anything already in the log: becomes (or prepends to) segment 0
+                if os.path.exists(target):
+                    with open(tmp_path, "a", encoding="utf-8") as out, open(target, "r", encoding="utf-8") as cur:
+                        for line in cur:
+                            out.write(line)
+                os.replace(tmp_path, target)
+                os.replace(json_path, json_path + ".migrated")
+                logger.info(f"Migrated {len(entries)} feedback entries from {json_path} to {target}")
+                return len(entries)
+            except Exception as e:
+                logger.error(f"Feedback migration from {json_path} failed: {e}")
+                return 0
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+        segs = self.segments()
+        stats["segments"] = len(segs)
+        stats["bytes"] = sum(os.path.getsize(p) for p in segs + [self.path] if os.path.exists(p))
+        return stats
+
+
+feedback_log = FeedbackLog()
@@ -0,0 +1,317 @@
+import datetime
+import re
+import sys
+import time
+from sqlalchemy import Column, Float, Integer, String, Text, Index, insert, select, update
+from sqlalchemy.orm import declarative_base
+from config import settings
+from utils.helpers import hash_text
+from utils.logger import logger
+from utils.metrics import metrics
+from llms.topic_classifier_llm import classify_topic
+from database.engine import get_engine, get_sessionmaker
+from database import versions
+
+Base = declarative_base()
+
+# Version key (database/versions.py) bumped whenever an aggregate changes
+STATS_KEY = "feedback_stats"
+
+# Bucket holding the all-time running totals next to the per-window rows
+ALL_TIME = -1
+
+COUNTERS = ("feedback", "likes", "dislikes", "scores", "score_sum", "low_scores")
+
+SCORE_RE = re.compile(r"Score:\s*(\d+(?:\.\d+)?)\s*/\s*5", re.IGNORECASE)
+
+# Critic scores at or below this count as low
+LOW_SCORE = 2.0
+
+LABEL_CHARS = 200
+
+
+class FeedbackAggregate(Base):
+    # dimension/key: "all"/"", "topic"/<topic>, "chat"/<chat id>, "message"/<hash of a disliked answer>
+    __tablename__ = 'feedback_aggregates'
+    dimension = Column(String(16), primary_key=True)
+    key = Column(String(64), primary_key=True)
+    # Window start (unix seconds, a multiple of the bucket size) or ALL_TIME
+    bucket = Column(Integer, primary_key=True)
+    feedback = Column(Integer, nullable=False, default=0)
+    likes = Column(Integer, nullable=False, default=0)
+    dislikes = Column(Integer, nullable=False, default=0)
+    scores = Column(Integer, nullable=False, default=0)
+    score_sum = Column(Float, nullable=False, default=0.0)
+    low_scores = Column(Integer, nullable=False, default=0)
+    # Excerpt of the disliked answer for "message" rows
+    label = Column(Text)
+
+    __table_args__ = (
+        # Top-N by dislikes within one bucket and dimension, without touching other rows
+        Index("ix_feedback_aggregates_top", "dimension", "bucket", "dislikes"),
+    )
+
+
+def parse_score(feedback_text: str):
+    """
+    The critic's "Score: X/5" as a float in [0, 5], or None
+    """
+    m = SCORE_RE.search(feedback_text or "")
+    if not m:
+        return None
+    return min(max(float(m.group(1)), 0.0), 5.0)
+
+
+def feedback_event(rating: str, query: str = "", message: str = "", chat_id: str = None, ts: float = None) -> dict:
+    """
+    A /feedback submission as an aggregate update; the topic comes from the query (or the answer)
+    """
+    return {"ts": time.time() if ts is None else ts, "chat_id": chat_id,
+            "topic": classify_topic(query or message or ""),
+            "rating": rating or "", "message": message or ""}
+
+
+def score_event(feedback_text: str, query: str = "", chat_id: str = None, ts: float = None):
+    """
+    A critic result as an aggregate update, or None when it carries no score
+    """
+    score = parse_score(feedback_text)
+    if score is None:
+        return None
+    return {"ts": time.time() if ts is None else ts, "chat_id": chat_id, "topic": classify_topic(query or ""),
+            "score": score}
+
+
+def _rows_for(event: dict, bucket_seconds: int):
+    # ts None: time unknown (rebuilt critiques), so only the all-time rows count it
+    window = None if event["ts"] is None else int(event["ts"] // bucket_seconds * bucket_seconds)
+    counts = {c: 0 for c in COUNTERS}
+    label = None
+    if "score" in event:
+        counts.update(scores=1, score_sum=event["score"], low_scores=int(event["score"] <= LOW_SCORE))
+        targets = [("all", ""), ("topic", event["topic"])]
+    else:
+        rating = event["rating"]
+        counts.update(feedback=1, likes=int(rating == "like"), dislikes=int(rating == "dislike"))
+        targets = [("all", ""), ("topic", event["topic"])]
+        if rating == "dislike" and event["message"]:
+            targets.append(("message", hash_text(event["message"])))
+            label = event["message"][:LABEL_CHARS]
+    if event.get("chat_id"):
+        targets.append(("chat", str(event["chat_id"])[:64]))
+    for dimension, key in targets:
+        for bucket in ((window, ALL_TIME) if window is not None else (ALL_TIME,)):
+            yield (dimension, key, bucket), counts, label if dimension == "message" else None
+
+
+def _dialect_insert(conn):
+    dialect = (getattr(conn, "dialect", None) or conn.get_bind().dialect).name
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    elif dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    else:
+        return None
+    return dialect_insert
+
+
+def _increment(session, pk: tuple, counts: dict, label) -> None:
+    table = FeedbackAggregate.__table__
+    dimension, key, bucket = pk
+    dialect_insert = _dialect_insert(session)
+    if dialect_insert is not None:
+        stmt = dialect_insert(table).values(dimension=dimension, key=key, bucket=bucket, label=label, **counts)
+        session.execute(stmt.on_conflict_do_update(
+            index_elements=[table.c.dimension, table.c.key, table.c.bucket],
+            set_={c: table.c[c] + stmt.excluded[c] for c in COUNTERS}))
+        return
+    where = (table.c.dimension == dimension) & (table.c.key == key) & (table.c.bucket == bucket)
+    if not session.execute(update(table).where(where).values(
+            **{c: table.c[c] + v for c, v in counts.items()})).rowcount:
+        session.execute(insert(table).values(dimension=dimension, key=key, bucket=bucket, label=label, **counts))
+
+
+def _summary(row) -> dict:
+    if row is None:
+        out = {c: 0 for c in COUNTERS}
+    else:
+        out = {c: getattr(row, c) for c in COUNTERS}
+    rated = out["likes"] + out["dislikes"]
+    out["like_rate"] = round(out["likes"] / rated, 4) if rated else None
+    out["avg_score"] = round(out["score_sum"] / out["scores"], 3) if out["scores"] else None
+    out["score_sum"] = round(out["score_sum"], 3)
+    return out
+
+
+def _iso(ts: int) -> str:
+    return datetime.datetime.fromtimestamp(ts, datetime.timezone.utc).isoformat()
+
+
+class FeedbackStats:
+    """
+    Running feedback and critic-score aggregates, bucketed by time window and keyed by
+    chat, topic and disliked answer. Each event increments a fixed handful of rows, so
+    dashboard reads are primary-key or top-N index lookups however much feedback exists.
+    """
+
+    def __init__(self, url: str = None, bucket_seconds: int = None):
+        self.url = url or settings.FEEDBACK_STATS_DB_URL
+        self.bucket_seconds = max(bucket_seconds or settings.FEEDBACK_STATS_BUCKET_SECONDS, 60)
+        self.engine = get_engine(self.url)
+        Base.metadata.create_all(self.engine)
+        versions.ensure_versions_table(self.engine)
+        self.Session = get_sessionmaker(self.url)
+
+    def bucket_of(self, ts: float) -> int:
+        return int(ts // self.bucket_seconds * self.bucket_seconds)
+
+    # ----- writes -----
+    def record_many(self, events: list) -> None:
+        """
+        Apply feedback/score events in one transaction; increments for the same row are
+        summed first so a batch costs one upsert per touched row
+        """
+        merged = {}
+        for event in events:
+            if not event:
+                continue
+            for pk, counts, label in _rows_for(event, self.bucket_seconds):
+                cur = merged.get(pk)
+                if cur is None:
+                    merged[pk] = [dict(counts), label]
+                else:
+                    for c, v in counts.items():
+                        cur[0][c] += v
+                    cur[1] = cur[1] or label
+        if not merged:
+            return
+        with metrics.track("feedback_stats_write"), self.Session() as session:
+            # Sorted keys: concurrent workers lock rows in the same order
+            for pk in sorted(merged):
+                counts, label = merged[pk]
+                _increment(session, pk, counts, label)
+            versions.bump(session, STATS_KEY)
+            session.commit()
+
+    def reset(self) -> None:
+        with self.Session() as session:
+            session.query(FeedbackAggregate).delete()
+            versions.bump(session, STATS_KEY)
+            session.commit()
+
+    # ----- reads -----
+    def get_versions(self) -> tuple:
+        with self.Session() as session:
+            return versions.read(session, STATS_KEY)
+
+    def get_stats(self, windows: int = None, chat_id: str = None, topic: str = None,
+                  top: int = None, now: float = None) -> dict:
+        """
+        Dashboard view: all-time totals, the last `windows` buckets (for everything, or for one
+        chat or topic), per-topic totals, and the most disliked chats and answers
+        """
+        windows = min(max(windows or settings.FEEDBACK_STATS_WINDOWS, 1), settings.FEEDBACK_STATS_MAX_WINDOWS)
+        top = min(max(top or settings.FEEDBACK_STATS_TOP, 1), settings.PAGE_MAX)
+        last = self.bucket_of(now or time.time())
+        first = last - (windows - 1) * self.bucket_seconds
+        if chat_id:
+            dimension, key = "chat", chat_id
+        elif topic:
+            dimension, key = "topic", topic
+        else:
+            dimension, key = "all", ""
+        t = FeedbackAggregate
+        with metrics.track("feedback_stats_read"), self.Session() as session:
+            def one(dim, k):
+                return session.execute(select(t).where(
+                    t.dimension == dim, t.key == k, t.bucket == ALL_TIME)).scalar_one_or_none()
+
+            def ranked(dim, limit=None):
+                q = (select(t).where(t.dimension == dim, t.bucket == ALL_TIME)
+                     .order_by(t.dislikes.desc(), t.key))
+                return session.execute(q.limit(limit) if limit else q).scalars().all()
+
+            series = {r.bucket: r for r in session.execute(select(t).where(
+                t.dimension == dimension, t.key == key, t.bucket.between(first, last))).scalars()}
+            out = {
+                "bucket_seconds": self.bucket_seconds,
+                "scope": {"dimension": dimension, "key": key},
+                "totals": _summary(one(dimension, key)),
+                "windows": [{"start": _iso(b), **_summary(series.get(b))}
+                            for b in range(first, last + 1, self.bucket_seconds)],
+                # Topics are a small fixed set (see llms/topic_classifier_llm.py)
+                "topics": {r.key: _summary(r) for r in ranked("topic")},
+                "top_disliked_chats": [{"chat_id": r.key, **_summary(r)}
+                                       for r in ranked("chat", top) if r.dislikes],
+                "top_disliked_answers": [{"answer_hash": r.key, "excerpt": r.label or "", **_summary(r)}
+                                         for r in ranked("message", top) if r.dislikes],
+            }
+        return out
+
+    # ----- rebuild -----
+    def rebuild(self, chat_url: str = None, chunk: int = 1000) -> int:
+        """
+        Recompute every aggregate from the chat store's feedback and stored critiques
+        (e.g. after changing the bucket size). Streams rows in chunks; returns events replayed.
+        Only critiques persisted on messages (CRITIC_MODE=background) can be replayed, and
+        replayed feedback takes its topic from the answer text.
+        """
+        from database.chat_store import ChatFeedback, ChatMessage
+        chat_session = get_sessionmaker(chat_url or settings.CHAT_DB_URL)()
+        self.reset()
+        total = 0
+        try:
+            last_id = 0
+            while True:
+                rows = (chat_session.query(ChatFeedback).filter(ChatFeedback.id > last_id)
+                        .order_by(ChatFeedback.id).limit(chunk).all())
+                if not rows:
+                    break
+                self.record_many([feedback_event(r.rating, "", r.message, r.chat_id, _parse_ts(r.created_at))
+                                  for r in rows])
+                total += len(rows)
+                last_id = rows[-1].id
+            # Critiques sit on bot messages; the user message before each gives the topic
+            last_id, last_user = 0, {}
+            while True:
+                rows = (chat_session.query(ChatMessage).filter(ChatMessage.id > last_id)
+                        .order_by(ChatMessage.id).limit(chunk).all())
+                if not rows:
+                    break
+                events = []
+                for m in rows:
+                    if m.role == "user":
+                        last_user[m.chat_id] = m.content or ""
+                    elif m.critique:
+                        event = score_event(m.critique, last_user.get(m.chat_id, ""), m.chat_id)
+                        if event:
+                            # Messages carry no timestamp: all-time totals only
+                            event["ts"] = None
+                            events.append(event)
+                self.record_many(events)
+                total += len(events)
+                last_id = rows[-1].id
+        finally:
+            chat_session.close()
+        logger.info(f"Rebuilt feedback aggregates from {total} events")
+        return total
+
+
+def _parse_ts(value):
+    # The chat store writes naive UTC timestamps
+    try:
+        dt = datetime.datetime.fromisoformat(str(value))
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return dt.timestamp()
+
+
+if __name__ == "__main__":
+    # python -m database.feedback_stats --rebuild
+    stats = FeedbackStats()
+    if len(sys.argv) > 1 and sys.argv[1] == "--rebuild":
+        print(f"Replayed {stats.rebuild()} feedback and critique events")
+    else:
+        print(stats.get_stats())
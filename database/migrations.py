@@ -0,0 +1,40 @@
+from sqlalchemy import inspect, text
+from utils.logger import logger
+
+
+def ensure_columns(engine, table: str, columns: dict) -> list:
+    """
+    Add missing columns to an existing table; columns maps name -> SQL type (e.g. "TEXT").
+    create_all() never alters tables that already exist, so new columns go through here.
+    Returns the names of the columns added.
+    """
+    added = []
+    try:
+        existing = {c["name"] for c in inspect(engine).get_columns(table)}
+    except Exception as e:
+        logger.error(f"Could not inspect table {table}: {e}")
+        return added
+    for name, ddl in columns.items():
+        if name in existing:
+            continue
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+            added.append(name)
+            logger.info(f"Added column {table}.{name}")
+        except Exception as e:
+            # Another worker may have added it first
+            logger.warning(f"Could not add column {table}.{name}: {e}")
+    return added
+
+
+def ensure_indexes(engine, table) -> None:
+    """
+    Create any of the table's declared indexes that are missing (create_all skips
+    indexes on tables that already exist)
+    """
+    for index in table.indexes:
+        try:
+            index.create(bind=engine, checkfirst=True)
+        except Exception as e:
+            logger.warning(f"Could not create index {index.name}: {e}")
@@ -0,0 +1,159 @@
+import io
+import multiprocessing
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from database.pdf_extract import extract_pdf_pages, join_pages
+
+
+def _extract_job(data: bytes, mime: str, name: str) -> str:
+    # Runs in a worker process
+    from database.attachment_store import extract_text
+    return extract_text(io.BytesIO(data), mime, name)
+
+
+class OCRQueue:
+    """
+    Text extraction / OCR for uploaded files on a process pool, so a scanned PDF never
+    holds the GIL or a request worker. PDFs are split into page chunks that run in
+    parallel. Jobs are keyed (e.g. by content hash): a job submitted again while it is
+    running shares that result.
+    """
+
+    def __init__(self, workers: int = None, max_pending: int = None, pages_per_job: int = None):
+        self.workers = workers or settings.OCR_WORKERS
+        self.max_pending = max_pending or settings.OCR_MAX_PENDING
+        self.pages_per_job = max(pages_per_job or settings.PDF_PAGES_PER_JOB, 1)
+        self._executor = None
+        self._lock = threading.Lock()
+        # key -> {"waiters": [(on_done, on_pages)], "remaining": chunks left, "pages": {}, "text", "error"}
+        self._inflight = {}
+        self.stats = {"submitted": 0, "completed": 0, "failed": 0, "dropped": 0, "coalesced": 0,
+                      "page_jobs": 0, "pages": 0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn (default): forking a process that runs threads can copy held locks
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, mp_context=multiprocessing.get_context(settings.OCR_START_METHOD))
+        return self._executor
+
+    def _submit_job(self, fn, *args):
+        try:
+            return self._get_executor().submit(fn, *args)
+        except BrokenProcessPool:
+            # A worker died (e.g. the OCR engine crashed); start a fresh pool
+            self._executor = None
+            return self._get_executor().submit(fn, *args)
+
+    def submit(self, key: str, data: bytes, mime: str, name: str, on_done, pages: list = None,
+               on_pages=None) -> bool:
+        """
+        Queue an extraction; on_done(text, error, pages) is called from a background thread
+        when it finishes. With pages (PDF page numbers) the pages are extracted in parallel
+        chunks, on_pages({page: text}) gets each chunk as it lands and on_done gets every page.
+        Returns False (and never calls on_done) when the queue is full.
+        """
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is not None:
+                entry["waiters"].append((on_done, on_pages))
+                self.stats["coalesced"] += 1
+                return True
+            if len(self._inflight) >= self.max_pending:
+                self.stats["dropped"] += 1
+                logger.warning("OCR queue full; not extracting text")
+                return False
+            if pages:
+                chunks = [pages[i:i + self.pages_per_job] for i in range(0, len(pages), self.pages_per_job)]
+                jobs = [(extract_pdf_pages, (data, chunk)) for chunk in chunks]
+                self.stats["page_jobs"] += len(jobs)
+            else:
+                jobs = [(_extract_job, (data, mime, name))]
+            self._inflight[key] = {"waiters": [(on_done, on_pages)], "remaining": len(jobs), "pages": {},
+                                   "text": "", "error": None, "paged": bool(pages),
+                                   "started": time.perf_counter()}
+            self.stats["submitted"] += 1
+            try:
+                futures = [self._submit_job(fn, *args) for fn, args in jobs]
+            except Exception:
+                self._inflight.pop(key, None)
+                raise
+        for future in futures:
+            future.add_done_callback(lambda f: self._finish(key, f))
+        return True
+
+    def _finish(self, key: str, future) -> None:
+        if future.cancelled():
+            # Shutting down: the job stays pending in the store and is queued again on restart
+            with self._lock:
+                self._inflight.pop(key, None)
+            return
+        result, error = None, None
+        try:
+            result = future.result()
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            logger.error(f"Text extraction failed for {key}: {error}")
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._executor = None
+        with self._lock:
+            entry = self._inflight.get(key)
+            if entry is None:
+                return
+            if isinstance(result, dict):
+                entry["pages"].update(result)
+                self.stats["pages"] += len(result)
+            elif result:
+                entry["text"] = result
+            entry["error"] = entry["error"] or error
+            entry["remaining"] -= 1
+            done = entry["remaining"] <= 0
+            if done:
+                self._inflight.pop(key, None)
+                # A failed chunk only fails the job when nothing else was extracted
+                extracted = entry["text"] or any(entry["pages"].values())
+                error = None if extracted else entry["error"]
+                self.stats["failed" if error else "completed"] += 1
+            waiters = list(entry["waiters"])
+        if isinstance(result, dict):
+            for _, on_pages in waiters:
+                if on_pages:
+                    self._call(key, on_pages, result)
+        if not done:
+            return
+        metrics.observe("supportai_stage_seconds", time.perf_counter() - entry["started"], stage="ocr")
+        pages = entry["pages"] if entry["paged"] else None
+        text = join_pages(pages) if pages is not None else entry["text"]
+        for on_done, _ in waiters:
+            self._call(key, on_done, text, error, pages)
+
+    @staticmethod
+    def _call(key: str, fn, *args) -> None:
+        try:
+            fn(*args)
+        except Exception as e:
+            logger.error(f"Failed to store extracted text for {key}: {e}")
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._inflight)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return {**self.stats, "pending": len(self._inflight), "workers": self.workers}
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+ocr_queue = OCRQueue()
+metrics.register_collector(lambda: [("supportai_ocr_queue_pending", {}, ocr_queue.pending())])
@@ -0,0 +1,150 @@
+import io
+import re
+from config import settings
+from utils.logger import logger
+
+# Page references in a question: "page 12", "p. 12", "pages 40-45", "pp 3 to 5"
+_PAGE_REF = re.compile(r"\b(?:pages?|pp?\.?)\s*(\d{1,5})(?:\s*(?:-|–|to)\s*(\d{1,5}))?", re.IGNORECASE)
+_TERM = re.compile(r"[a-z0-9]{4,}")
+
+# Upper bound on pages one page-range reference can ask for
+_MAX_REF_SPAN = 50
+
+
+def pdf_page_count(data: bytes) -> int:
+    """
+    Number of pages, without parsing page contents; 0 when the file cannot be read
+    """
+    try:
+        import pypdfium2 as pdfium
+        pdf = pdfium.PdfDocument(data)
+        try:
+            return len(pdf)
+        finally:
+            pdf.close()
+    except Exception:
+        pass
+    try:
+        import pdfplumber
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            return len(pdf.pages)
+    except Exception as e:
+        logger.warning(f"Could not count PDF pages: {e}")
+        return 0
+
+
+def _ocr_page(raster, page_number: int) -> str:
+    # Scanned page: rasterize at OCR_PDF_DPI and run Tesseract on the image
+    import pytesseract
+    page = raster[page_number - 1]
+    try:
+        image = page.render(scale=settings.OCR_PDF_DPI / 72.0).to_pil()
+        return pytesseract.image_to_string(image) or ""
+    finally:
+        page.close()
+
+
+def extract_pdf_pages(data: bytes, pages: list, ocr: bool = True) -> dict:
+    """
+    {page number (1-based): text} for the given pages. Pages without a text layer are
+    rasterized and OCR'd when ocr is set. Runs in OCR worker processes, one call per chunk.
+    """
+    import pdfplumber
+    out = {}
+    raster = None
+    try:
+        with pdfplumber.open(io.BytesIO(data)) as pdf:
+            total = len(pdf.pages)
+            for n in pages:
+                if n < 1 or n > total:
+                    continue
+                text = ""
+                try:
+                    page = pdf.pages[n - 1]
+                    text = (page.extract_text() or "").strip()
+                    page.close()
+                except Exception as e:
+                    logger.warning(f"PDF text extraction failed on page {n}: {e}")
+                if not text and ocr:
+                    try:
+                        if raster is None:
+                            import pypdfium2 as pdfium
+                            raster = pdfium.PdfDocument(data)
+                        text = _ocr_page(raster, n).strip()
+                    except Exception as e:
+                        logger.warning(f"OCR failed on PDF page {n}: {e}")
+                out[n] = text
+    finally:
+        if raster is not None:
+            raster.close()
+    return out
+
+
+def join_pages(pages: dict, max_chars: int = 200000) -> str:
+    """
+    Page texts in page order as one document
+    """
+    text = "\n".join(pages[n] for n in sorted(pages) if pages[n])
+    return text[:max_chars]
+
+
+def page_refs(query: str) -> list:
+    """
+    Page numbers a question refers to, e.g. "what does page 42 say" -> [42]
+    """
+    refs = set()
+    for m in _PAGE_REF.finditer(query or ""):
+        start = int(m.group(1))
+        end = int(m.group(2)) if m.group(2) else start
+        if start > end:
+            start, end = end, start
+        refs.update(range(max(start, 1), min(end, start + _MAX_REF_SPAN - 1) + 1))
+    return sorted(refs)
+
+
+def query_terms(query: str) -> set:
+    return set(_TERM.findall((query or "").lower()))
+
+
+def eager_pages(page_count: int) -> list:
+    """
+    Pages extracted at upload time
+    """
+    return list(range(1, min(page_count, settings.PDF_EAGER_PAGES) + 1))
+
+
+def pages_to_extract(query: str, extracted: dict, page_count: int, skip=()) -> list:
+    """
+    Pages not extracted yet that a question needs: the pages it refers to, or, when none
+    of its terms appear in the extracted pages, the next PDF_LAZY_PAGES pages. Pages in
+    skip (the eager range, pages already queued) are never returned.
+    """
+    skip = set(skip)
+    refs = page_refs(query)
+    if refs:
+        return [n for n in refs if n <= page_count and n not in extracted and n not in skip]
+    terms = query_terms(query)
+    if not terms or len(extracted) >= page_count:
+        return []
+    if any(term in (text or "").lower() for text in extracted.values() for term in terms):
+        return []
+    remaining = [n for n in range(1, page_count + 1) if n not in extracted and n not in skip]
+    return remaining[:settings.PDF_LAZY_PAGES]
+
+
+def page_excerpt(pages: dict, query: str, max_chars: int = 600) -> str:
+    """
+    The part of a paged document that answers a question best: the pages it refers to,
+    otherwise the pages matching most of its terms, otherwise the beginning
+    """
+    refs = [n for n in page_refs(query) if pages.get(n)]
+    if refs:
+        chosen = refs
+    else:
+        terms = query_terms(query)
+        scored = sorted(((sum(t in (text or "").lower() for t in terms), n) for n, text in pages.items()),
+                        key=lambda s: (-s[0], s[1]))
+        chosen = sorted(n for score, n in scored[:3] if score > 0)
+    if not chosen:
+        return join_pages(pages, max_chars)
+    return "\n".join(f"[page {n}] {pages[n]}" for n in chosen)[:max_chars]
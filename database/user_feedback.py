@@ -1,6 +1,8 @@
-from sqlalchemy import create_engine, Column, Integer, Text, DateTime
-from sqlalchemy.orm import declarative_base, sessionmaker
+from sqlalchemy import Column, Integer, Text, DateTime
+from sqlalchemy.orm import declarative_base
 from config import settings
+from database.engine import get_engine, get_sessionmaker, session_scope, bulk_insert
+from database.migrations import ensure_indexes
 import datetime
 
 Base = declarative_base()
@@ -9,23 +11,24 @@ class UserFeedback(Base):
     __tablename__ = 'user_feedback'
     id = Column(Integer, primary_key=True)
     feedback = Column(Text)
-    timestamp = Column(DateTime, default=datetime.datetime.utcnow)
+    timestamp = Column(DateTime, default=datetime.datetime.utcnow, index=True)
 
 class FeedbackManager:
     def __init__(self):
-        self.engine = create_engine(settings.DATABASE_URL)
+        self.url = settings.DATABASE_URL
+        self.engine = get_engine(self.url)
         Base.metadata.create_all(self.engine)
-        self.Session = sessionmaker(bind=self.engine)
+        ensure_indexes(self.engine, UserFeedback.__table__)
+        self.Session = get_sessionmaker(self.url)
 
     def add_feedback(self, feedback_text):
-        session = self.Session()
-        feedback = UserFeedback(feedback=feedback_text)
-        session.add(feedback)
-        session.commit()
-        session.close()
+        self.add_feedback_many([feedback_text])
+
+    def add_feedback_many(self, feedback_texts):
+        with session_scope(self.url) as session:
+            bulk_insert(session, UserFeedback, [
+                {"feedback": text, "timestamp": datetime.datetime.utcnow()} for text in feedback_texts])
 
     def get_feedback(self, limit=20):
-        session = self.Session()
-        feedbacks = session.query(UserFeedback).order_by(UserFeedback.timestamp.desc()).limit(limit).all()
-        session.close()
-        return feedbacks
+        with self.Session() as session:
+            return session.query(UserFeedback).order_by(UserFeedback.timestamp.desc()).limit(limit).all()
@@ -0,0 +1,71 @@
+import hashlib
+import random
+from sqlalchemy import Column, Integer, String, insert, select, update
+from sqlalchemy.orm import declarative_base
+
+# Version counters for HTTP conditional GETs. Each store keeps the table in its own
+# database and bumps counters in the same transaction as the write, so every worker
+# sees a change the moment it commits.
+Base = declarative_base()
+
+# Random per-database value; reset when a store is wiped so old ETags can never match again
+EPOCH_KEY = "__epoch__"
+
+
+class ResourceVersion(Base):
+    __tablename__ = 'resource_versions'
+    key = Column(String(200), primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+def ensure_versions_table(engine) -> None:
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        if conn.execute(select(ResourceVersion.version).where(ResourceVersion.key == EPOCH_KEY)).first() is None:
+            _upsert(conn, EPOCH_KEY, random.randint(1, 2 ** 31 - 1), increment=False)
+
+
+def _upsert(conn, key: str, value: int, increment: bool = True) -> None:
+    table = ResourceVersion.__table__
+    dialect = (getattr(conn, "dialect", None) or conn.get_bind().dialect).name
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table).values(key=key, version=value)
+        new_value = table.c.version + 1 if increment else stmt.excluded.version
+        conn.execute(stmt.on_conflict_do_update(index_elements=[table.c.key], set_={"version": new_value}))
+        return
+    new_value = table.c.version + 1 if increment else value
+    if not conn.execute(update(table).where(table.c.key == key).values(version=new_value)).rowcount:
+        conn.execute(insert(table).values(key=key, version=value))
+
+
+def bump(session, *keys) -> None:
+    """
+    Increment the counters for keys (e.g. "chats", "chat:<id>") inside the caller's transaction
+    """
+    for key in sorted(set(keys)):
+        _upsert(session, key, 1)
+
+
+def reset_epoch(session) -> None:
+    _upsert(session, EPOCH_KEY, random.randint(1, 2 ** 31 - 1), increment=False)
+
+
+def read(session, *keys) -> tuple:
+    """
+    (epoch, version of each key); unknown keys are 0
+    """
+    rows = dict(session.execute(select(ResourceVersion.key, ResourceVersion.version)
+                                .where(ResourceVersion.key.in_((EPOCH_KEY,) + keys))).all())
+    return (rows.get(EPOCH_KEY, 0),) + tuple(rows.get(k, 0) for k in keys)
+
+
+def make_etag(versions: tuple, *variant) -> str:
+    """
+    Strong ETag for a resource version; variant covers query parameters that change the body
+    """
+    raw = "|".join(str(v) for v in versions + variant)
+    return '"' + hashlib.sha1(raw.encode("utf-8")).hexdigest()[:24] + '"'
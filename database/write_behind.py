@@ -0,0 +1,202 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+from utils.concurrency import run_io
+
+MODES = ("sync", "batched", "async")
+
+
+class WriteBehind:
+    """
+    Write-behind persistence: writes are queued and applied in batches, one transaction
+    per kind per batch, by a single flusher thread.
+
+    Durability modes:
+      sync    - apply immediately in the caller's transaction (no queue)
+      batched - queue, and the caller waits for its batch to commit (group commit)
+      async   - queue and return at once; committed within the flush interval
+    """
+
+    def __init__(self, mode: str = None, batch_size: int = None, flush_interval: float = None,
+                 max_pending: int = None):
+        self.mode = (mode or settings.WRITE_MODE).lower()
+        if self.mode not in MODES:
+            logger.warning(f"Unknown WRITE_MODE '{self.mode}'; using async")
+            self.mode = "async"
+        self.batch_size = batch_size or settings.WRITE_BATCH_SIZE
+        self.flush_interval = settings.WRITE_FLUSH_INTERVAL_MS / 1000.0 if flush_interval is None else flush_interval
+        self.max_pending = max_pending or settings.WRITE_MAX_PENDING
+        # kind -> bulk handler(items); kinds are applied in registration order within a batch
+        self._handlers = {}
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._inflight = 0
+        self._urgent = 0
+        self.stats = {"queued": 0, "applied": 0, "batches": 0, "failed": 0, "backpressure_waits": 0}
+        metrics.register_collector(lambda: [("supportai_write_queue_depth", {}, len(self._queue))])
+
+    def register(self, kind: str, handler) -> None:
+        """
+        handler(items) applies a list of queued items for this kind in one transaction
+        """
+        self._handlers[kind] = handler
+
+    # ----- producers -----
+    def put(self, kind: str, item, block: bool = True):
+        """
+        Queue one write; returns a Future resolved when its batch commits, or None
+        when the queue is full and block is False. Blocks (backpressure) otherwise.
+        """
+        if kind not in self._handlers:
+            raise KeyError(f"No write handler for '{kind}'")
+        fut = Future()
+        if self.mode == "sync":
+            try:
+                self._apply(kind, [item])
+                fut.set_result(None)
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Write-behind queue is closed")
+            if len(self._queue) >= self.max_pending:
+                if not block:
+                    return None
+                self.stats["backpressure_waits"] += 1
+                metrics.inc("supportai_write_backpressure_total")
+                while len(self._queue) >= self.max_pending and not self._closed:
+                    self._cond.wait()
+            self._queue.append((kind, item, fut))
+            self.stats["queued"] += 1
+            self._ensure_thread()
+            # Wake the flusher when work arrives and again when a batch is full
+            if len(self._queue) == 1 or len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return fut
+
+    async def submit(self, kind: str, item) -> None:
+        """
+        Queue a write from async code; waits for the commit only in batched mode
+        """
+        if self.mode == "sync":
+            await run_io(self._apply, kind, [item])
+            return
+        fut = self.put(kind, item, block=False)
+        if fut is None:
+            # Queue full: wait for room on a storage thread, not the event loop
+            fut = await run_io(self.put, kind, item, True)
+        if self.mode == "batched":
+            await asyncio.wrap_future(fut)
+
+    # ----- flushing -----
+    def _ensure_thread(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="write-behind", daemon=True)
+            self._thread.start()
+
+    def _loop(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closed:
+                    self._cond.wait()
+                if not self._queue and self._closed:
+                    return
+                # Let a batch accumulate until it is full or the oldest write is flush_interval old
+                deadline = time.monotonic() + self.flush_interval
+                while len(self._queue) < self.batch_size and not self._closed and not self._urgent:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+                self._inflight += 1
+                self._cond.notify_all()
+            try:
+                self._flush_batch(batch)
+            finally:
+                with self._cond:
+                    self._inflight -= 1
+                    self._cond.notify_all()
+
+    def _apply(self, kind: str, items: list) -> None:
+        with metrics.track(f"write_{kind}"):
+            self._handlers[kind](items)
+
+    def _flush_batch(self, batch: list) -> None:
+        by_kind = {}
+        for kind, item, fut in batch:
+            by_kind.setdefault(kind, []).append((item, fut))
+        metrics.observe("supportai_write_batch_size", len(batch))
+        with self._cond:
+            self.stats["batches"] += 1
+        for kind in self._handlers:
+            entries = by_kind.get(kind)
+            if not entries:
+                continue
+            try:
+                self._apply(kind, [item for item, _ in entries])
+                results = [(fut, None) for _, fut in entries]
+            except Exception as e:
+                # One bad row must not sink the batch: retry each write on its own
+                logger.warning(f"Batched {kind} write failed ({e}); retrying {len(entries)} writes individually")
+                results = []
+                for item, fut in entries:
+                    try:
+                        self._apply(kind, [item])
+                        results.append((fut, None))
+                    except Exception as item_err:
+                        logger.error(f"Dropped {kind} write: {item_err}")
+                        results.append((fut, item_err))
+            with self._cond:
+                for _, err in results:
+                    self.stats["failed" if err else "applied"] += 1
+            for fut, err in results:
+                if err is None:
+                    fut.set_result(None)
+                else:
+                    fut.set_exception(err)
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Block until everything queued so far is committed; returns False on timeout
+        """
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            # Stop waiting for batches to fill while a flush is requested
+            self._urgent += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._inflight:
+                    remaining = None if end is None else end - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining if remaining is not None else 0.1)
+            finally:
+                self._urgent -= 1
+        return True
+
+    def close(self, timeout: float = 30.0) -> None:
+        """
+        Flush pending writes and stop the flusher (called from the app lifespan)
+        """
+        flushed = self.flush(timeout)
+        with self._cond:
+            self._closed = True
+            pending = len(self._queue)
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if not flushed or pending:
+            logger.error(f"Write-behind shutdown left {pending} writes unflushed")
+
+    def get_stats(self) -> dict:
+        with self._cond:
+            return {"mode": self.mode, "pending": len(self._queue), **self.stats}
@@ -0,0 +1,134 @@
+import threading
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+
+# One configured SDK, one pooled REST session and one model object per
+# (model name, generation config) for the whole process
+_lock = threading.Lock()
+_configured = False
+_models = {}
+# Updated from every LLM thread at once; a separate lock keeps counting off the configure path
+_stats_lock = threading.Lock()
+stats = {"requests": 0, "fallbacks": 0, "errors": 0}
+
+
+def _count(key: str) -> None:
+    with _stats_lock:
+        stats[key] += 1
+
+
+def get_stats() -> dict:
+    with _stats_lock:
+        return dict(stats)
+
+
+def _configure() -> None:
+    global _configured
+    if _configured:
+        return
+    with _lock:
+        if _configured:
+            return
+        import google.generativeai as genai
+        # Force API key path (no ADC) and REST transport
+        genai.configure(api_key=settings.GEMINI_API_KEY, transport="rest")
+        logger.info(f"Gemini client configured (key loaded: {bool(settings.GEMINI_API_KEY)})")
+        _tune_http_pool()
+        _configured = True
+
+
+def _tune_http_pool() -> None:
+    # The REST transport keeps a requests session alive; size its pool to the
+    # LLM concurrency so parallel calls reuse connections instead of re-handshaking
+    try:
+        from requests.adapters import HTTPAdapter
+        from google.generativeai import client as genai_client
+        session = genai_client.get_default_generative_client()._transport._session
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=settings.GEMINI_HTTP_POOL_SIZE)
+        session.mount("https://", adapter)
+    except Exception as e:
+        logger.warning(f"Could not resize Gemini HTTP pool: {e}")
+
+
+def get_model(model_name: str, generation_config: dict = None):
+    """
+    Return a cached GenerativeModel for this model name and generation config
+    """
+    key = (model_name, tuple(sorted((generation_config or {}).items())))
+    model = _models.get(key)
+    if model is None:
+        _configure()
+        import google.generativeai as genai
+        model = genai.GenerativeModel(model_name=model_name, generation_config=generation_config)
+        with _lock:
+            model = _models.setdefault(key, model)
+    return model
+
+
+def extract_text(result, sep: str = "\n", strip: bool = True) -> str:
+    """
+    Safely extract text, since result.text can fail when no valid Part exists
+    """
+    text = None
+    try:
+        if getattr(result, 'text', None):
+            text = result.text or ""
+    except Exception:
+        text = None
+
+    if not text:
+        try:
+            candidates = getattr(result, 'candidates', None) or []
+            if candidates:
+                parts = getattr(candidates[0], 'content', None)
+                if parts and getattr(parts, 'parts', None):
+                    texts = [getattr(p, 'text', '') for p in parts.parts]
+                    text = sep.join([t for t in texts if t])
+        except Exception:
+            text = None
+    text = text or ""
+    return text.strip() if strip else text
+
+
+def _is_not_found(e: Exception) -> bool:
+    return '404' in str(e) or 'not found' in str(e).lower()
+
+
+def _model_chain(models: list = None) -> list:
+    return list(models or settings.GEMINI_MODEL_CHAIN)
+
+
+def generate(prompt: str, generation_config: dict = None, models: list = None, **kwargs):
+    """
+    generate_content with the configured model fallback chain (next model on 404)
+    """
+    chain = _model_chain(models)
+    for i, name in enumerate(chain):
+        try:
+            _count("requests")
+            return get_model(name, generation_config).generate_content(prompt, **kwargs)
+        except Exception as e:
+            if _is_not_found(e) and i < len(chain) - 1:
+                _count("fallbacks")
+                metrics.inc("supportai_llm_fallbacks_total", model=name)
+                logger.warning(f"Model {name} unavailable; falling back to {chain[i + 1]}")
+                continue
+            _count("errors")
+            raise
+
+
+def generate_text(prompt: str, generation_config: dict = None, models: list = None, sep: str = "\n") -> str:
+    return extract_text(generate(prompt, generation_config, models), sep=sep)
+
+
+def stream_text(prompt: str, generation_config: dict = None, models: list = None):
+    """
+    Yield text chunks from a streamed response
+    """
+    response = generate(prompt, generation_config, models, stream=True)
+    for chunk in response:
+        # chunk.text raises when a chunk carries no valid Part (e.g. safety stop)
+        text = extract_text(chunk, sep="", strip=False)
+        if text:
+            yield text
@@ -0,0 +1,217 @@
+import math
+import random
+import re
+import threading
+import time
+from config import settings
+from llms import gemini_client
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+class LLMProviderError(Exception):
+    pass
+
+
+class RateLimitError(LLMProviderError):
+    pass
+
+
+class LLMProvider:
+    """
+    Interface used by the researcher, summarizer, critic and title generator.
+    Subclasses implement _generate/_stream; the public methods add metrics.
+    """
+    name = "base"
+
+    def _generate(self, prompt: str, generation_config: dict = None, sep: str = "\n") -> str:
+        raise NotImplementedError
+
+    def _stream(self, prompt: str, generation_config: dict = None):
+        # Providers without native streaming yield the whole answer at once
+        text = self._generate(prompt, generation_config)
+        if text:
+            yield text
+
+    def _record_error(self, e: Exception) -> None:
+        kind = "rate_limit" if isinstance(e, RateLimitError) or "429" in str(e) else "error"
+        metrics.inc("supportai_llm_errors_total", provider=self.name, kind=kind)
+
+    def generate(self, prompt: str, generation_config: dict = None, sep: str = "\n") -> str:
+        metrics.inc("supportai_llm_requests_total", provider=self.name)
+        metrics.observe("supportai_llm_prompt_chars", len(prompt or ""), provider=self.name)
+        try:
+            text = self._generate(prompt, generation_config, sep)
+        except Exception as e:
+            self._record_error(e)
+            raise
+        metrics.observe("supportai_llm_response_chars", len(text or ""), provider=self.name)
+        return text
+
+    def stream(self, prompt: str, generation_config: dict = None):
+        metrics.inc("supportai_llm_requests_total", provider=self.name)
+        metrics.observe("supportai_llm_prompt_chars", len(prompt or ""), provider=self.name)
+        size = 0
+        try:
+            for chunk in self._stream(prompt, generation_config):
+                size += len(chunk)
+                yield chunk
+        except Exception as e:
+            self._record_error(e)
+            raise
+        metrics.observe("supportai_llm_response_chars", size, provider=self.name)
+
+    def get_stats(self) -> dict:
+        return {}
+
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def _generate(self, prompt: str, generation_config: dict = None, sep: str = "\n") -> str:
+        return gemini_client.generate_text(prompt, generation_config=generation_config, sep=sep)
+
+    def _stream(self, prompt: str, generation_config: dict = None):
+        yield from gemini_client.stream_text(prompt, generation_config=generation_config)
+
+    def get_stats(self) -> dict:
+        return gemini_client.get_stats()
+
+
+class FakeProvider(LLMProvider):
+    """
+    Offline stand-in for Gemini: canned, correctly formatted answers with
+    configurable latency, error rate and 429 injection. Seeded for repeatability.
+    """
+    name = "fake"
+
+    def __init__(self, latency_ms: float = None, latency_dist: str = None, latency_sigma: float = None,
+                 error_rate: float = None, rate_limit_rate: float = None, token_ms: float = None,
+                 seed: int = None):
+        self.latency_ms = settings.FAKE_LLM_LATENCY_MS if latency_ms is None else latency_ms
+        self.latency_dist = (latency_dist or settings.FAKE_LLM_LATENCY_DIST).lower()
+        self.latency_sigma = settings.FAKE_LLM_LATENCY_SIGMA if latency_sigma is None else latency_sigma
+        self.error_rate = settings.FAKE_LLM_ERROR_RATE if error_rate is None else error_rate
+        self.rate_limit_rate = settings.FAKE_LLM_429_RATE if rate_limit_rate is None else rate_limit_rate
+        self.token_ms = settings.FAKE_LLM_TOKEN_MS if token_ms is None else token_ms
+        self._rng = random.Random(settings.FAKE_LLM_SEED if seed is None else seed)
+        self._lock = threading.Lock()
+        self.stats = {"calls": 0, "errors": 0, "rate_limited": 0}
+
+    # ----- behaviour knobs -----
+    def _random(self) -> float:
+        with self._lock:
+            return self._rng.random()
+
+    def sample_latency(self) -> float:
+        """
+        Latency in seconds drawn from the configured distribution
+        """
+        mean = max(self.latency_ms, 0) / 1000.0
+        if mean == 0:
+            return 0.0
+        with self._lock:
+            if self.latency_dist == "fixed":
+                value = mean
+            elif self.latency_dist == "uniform":
+                value = self._rng.uniform(mean * (1 - self.latency_sigma), mean * (1 + self.latency_sigma))
+            elif self.latency_dist == "exponential":
+                value = self._rng.expovariate(1.0 / mean)
+            else:
+                # lognormal with the configured mean
+                mu = math.log(mean) - self.latency_sigma ** 2 / 2
+                value = self._rng.lognormvariate(mu, self.latency_sigma)
+        return max(value, 0.0)
+
+    def _begin_call(self) -> None:
+        with self._lock:
+            self.stats["calls"] += 1
+        time.sleep(self.sample_latency())
+        roll = self._random()
+        if roll < self.rate_limit_rate:
+            with self._lock:
+                self.stats["rate_limited"] += 1
+            raise RateLimitError("429 Resource has been exhausted (fake provider)")
+        if roll < self.rate_limit_rate + self.error_rate:
+            with self._lock:
+                self.stats["errors"] += 1
+            raise LLMProviderError("500 Internal error (fake provider)")
+
+    # ----- canned content -----
+    @staticmethod
+    def _topic(prompt: str) -> str:
+        m = re.findall(r"User(?: Query)?: (.+)", prompt)
+        topic = (m[-1] if m else "your request").strip()
+        return topic[:80]
+
+    def respond(self, prompt: str) -> str:
+        if "Evaluate this chatbot response" in prompt:
+            return "Score: 4/5\nEvaluation: Clear, friendly and actionable answer."
+        if "chat title" in prompt:
+            # Batched title prompts number each conversation; answer one line per number
+            users = re.findall(r"^(\d+)\. User: (.*)$", prompt, re.M)
+            if not users:
+                return "Support Question Overview"
+            return "\n".join(f"{n}. {' '.join(text.split()[:4]).title()} Help" for n, text in users)
+        topic = self._topic(prompt)
+        return (
+            "## Summary\n"
+            f"Here is how to handle: {topic}.\n\n"
+            "## Steps\n"
+            "1. Open your account settings.\n"
+            "2. Select the relevant section.\n"
+            "3. Follow the on-screen instructions.\n\n"
+            "## Tips/Notes\n"
+            "- Keep your order or account number handy.\n\n"
+            "## Next Steps / Resources\n"
+            "- Contact support if the issue persists."
+        )
+
+    def _generate(self, prompt: str, generation_config: dict = None, sep: str = "\n") -> str:
+        self._begin_call()
+        return self.respond(prompt)
+
+    def _stream(self, prompt: str, generation_config: dict = None):
+        # Initial latency is time-to-first-token; then one chunk per word
+        self._begin_call()
+        words = re.split(r"(\s+)", self.respond(prompt))
+        delay = max(self.token_ms, 0) / 1000.0
+        for i in range(0, len(words), 2):
+            chunk = "".join(words[i:i + 2])
+            if chunk:
+                if delay and i:
+                    time.sleep(delay)
+                yield chunk
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+_PROVIDERS = {"gemini": GeminiProvider, "fake": FakeProvider}
+_provider = None
+_provider_lock = threading.Lock()
+
+
+def get_provider() -> LLMProvider:
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                name = settings.LLM_PROVIDER
+                cls = _PROVIDERS.get(name)
+                if cls is None:
+                    logger.warning(f"Unknown LLM_PROVIDER '{name}'; using gemini")
+                    cls = GeminiProvider
+                _provider = cls()
+                logger.info(f"LLM provider: {_provider.name}")
+    return _provider
+
+
+def set_provider(provider: LLMProvider) -> None:
+    """
+    Swap the active provider (benchmarks, load tests)
+    """
+    global _provider
+    with _provider_lock:
+        _provider = provider
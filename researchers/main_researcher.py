@@ -1,26 +1,20 @@
-import google.generativeai as genai
-from config import settings
+from llms.providers import get_provider
 from utils.logger import logger
 
-# Configure Gemini (force API key path, avoid ADC)
-genai.configure(api_key=settings.GEMINI_API_KEY, transport="rest")
+GENERATION_CONFIG = {'temperature': 0.4, 'max_output_tokens': 800}
 
-print("Gemini key loaded:", bool(settings.GEMINI_API_KEY))
+FALLBACK_ANSWER = "I'm having trouble processing that right now. Could you please rephrase your question?"
 
 
-def handle_universal_query(query: str, conversation_history: list = None) -> dict:
-    """
-    Universal researcher that handles ALL types of queries using Gemini 2.5 Flash
-    """
-    try:
-        # Build conversation context
-        context = ""
-        if conversation_history:
-            context = "\n".join(
-                [f"User: {h['user']}\nBot: {h['bot']}" for h in conversation_history[-3:]])
-
-        # System prompt for structured, helpful answers
-        system_instruction = """You are a friendly, helpful AI assistant for customer support.
+def _build_prompt(query: str, conversation_history: list = None) -> str:
+    # Build conversation context
+    context = ""
+    if conversation_history:
+        context = "\n".join(
+            [f"User: {h['user']}\nBot: {h['bot']}" for h in conversation_history[-3:]])
+
+    # System prompt for structured, helpful answers
+    system_instruction = """You are a friendly, helpful AI assistant for customer support.
 Return answers in clean, scannable Markdown like ChatGPT/Gemini.
 
 Formatting (STRICT):
@@ -36,26 +30,21 @@ Formatting (STRICT):
 - Be concise and actionable; do not invent facts.
 """
 
-        # Prepare the full prompt
-        full_prompt = f"{system_instruction}\n\nConversation history:\n{context}\n\nUser: {query}\n\nAssistant:"
-
-        # Build and call model (fallback to widely available 8B tier, then pro)
-        model = genai.GenerativeModel(
-            model_name='gemini-2.5-flash',
-            generation_config={'temperature': 0.4, 'max_output_tokens': 800}
-        )
-        try:
-            response = model.generate_content(full_prompt)
-        except Exception as e:
-            if '404' in str(e) or 'not found' in str(e).lower():
-                model = genai.GenerativeModel(
-                    model_name='gemini-2.5-flash',
-                    generation_config={'temperature': 0.4, 'max_output_tokens': 800}
-                )
-                response = model.generate_content(full_prompt)
-            else:
-                raise
-        answer = response.text.strip()
+    # Prepare the full prompt
+    return f"{system_instruction}\n\nConversation history:\n{context}\n\nUser: {query}\n\nAssistant:"
+
+
+def handle_universal_query(query: str, conversation_history: list = None) -> dict:
+    """
+    Universal researcher that handles ALL types of queries using Gemini 2.5 Flash
+    """
+    try:
+        full_prompt = _build_prompt(query, conversation_history)
+
+        # Provider handles model caching and the 404 fallback chain
+        answer = get_provider().generate(full_prompt, generation_config=GENERATION_CONFIG)
+        if not answer:
+            raise ValueError("Gemini returned no text")
 
         logger.info(f"Universal researcher handled query: {query[:50]}...")
 
@@ -68,8 +57,30 @@ Formatting (STRICT):
     except Exception as e:
         logger.error(f"Error in universal researcher: {e}")
         return {
-            "response": "I'm having trouble processing that right now. Could you please rephrase your question?",
+            "response": FALLBACK_ANSWER,
             "query": query,
             "status": "error",
             "error": str(e)
         }
+
+
+def stream_universal_query(query: str, conversation_history: list = None):
+    """
+    Streaming variant of handle_universal_query; yields answer text chunks as Gemini produces them.
+    A failure before any output yields FALLBACK_ANSWER; a failure part-way through is re-raised,
+    since the chunks already sent are not a complete answer.
+    """
+    produced = False
+    try:
+        full_prompt = _build_prompt(query, conversation_history)
+        for text in get_provider().stream(full_prompt, generation_config=GENERATION_CONFIG):
+            produced = True
+            yield text
+
+        logger.info(f"Universal researcher streamed query: {query[:50]}...")
+
+    except Exception as e:
+        logger.error(f"Error in universal researcher stream: {e}")
+        if produced:
+            raise
+        yield FALLBACK_ANSWER
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, ROOT)
+
+# Settings are read when config is first imported: point every store at a scratch
+# directory and use the offline LLM backend and in-memory attachments
+_TMP = tempfile.mkdtemp(prefix="csai-tests-")
+os.environ.update({
+    "LLM_PROVIDER": "fake",
+    "FAKE_LLM_LATENCY_MS": "0",
+    "FAKE_LLM_TOKEN_MS": "0",
+    "ATTACHMENT_BACKEND": "memory",
+    "DATABASE_URL": f"sqlite:///{os.path.join(_TMP, 'test.db')}",
+    "CHATS_FILE": os.path.join(_TMP, "chats_data.json"),
+    "FEEDBACK_STORE": os.path.join(_TMP, "feedback_data.json"),
+    "OCR_WORKERS": "1",
+})
@@ -0,0 +1,134 @@
+import threading
+
+import pytest
+
+from agents import summarizer_agent
+from agents.summarizer_agent import meets_format_contract, summarize_output
+from agents.title_queue import TitleQueue, heuristic_title_from_text
+from config import settings
+from database.chat_store import ChatStore
+from llms import providers
+from llms.providers import FakeProvider
+
+WELL_FORMED = """## Summary
+Reset it from the login page.
+
+## Steps
+1. Click "Forgot password".
+2. Follow the emailed link.
+
+## Tips/Notes
+- The link expires after an hour.
+
+## Next Steps / Resources
+- Contact support if no email arrives."""
+
+
+@pytest.mark.parametrize("text", [
+    WELL_FORMED,
+    WELL_FORMED.replace("## Steps", "**Key Points**"),
+    WELL_FORMED.replace("## Summary", "1. Summary:").replace("## Next Steps / Resources", "### 4. Next Steps"),
+])
+def test_contract_accepts_the_four_sections_in_order(text):
+    assert meets_format_contract(text)
+
+
+@pytest.mark.parametrize("text", [
+    "",
+    "Just reset it from the login page.",
+    WELL_FORMED.replace("## Tips/Notes\n- The link expires after an hour.\n\n", ""),
+    WELL_FORMED.replace("## Summary\nReset it from the login page.", "## Summary"),
+    WELL_FORMED.replace("## Steps", "## Tips/Notes", 1),
+    WELL_FORMED + "\n## Summary\nAgain.",
+    "```\n" + WELL_FORMED + "\n```",
+])
+def test_contract_rejects_missing_empty_or_misordered_sections(text):
+    assert not meets_format_contract(text)
+
+
+@pytest.fixture
+def provider(monkeypatch):
+    fake = FakeProvider(latency_ms=0, error_rate=0, rate_limit_rate=0)
+    monkeypatch.setattr(providers, "_provider", fake)
+    monkeypatch.setattr(settings, "SUMMARIZER_FORCE_TWO_PASS", False)
+    return fake
+
+
+def test_well_formed_research_skips_the_summarizer_call(provider):
+    before = summarizer_agent.get_summarizer_stats()["fast_path"]
+    assert summarize_output({"response": WELL_FORMED + "\n"}) == WELL_FORMED
+    assert provider.get_stats()["calls"] == 0
+    assert summarizer_agent.get_summarizer_stats()["fast_path"] == before + 1
+
+
+@pytest.mark.parametrize("routing", [
+    {"response": "Just reset it from the login page."},
+    {"response": WELL_FORMED, "resummarize": True},
+    {"response": WELL_FORMED, "feedback_guidance": "Be shorter"},
+])
+def test_other_answers_take_the_second_pass(provider, routing):
+    out = summarize_output(dict(routing))
+    assert provider.get_stats()["calls"] == 1
+    assert out.startswith("## Summary")
+
+
+def test_forced_two_pass(provider, monkeypatch):
+    monkeypatch.setattr(settings, "SUMMARIZER_FORCE_TWO_PASS", True)
+    summarize_output({"response": WELL_FORMED})
+    assert provider.get_stats()["calls"] == 1
+
+
+# ----- chat titles -----
+def test_heuristic_title():
+    assert heuristic_title_from_text("My order never arrived. It was due Monday") == "My order never arrived"
+    assert heuristic_title_from_text("one two three four five six seven eight nine ten") == \
+        "one two three four five six seven eight"
+    assert heuristic_title_from_text("   ") == "Untitled"
+
+
+def test_titles_are_generated_in_batches_with_one_llm_call(provider):
+    done = []
+    finished = threading.Event()
+    queue = TitleQueue(batch_size=3, interval=5, max_pending=10)
+
+    def on_done(chat_id, heuristic, title):
+        done.append((chat_id, heuristic, title))
+        if len(done) == 3:
+            finished.set()
+
+    try:
+        for n, text in enumerate(["refund my order", "app crashes on start", "change my email"]):
+            assert queue.submit(f"c{n}", text, "answer", heuristic_title_from_text(text), on_done)
+        # A full batch is titled without waiting for the interval
+        assert finished.wait(2)
+    finally:
+        queue.shutdown()
+    assert provider.get_stats()["calls"] == 1
+    assert done[0] == ("c0", "refund my order", "Refund My Order Help")
+    assert queue.get_stats()["titled"] == 3
+
+
+def test_full_title_queue_keeps_the_heuristic_title():
+    queue = TitleQueue(batch_size=10, interval=60, max_pending=1)
+    try:
+        assert queue.submit("a", "q", "a", "q", lambda *args: None)
+        assert queue.submit("a", "q", "a", "q", lambda *args: None)
+        assert not queue.submit("b", "q", "a", "q", lambda *args: None)
+    finally:
+        queue.shutdown()
+    assert queue.get_stats()["dropped"] == 1
+    assert not queue.submit("c", "q", "a", "q", lambda *args: None)
+
+
+def test_llm_title_replaces_only_the_heuristic_it_was_made_for(tmp_path):
+    store = ChatStore(f"sqlite:///{tmp_path / 'chats.db'}")
+    store.append_exchanges([("c1", "refund my order", "answer", "m1"), ("c2", "hi", "hello", "m2")])
+    store.set_titles([("c1", "refund my order"), ("c2", "hi")])
+    # Default titles only: a chat that already has a title keeps it
+    store.set_titles([("c2", "Other")])
+    assert store.get_title("c2") == "hi"
+    # c2's title changed after its LLM title was requested
+    store.upgrade_titles([("c2", "hi", "Manual name")])
+    store.upgrade_titles([("c1", "refund my order", "Order Refund Request"), ("c2", "hi", "Greeting")])
+    assert store.get_title("c1") == "Order Refund Request"
+    assert store.get_title("c2") == "Manual name"
@@ -0,0 +1,276 @@
+import asyncio
+import json
+import time
+import uuid
+
+import httpx
+import pytest
+
+import app as app_module
+from benchmarks.bench_pdf_extraction import make_pdf
+from config import settings
+from database import attachment_store as store_module
+from database.pdf_extract import join_pages
+from llms import providers
+from llms.providers import FakeProvider
+
+
+def _run(scenario):
+    """
+    Run scenario(client) against the app in-process
+    """
+    async def main():
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            return await scenario(client)
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def ocr_jobs(monkeypatch):
+    # Capture OCR jobs instead of running them, so tests decide when each one lands
+    submitted = []
+
+    def submit(key, data, mime, name, on_done, pages=None, on_pages=None):
+        submitted.append({"key": key, "pages": pages, "on_done": on_done, "on_pages": on_pages})
+        return True
+    monkeypatch.setattr(store_module.ocr_queue, "submit", submit)
+    return submitted
+
+
+async def _query(client, query, chat_id, **extra):
+    payload = {"query": query, "chat_id": chat_id, "session_id": uuid.uuid4().hex, **extra}
+    r = await client.post("/query", json=payload)
+    assert r.status_code == 200
+    return r.json()
+
+
+def test_answer_built_before_attachment_text_is_not_cached(ocr_jobs, monkeypatch):
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    monkeypatch.setattr(settings, "OCR_QUERY_WAIT_MS", 20)
+    monkeypatch.setattr(settings, "OCR_POLL_MS", 5)
+    chat_id = uuid.uuid4().hex
+
+    async def scenario(client):
+        r = await client.post("/api/upload", data={"chat_id": chat_id},
+                              files=[("files", ("receipt.png", b"\x89PNG" + uuid.uuid4().bytes, "image/png"))])
+        file_id = r.json()["attachments"][0]["id"]
+        assert r.json()["attachments"][0]["status"] == "pending"
+
+        entries = app_module.response_cache.get_stats()["entries"]
+        await _query(client, "what is the receipt total", chat_id, attachments=[file_id])
+        assert app_module.response_cache.get_stats()["entries"] == entries
+
+        ocr_jobs[0]["on_done"]("Receipt total 42 dollars", None, None)
+        assert (await client.get(f"/api/attachment/{file_id}/status")).json()["status"] == "done"
+        await _query(client, "what is the receipt total", chat_id, attachments=[file_id])
+        assert app_module.response_cache.get_stats()["entries"] == entries + 1
+    _run(scenario)
+
+
+def test_only_pages_a_question_names_are_waited_for(ocr_jobs, monkeypatch):
+    monkeypatch.setattr(settings, "OCR_QUERY_WAIT_MS", 300)
+    monkeypatch.setattr(settings, "OCR_POLL_MS", 5)
+    chat_id = uuid.uuid4().hex
+
+    async def scenario(client):
+        r = await client.post("/api/upload", data={"chat_id": chat_id},
+                              files=[("files", ("manual.pdf", make_pdf(40, lines_per_page=1), "application/pdf"))])
+        file_id = r.json()["attachments"][0]["id"]
+
+        def finish(job):
+            pages = {n: f"intro page {n}" for n in job["pages"]}
+            job["on_pages"](pages)
+            job["on_done"](join_pages(pages), None, pages)
+        finish(ocr_jobs[0])
+
+        # A term miss queues the next pages in the background and answers right away
+        start = time.perf_counter()
+        await _query(client, "how do I upgrade my subscription", chat_id, attachments=[file_id])
+        assert time.perf_counter() - start < 0.25
+        assert len(ocr_jobs) == 2 and len(ocr_jobs[1]["pages"]) == settings.PDF_LAZY_PAGES
+        finish(ocr_jobs[1])
+
+        # A page the question names is waited for
+        start = time.perf_counter()
+        await _query(client, "what does page 35 say", chat_id, attachments=[file_id])
+        assert time.perf_counter() - start >= 0.3
+        assert ocr_jobs[2]["pages"] == [35]
+    _run(scenario)
+
+
+def test_slow_llm_calls_do_not_block_the_event_loop(monkeypatch):
+    monkeypatch.setattr(providers, "_provider",
+                        FakeProvider(latency_ms=150, latency_dist="fixed", error_rate=0, rate_limit_rate=0))
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(settings, "CRITIC_MODE", "inline")
+
+    async def scenario(client):
+        gaps = []
+
+        async def heartbeat(stop):
+            last = time.perf_counter()
+            while not stop.is_set():
+                await asyncio.sleep(0.01)
+                now = time.perf_counter()
+                gaps.append(now - last)
+                last = now
+
+        stop = asyncio.Event()
+        beat = asyncio.create_task(heartbeat(stop))
+        start = time.perf_counter()
+        results = await asyncio.gather(*(_query(client, f"question {uuid.uuid4().hex}", uuid.uuid4().hex)
+                                         for _ in range(3)))
+        elapsed = time.perf_counter() - start
+        stop.set()
+        await beat
+        assert all(r["summary"] for r in results)
+        # Three requests with several 150 ms LLM calls each ran side by side, and the loop
+        # kept ticking every 10 ms meanwhile
+        assert providers._provider.get_stats()["calls"] >= 6
+        assert elapsed < 0.15 * providers._provider.get_stats()["calls"]
+        assert max(gaps) < 0.1
+    _run(scenario)
+
+
+def _events(body: str) -> list:
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.splitlines())
+        events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+
+def test_stream_sends_tokens_then_the_answer(monkeypatch):
+    monkeypatch.setattr(app_module, "route_query_stream", lambda query, history: iter(["Restart ", "the router."]))
+    monkeypatch.setattr(app_module, "summarize_output", lambda routed: f"## Summary\n{routed['response']}")
+    monkeypatch.setattr(app_module, "provide_feedback", lambda summary, query: {"feedback": "Score: 4/5"})
+    monkeypatch.setattr(settings, "CRITIC_MODE", "inline")
+
+    async def scenario(client):
+        r = await client.post("/query", headers={"Accept": "text/event-stream"},
+                              json={"query": "my router keeps dropping", "session_id": uuid.uuid4().hex})
+        assert r.headers["content-type"].startswith("text/event-stream")
+        return _events(r.text)
+    events = _run(scenario)
+    assert [name for name, _ in events] == ["stage", "token", "token", "stage", "answer", "done"]
+    assert "".join(data["text"] for name, data in events if name == "token") == "Restart the router."
+    assert events[4][1]["summary"] == "## Summary\nRestart the router."
+    assert events[5][1]["feedback"] == "Score: 4/5" and events[5][1]["chat_id"]
+
+
+def test_stream_rejects_a_body_that_is_not_a_json_object():
+    async def scenario(client):
+        headers = {"Accept": "text/event-stream", "Content-Type": "application/json"}
+        for body in (b"{not json", b'["how do I reset my router"]'):
+            r = await client.post("/query/stream", headers=headers, content=body)
+            assert r.status_code == 400
+            assert r.json() == {"summary": "", "feedback": "Invalid JSON"}
+    _run(scenario)
+
+
+class _FailingStreamProvider:
+    def stream(self, prompt, generation_config=None):
+        yield "The first half of an answer"
+        raise RuntimeError("connection reset")
+
+
+def test_stream_failure_after_partial_output_is_an_error(monkeypatch):
+    from researchers import main_researcher
+    monkeypatch.setattr(main_researcher, "get_provider", lambda: _FailingStreamProvider())
+    monkeypatch.setattr(settings, "RESPONSE_CACHE_ENABLED", True)
+    session_id = uuid.uuid4().hex
+
+    async def scenario(client):
+        entries = app_module.response_cache.get_stats()["entries"]
+        r = await client.post("/query/stream", headers={"Accept": "text/event-stream"},
+                              json={"query": "how do I reset my router", "session_id": session_id})
+        assert "event: token" in r.text
+        assert "event: error" in r.text
+        assert "event: answer" not in r.text
+        assert app_module.response_cache.get_stats()["entries"] == entries
+    _run(scenario)
+    assert app_module.session_store.get(session_id) == []
+
+
+def test_inline_critic_score_is_not_written_on_the_event_loop(monkeypatch):
+    import threading
+    monkeypatch.setattr(settings, "CRITIC_MODE", "inline")
+    monkeypatch.setattr(app_module.critic_queue, "should_sample", lambda: True)
+    monkeypatch.setattr(app_module, "provide_feedback", lambda summary, query: {"feedback": "Score: 4/5\nClear."})
+    monkeypatch.setattr(app_module.writes, "mode", "sync")
+    applied = []
+    apply = app_module.writes._apply
+
+    def record(kind, items):
+        applied.append((kind, threading.current_thread()))
+        return apply(kind, items)
+    monkeypatch.setattr(app_module.writes, "_apply", record)
+
+    async def scenario(client):
+        result = await _query(client, "how do I update my billing address", uuid.uuid4().hex)
+        assert result["critique"] == "done"
+    _run(scenario)
+    scores = [thread for kind, thread in applied if kind == "feedback_stats"]
+    assert scores and threading.main_thread() not in scores
+
+
+def test_metrics_endpoint_reports_pipeline_stages():
+    async def scenario(client):
+        await _query(client, f"question {uuid.uuid4().hex}", uuid.uuid4().hex)
+        return await client.get("/metrics")
+    r = _run(scenario)
+    assert r.status_code == 200 and r.headers["content-type"].startswith("text/plain")
+    assert 'supportai_stage_seconds_count{stage="researcher"}' in r.text
+    assert 'supportai_http_request_seconds_count{method="POST",route="/query",status="200"}' in r.text
+
+
+async def _settle():
+    # Let titles and writes queued by earlier tests land before taking tags
+    deadline = time.monotonic() + 5
+    while app_module.title_queue.get_stats()["pending"] and time.monotonic() < deadline:
+        await asyncio.sleep(0.01)
+    await asyncio.sleep(0.05)
+    await asyncio.to_thread(app_module.writes.flush, 5)
+
+
+async def _revalidate(client, url):
+    first = await client.get(url)
+    assert first.status_code == 200
+    etag = first.headers["ETag"]
+    again = await client.get(url, headers={"If-None-Match": etag})
+    assert again.status_code == 304 and again.headers["ETag"] == etag and not again.content
+    return etag
+
+
+def test_conditional_gets_revalidate_until_a_write(monkeypatch):
+    # Background titles and critiques also bump a chat's version; keep them out of the way
+    monkeypatch.setattr(settings, "CRITIC_MODE", "off")
+    monkeypatch.setattr(app_module.title_queue, "submit", lambda *args: True)
+
+    async def scenario(client):
+        await _settle()
+        chat_id = (await client.post("/api/chat/new")).json()["id"]
+        list_etag = await _revalidate(client, "/api/chats")
+        chat_etag = await _revalidate(client, f"/api/chat/{chat_id}")
+        history_etag = await _revalidate(client, "/api/history")
+        # Different pages of the same resource have different tags
+        paged = await client.get(f"/api/chat/{chat_id}?limit=1", headers={"If-None-Match": chat_etag})
+        assert paged.status_code == 200
+
+        await _query(client, "how do I reset my password", chat_id)
+        await asyncio.to_thread(app_module.writes.flush, 5)
+        for url, etag in (("/api/chats", list_etag), (f"/api/chat/{chat_id}", chat_etag),
+                          ("/api/history", history_etag)):
+            r = await client.get(url, headers={"If-None-Match": etag})
+            assert r.status_code == 200, url
+            assert r.headers["ETag"] != etag
+            assert r.headers["Cache-Control"] == "no-cache"
+        # Another chat's write leaves this chat's tag alone
+        chat_etag = await _revalidate(client, f"/api/chat/{chat_id}")
+        other = (await client.post("/api/chat/new")).json()["id"]
+        await _query(client, "where is my order", other)
+        await asyncio.to_thread(app_module.writes.flush, 5)
+        r = await client.get(f"/api/chat/{chat_id}", headers={"If-None-Match": chat_etag})
+        assert r.status_code == 304
+    _run(scenario)
@@ -0,0 +1,67 @@
+import io
+
+from database import attachment_store as store_module
+from database.attachment_store import MemoryAttachmentStore
+
+
+def _capture(monkeypatch, accept=True):
+    submitted = []
+
+    def submit(key, data, mime, name, on_done, pages=None, on_pages=None):
+        submitted.append({"key": key, "on_done": on_done, "pages": pages})
+        return accept
+
+    monkeypatch.setattr(store_module.ocr_queue, "submit", submit)
+    return submitted
+
+
+def test_dedupe_counts_references_and_frees_blob_with_the_last_one():
+    store = MemoryAttachmentStore()
+    a = store.save(io.BytesIO(b"same notes"), "a.txt", "text/plain", "chat-a")
+    b = store.save(io.BytesIO(b"same notes"), "b.txt", "text/plain", "chat-b")
+    assert not a["deduplicated"] and b["deduplicated"]
+    assert a["sha256"] == b["sha256"] and b["status"] == "done"
+    assert store._blobs[a["sha256"]]["refcount"] == 2
+
+    store.delete_chat("chat-a")
+    assert store._blobs[a["sha256"]]["refcount"] == 1
+    assert store.open(b["id"]).read() == b"same notes"
+    store.delete_chat("chat-b")
+    assert a["sha256"] not in store._blobs
+
+
+def test_scanned_upload_is_pending_until_ocr_finishes(monkeypatch):
+    store = MemoryAttachmentStore()
+    jobs = _capture(monkeypatch)
+    saved = store.save(io.BytesIO(b"\x89PNG scan"), "scan.png", "image/png", "chat")
+    assert saved["status"] == "pending" and len(jobs) == 1
+    assert store.pending_count("chat", [saved["id"]]) == 1
+    jobs[0]["on_done"]("Order 123 arrived damaged", None)
+    assert store.status(saved["id"])["status"] == "done"
+    assert store.pending_count("chat", [saved["id"]]) == 0
+    assert "Order 123" in store.snippets("chat")
+
+    _capture(monkeypatch, accept=False)
+    full = store.save(io.BytesIO(b"\x89PNG other"), "other.png", "image/png", "chat")
+    assert full["status"] == "failed" and store.status(full["id"])["error"] == "OCR queue full"
+
+
+def test_upload_deduped_onto_failed_blob_retries_extraction(monkeypatch):
+    store = MemoryAttachmentStore()
+    _capture(monkeypatch, accept=False)
+    first = store.save(io.BytesIO(b"\x89PNG scan"), "scan.png", "image/png", "chat")
+    assert first["status"] == "failed"
+    assert store.status(first["id"])["error"] == "OCR queue full"
+
+    jobs = _capture(monkeypatch)
+    second = store.save(io.BytesIO(b"\x89PNG scan"), "scan.png", "image/png", "chat")
+    assert second["deduplicated"] and second["status"] == "pending"
+    assert len(jobs) == 1
+    assert store.status(first["id"])["status"] == "pending"
+    jobs[0]["on_done"]("Order 123 arrived damaged", None)
+    assert store.status(first["id"])["status"] == "done"
+    assert "Order 123" in store.snippets("chat")
+
+    # A blob that extracted fine is reused as-is
+    store.save(io.BytesIO(b"\x89PNG scan"), "again.png", "image/png", "chat")
+    assert len(jobs) == 1
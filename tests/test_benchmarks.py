@@ -0,0 +1,19 @@
+from benchmarks.bench_app import percentile, summarize
+from benchmarks.bench_pdf_extraction import make_pdf
+from database.pdf_extract import pdf_page_count
+
+
+def test_percentiles_and_summary():
+    values = [i / 1000 for i in range(1, 101)]
+    assert percentile([], 50) == 0.0
+    assert percentile(values, 50) == 0.05
+    assert percentile(values, 99) == 0.099
+    assert percentile(values, 100) == 0.1
+    row = summarize(values, errors=2, wall=0.5)
+    assert row["requests"] == 102 and row["errors"] == 2
+    assert row["throughput_rps"] == 200.0
+    assert row["p95_ms"] == 95.0
+
+
+def test_generated_pdf_has_requested_pages():
+    assert pdf_page_count(make_pdf(12, lines_per_page=2, scanned_every=4)) == 12
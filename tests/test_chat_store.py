@@ -0,0 +1,112 @@
+import json
+import uuid
+
+import pytest
+
+from config import settings
+from database.chat_store import ChatStore, chat_key
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ChatStore(f"sqlite:///{tmp_path / 'chats.db'}")
+
+
+def _fill(store, chat_id, exchanges):
+    store.append_exchanges([(chat_id, f"question {i}", f"answer {i}", uuid.uuid4().hex) for i in range(exchanges)])
+
+
+def test_after_is_a_keyset_cursor(store):
+    _fill(store, "c1", 5)
+    _fill(store, "c2", 2)
+    _fill(store, "c1", 1)
+    full = store.get_chat("c1")["messages"]
+    assert [m["content"] for m in full[-2:]] == ["question 0", "answer 0"]
+    assert len(full) == 12
+    # Messages of other chats interleave in the table; the cursor is unaffected
+    newer = store.get_chat("c1", after=full[9]["seq"])["messages"]
+    assert newer == full[10:]
+    assert store.get_chat("c1", after=full[-1]["seq"])["messages"] == []
+
+
+def test_limit_pages_through_a_chat(store):
+    _fill(store, "c1", 5)
+    seen, after = [], None
+    while True:
+        page = store.get_chat("c1", after=after, limit=4)
+        seen.extend(page["messages"])
+        after = page.get("next_after")
+        if after is None:
+            break
+    assert seen == store.get_chat("c1")["messages"]
+    assert store.get_chat("missing") is None
+
+
+def test_list_chats_newest_first_with_cursor(store):
+    for i in range(5):
+        store.create_chat(chat_id=f"c{i}", title=f"Chat {i}")
+    first, cursor = store.list_chats_page(limit=2)
+    assert [c["id"] for c in first] == ["c4", "c3"]
+    second, cursor = store.list_chats_page(limit=2, before=cursor)
+    assert [c["id"] for c in second] == ["c2", "c1"]
+    last, cursor = store.list_chats_page(limit=2, before=cursor)
+    assert [c["id"] for c in last] == ["c0"] and cursor is None
+
+
+def test_versions_change_with_writes(store):
+    store.create_chat(chat_id="c1")
+    before = store.get_versions("chats", chat_key("c1"))
+    _fill(store, "c1", 1)
+    after_append = store.get_versions("chats", chat_key("c1"))
+    assert after_append[2] > before[2]
+    # An append to an existing chat leaves the list version alone
+    assert after_append[1] == before[1]
+    store.clear()
+    assert store.get_versions("chats")[0] != before[0]
+
+
+def test_legacy_json_is_imported_once_in_its_order(store, tmp_path):
+    path = tmp_path / "chats_data.json"
+    path.write_text(json.dumps([
+        {"id": "new", "title": "Newest", "createdAt": "2024-02-01T00:00:00",
+         "messages": [{"role": "user", "content": "hi"}, {"role": "assistant", "content": "hello", "id": "m1",
+                                                          "critique": "Score: 5/5"}],
+         "feedback": [{"rating": "dislike", "feedback": "too long", "message": "hello"}]},
+        {"id": "old", "title": "Oldest", "createdAt": "2024-01-01T00:00:00", "messages": []},
+    ]), encoding="utf-8")
+    assert store.import_json_once(str(path)) == 2
+    assert store.import_json_once(str(path)) == 0
+    assert [c["id"] for c in store.list_chats()] == ["new", "old"]
+    chat = store.get_chat("new")
+    assert [m["content"] for m in chat["messages"]] == ["hi", "hello"]
+    assert store.find_message_critique("m1") == "Score: 5/5"
+    assert store.get_guidance("new") == "1. too long | reference: hello"
+
+
+def test_appends_create_chats_and_delete_removes_everything(store):
+    _fill(store, "c1", 2)
+    assert store.get_title("c1") == "New Chat"
+    store.add_feedback_many([("c1", "dislike", "wrong", "answer 1"), ("missing", "dislike", "x", "y")])
+    assert store.get_chat("missing") is None
+    assert store.delete_chat("c1")
+    assert not store.delete_chat("c1")
+    assert store.get_chat("c1") is None and store.list_chats() == []
+
+
+def test_guidance_is_maintained_on_each_feedback_batch(store, monkeypatch):
+    monkeypatch.setattr(settings, "FEEDBACK_GUIDANCE_WINDOW", 3)
+    monkeypatch.setattr(settings, "FEEDBACK_GUIDANCE_MAX_ITEMS", 2)
+    _fill(store, "c1", 1)
+    assert store.get_guidance("c1") is None
+    store.add_feedback_many([("c1", "like", "", "answer 0")])
+    assert store.get_guidance("c1") is None
+    store.add_feedback_many([("c1", "dislike", "too vague", "answer 0"), ("c1", "dislike", "", "answer 1")])
+    # Newest dislikes first
+    assert store.get_guidance("c1") == "1. Avoid issues like: answer 1\n2. too vague | reference: answer 0"
+    # Only the last FEEDBACK_GUIDANCE_WINDOW entries count
+    store.add_feedback_many([("c1", "like", "", "a")] * 3)
+    assert store.get_guidance("c1") is None
+
+    monkeypatch.setattr(settings, "FEEDBACK_GUIDANCE_WINDOW", 10)
+    assert store.rebuild_guidance() == 1
+    assert store.get_guidance("c1").startswith("1. Avoid issues like: answer 1")
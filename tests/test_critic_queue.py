@@ -0,0 +1,99 @@
+import threading
+import time
+
+import pytest
+
+from agents import critic_queue as critic_module
+from agents.critic_queue import CriticQueue
+
+
+@pytest.fixture
+def critic(monkeypatch):
+    calls = []
+    release = threading.Event()
+
+    def provide_feedback(summary, query):
+        calls.append(summary)
+        release.wait(5)
+        return {"feedback": f"Score: 4/5 for {summary}"}
+    monkeypatch.setattr(critic_module, "provide_feedback", provide_feedback)
+    queue = CriticQueue(workers=2, sample_rate=1, max_pending=10, max_results=100)
+    yield queue, calls, release
+    queue.shutdown()
+
+
+def _wait_done(queue, *message_ids):
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        if all((queue.get(m) or {}).get("status") == "done" for m in message_ids):
+            return
+        time.sleep(0.01)
+    raise AssertionError({m: queue.get(m) for m in message_ids})
+
+
+def test_critique_runs_in_the_background(critic):
+    queue, calls, release = critic
+    done = []
+    assert queue.submit("m1", "answer", on_done=lambda mid, fb: done.append((mid, fb))) == "pending"
+    assert queue.get("m1") == {"status": "pending", "feedback": ""}
+    release.set()
+    _wait_done(queue, "m1")
+    assert calls == ["answer"]
+    assert done == [("m1", "Score: 4/5 for answer")]
+    assert queue.get("m1")["feedback"] == "Score: 4/5 for answer"
+
+
+def test_same_key_shares_one_critique(critic):
+    queue, calls, release = critic
+    done = []
+    assert queue.submit("m1", "answer", on_done=lambda mid, fb: done.append(mid), key="k") == "pending"
+    assert queue.submit("m2", "answer", on_done=lambda mid, fb: done.append(mid), key="k") == "pending"
+    assert queue.get("m2")["status"] == "pending"
+    release.set()
+    _wait_done(queue, "m1", "m2")
+    assert len(calls) == 1
+    assert sorted(done) == ["m1", "m2"]
+    assert queue.get("m2")["feedback"] == "Score: 4/5 for answer"
+
+
+def test_finished_flight_keeps_a_newer_flights_waiters(critic, monkeypatch):
+    queue, calls, release = critic
+    second = threading.Event()
+
+    def provide_feedback(summary, query):
+        if summary == "second":
+            second.wait(5)
+        return {"feedback": f"Score: 4/5 for {summary}"}
+    monkeypatch.setattr(critic_module, "provide_feedback", provide_feedback)
+
+    def resubmit(mid, fb):
+        # Runs after m1's flight left the in-flight table: starts a new flight for the same
+        # key and coalesces onto it before m1's worker has wound down
+        queue.submit("m2", "second", key="k")
+        queue.submit("m3", "second", key="k")
+    queue.submit("m1", "first", on_done=resubmit, key="k")
+    _wait_done(queue, "m1")
+    time.sleep(0.05)
+    second.set()
+    _wait_done(queue, "m2", "m3")
+    assert queue.get("m3")["feedback"] == "Score: 4/5 for second"
+
+
+def test_failed_critique_marks_every_waiter(critic, monkeypatch):
+    queue, calls, release = critic
+    monkeypatch.setattr(critic_module, "provide_feedback", lambda summary, query: 1 / 0)
+    queue.submit("m1", "answer", key="k")
+    queue.submit("m2", "answer", key="k")
+    deadline = time.monotonic() + 5
+    while queue.get("m2")["status"] == "pending" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert queue.get("m1")["status"] == queue.get("m2")["status"] == "error"
+
+
+def test_sampled_out_and_full_queue_are_skipped(monkeypatch):
+    assert CriticQueue(sample_rate=0).submit("m1", "answer") == "skipped"
+    monkeypatch.setattr(critic_module, "provide_feedback", lambda summary, query: time.sleep(0.2) or {})
+    queue = CriticQueue(workers=1, sample_rate=1, max_pending=1)
+    assert queue.submit("m1", "answer") == "pending"
+    assert queue.submit("m2", "other") == "skipped"
+    queue.shutdown()
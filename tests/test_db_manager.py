@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from sqlalchemy import text
+
+from config import settings
+from database.db_manager import Conversation, DatabaseManager
+from database.engine import bulk_insert, get_engine, get_sessionmaker, run_in_session
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, "DATABASE_URL", f"sqlite:///{tmp_path / 'history.db'}")
+    return DatabaseManager()
+
+
+def test_find_response_prefers_message_id_then_chat_then_session_then_latest(db):
+    db.add_conversations([
+        ("Reset my password", "global answer", "other-chat", "other-session", "m0"),
+        ("reset my  PASSWORD?", "session answer", "other-chat", "s1", "m1"),
+        ("Reset my password", "chat answer", "c1", "s2", "m2"),
+        ("Reset my password", "newest elsewhere", "c9", "s9", "m3"),
+    ])
+    assert db.find_response("reset my password", message_id="m0") == "global answer"
+    assert db.find_response("Reset my password", chat_id="c1", session_id="s1") == "chat answer"
+    assert db.find_response("Reset my password", chat_id="c2", session_id="s1") == "session answer"
+    assert db.find_response("Reset my password", chat_id="c2", session_id="s3") == "newest elsewhere"
+    # An unknown message id falls back to the query
+    assert db.find_response("Reset my password", message_id="missing") == "newest elsewhere"
+    assert db.find_response("something else") is None
+
+
+def test_lookup_uses_the_query_hash_index(db):
+    with db.engine.connect() as conn:
+        plan = " ".join(str(r[-1]) for r in conn.execute(text(
+            "EXPLAIN QUERY PLAN SELECT bot_response FROM conversations "
+            "WHERE chat_id = 'c1' AND query_hash = 'x' ORDER BY id DESC LIMIT 1")))
+    assert "ix_conversations_chat_query" in plan
+
+
+def test_rows_from_before_query_hash_are_backfilled(db):
+    db.add_conversation("Where is my order", "legacy answer")
+    with db.Session() as session:
+        session.query(Conversation).update({Conversation.query_hash: None})
+        session.commit()
+    assert db.find_response("where is my order") is None
+    assert db.backfill_query_hashes(chunk=1) == 1
+    assert db.find_response("where is my order") == "legacy answer"
+
+
+def test_stores_share_one_engine_per_url_with_wal(db, tmp_path):
+    assert get_engine(db.url) is db.engine
+    assert get_sessionmaker(db.url) is get_sessionmaker(db.url)
+    with db.engine.connect() as conn:
+        assert conn.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert conn.execute(text("PRAGMA foreign_keys")).scalar() == 1
+
+
+def test_async_session_api_commits_or_rolls_back(db):
+    def add(session, query):
+        bulk_insert(session, Conversation, [{"user_query": query, "bot_response": "answer"}])
+
+    def fail(session):
+        add(session, "rolled back")
+        raise RuntimeError("boom")
+
+    async def scenario():
+        await run_in_session(add, "kept", url=db.url)
+        with pytest.raises(RuntimeError):
+            await run_in_session(fail, url=db.url)
+        return [r.user_query for r in await db.get_history_async(10)]
+
+    assert asyncio.run(scenario()) == ["kept"]
+
+
+def test_history_pages_and_deletes_bump_the_version(db):
+    db.add_conversations([(f"q{i}", f"a{i}") for i in range(5)])
+    first = db.get_history(2)
+    assert [r.user_query for r in first] == ["q4", "q3"]
+    assert [r.user_query for r in db.get_history(2, before=first[-1].id)] == ["q2", "q1"]
+    version = db.get_versions()
+    assert db.delete_conversation(first[0].id)
+    assert not db.delete_conversation(first[0].id)
+    assert db.get_versions() != version
+    assert db.clear_history() == 4 and db.get_history() == []
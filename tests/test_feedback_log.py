@@ -0,0 +1,47 @@
+import json
+import os
+
+from database.feedback_log import FeedbackLog
+
+
+def _entries(n, start=0):
+    return [{"id": f"e{i}", "query": f"question {i}", "feedback": "up"} for i in range(start, start + n)]
+
+
+def test_append_rotates_at_max_bytes_and_reads_oldest_first(tmp_path):
+    log = FeedbackLog(path=str(tmp_path / "feedback.jsonl"), max_bytes=200, max_segments=100, fsync=False)
+    for i in range(10):
+        log.append(_entries(1, i))
+    assert len(log.segments()) >= 2
+    assert [e["id"] for e in log] == [f"e{i}" for i in range(10)]
+    stats = log.get_stats()
+    assert stats["appended"] == 10 and stats["rotations"] == len(log.segments())
+
+
+def test_compaction_merges_segments_and_drops_torn_lines_and_duplicates(tmp_path):
+    log = FeedbackLog(path=str(tmp_path / "feedback.jsonl"), max_bytes=10 ** 6, fsync=False)
+    for n, lines in enumerate([
+        [json.dumps(e) for e in _entries(2)],
+        ['{"id": "e1", "query": "retried write"}', '{"id": "torn', json.dumps(_entries(1, 2)[0])],
+    ], 1):
+        with open(log._segment_path(n), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+    log.append(_entries(1, 3))
+
+    assert log.compact() == 3
+    assert log.segments() == [log._segment_path(1)]
+    # The first copy of a duplicated id wins; the active file is left alone
+    assert [e["id"] for e in log] == ["e0", "e1", "e2", "e3"]
+    assert next(e for e in log if e["id"] == "e1")["query"] == "question 1"
+    assert not [p for p in os.listdir(tmp_path) if p.endswith(".tmp")]
+
+
+def test_legacy_json_is_migrated_once_as_the_oldest_segment(tmp_path):
+    legacy = tmp_path / "feedback_data.json"
+    legacy.write_text(json.dumps(_entries(2)), encoding="utf-8")
+    log = FeedbackLog(path=str(tmp_path / "feedback.jsonl"), fsync=False)
+    log.append(_entries(1, 2))
+    assert log.migrate_json(str(legacy)) == 2
+    assert log.migrate_json(str(legacy)) == 0
+    assert (tmp_path / "feedback_data.json.migrated").exists()
+    assert [e["id"] for e in log] == ["e0", "e1", "e2"]
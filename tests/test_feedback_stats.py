@@ -0,0 +1,52 @@
+from database.feedback_stats import FeedbackStats, feedback_event, parse_score, score_event
+
+HOUR = 3600
+NOW = 1_700_000_000 // HOUR * HOUR + 1800
+
+
+def _stats(tmp_path):
+    return FeedbackStats(url=f"sqlite:///{tmp_path / 'stats.db'}", bucket_seconds=HOUR)
+
+
+def test_parse_score():
+    assert parse_score("Good answer. Score: 4/5") == 4.0
+    assert parse_score("score: 7.5 / 5") == 5.0
+    assert parse_score("no rating here") is None
+
+
+def test_running_totals_windows_and_hot_spots(tmp_path):
+    stats = _stats(tmp_path)
+    stats.record_many([
+        feedback_event("like", "refund for my invoice", "Refunds take 5 days", "c1", NOW - HOUR),
+        feedback_event("dislike", "app shows an error", "Restart it", "c1", NOW),
+        feedback_event("dislike", "app shows an error", "Restart it", "c2", NOW),
+        score_event("Score: 2/5", "app shows an error", "c2", NOW),
+        score_event("no score", "ignored", "c2", NOW),
+    ])
+    out = stats.get_stats(windows=3, now=NOW)
+    totals = out["totals"]
+    assert (totals["feedback"], totals["likes"], totals["dislikes"]) == (3, 1, 2)
+    assert totals["like_rate"] == round(1 / 3, 4)
+    assert totals["avg_score"] == 2.0 and totals["low_scores"] == 1
+    assert [w["feedback"] for w in out["windows"]] == [0, 1, 2]
+    assert out["topics"]["technical"]["dislikes"] == 2 and out["topics"]["billing"]["likes"] == 1
+    assert [c["chat_id"] for c in out["top_disliked_chats"]] == ["c1", "c2"]
+    answers = out["top_disliked_answers"]
+    assert len(answers) == 1 and answers[0]["excerpt"] == "Restart it" and answers[0]["dislikes"] == 2
+
+    chat = stats.get_stats(windows=1, chat_id="c2", now=NOW)
+    assert chat["scope"] == {"dimension": "chat", "key": "c2"}
+    assert chat["totals"]["dislikes"] == 1 and chat["totals"]["scores"] == 1
+
+
+def test_every_write_bumps_the_version(tmp_path):
+    stats = _stats(tmp_path)
+    before = stats.get_versions()
+    stats.record_many([feedback_event("like", "hi", "hello", None, NOW)])
+    after = stats.get_versions()
+    assert after != before
+    stats.record_many([None])
+    assert stats.get_versions() == after
+    stats.reset()
+    assert stats.get_versions() != after
+    assert stats.get_stats(now=NOW)["totals"]["feedback"] == 0
@@ -0,0 +1,118 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from llms import gemini_client
+from llms.providers import FakeProvider, LLMProviderError, RateLimitError
+
+
+def test_fake_provider_answers_in_the_pipeline_format():
+    provider = FakeProvider(latency_ms=0, error_rate=0, rate_limit_rate=0, token_ms=0)
+    answer = provider.generate("Context...\nUser Query: how do I reset my password")
+    for heading in ("## Summary", "## Steps", "## Tips/Notes", "## Next Steps / Resources"):
+        assert heading in answer
+    assert "how do I reset my password" in answer
+    assert provider.generate("Evaluate this chatbot response: ...").startswith("Score: 4/5")
+    titles = provider.generate("Write a short chat title for each:\n1. User: refund my order please\n"
+                               "2. User: app crashes on login")
+    assert titles.splitlines() == ["1. Refund My Order Please Help", "2. App Crashes On Login Help"]
+
+
+def test_fake_stream_matches_generate():
+    provider = FakeProvider(latency_ms=0, error_rate=0, rate_limit_rate=0, token_ms=0)
+    prompt = "User: where is my parcel"
+    chunks = list(provider.stream(prompt))
+    assert len(chunks) > 10
+    assert "".join(chunks) == provider.generate(prompt)
+
+
+def test_fake_faults_are_seeded_and_typed():
+    def outcomes(seed):
+        provider = FakeProvider(latency_ms=0, error_rate=0.3, rate_limit_rate=0.2, seed=seed)
+        out = []
+        for _ in range(50):
+            try:
+                provider.generate("User: hi")
+                out.append("ok")
+            except RateLimitError:
+                out.append("429")
+            except LLMProviderError:
+                out.append("error")
+        return out, provider.get_stats()
+
+    first, stats = outcomes(7)
+    assert outcomes(7)[0] == first
+    assert {"ok", "429", "error"} <= set(first)
+    assert stats == {"calls": 50, "errors": first.count("error"), "rate_limited": first.count("429")}
+
+
+@pytest.mark.parametrize("dist", ["fixed", "uniform", "exponential", "lognormal"])
+def test_fake_latency_distributions(dist):
+    provider = FakeProvider(latency_ms=20, latency_dist=dist, latency_sigma=0.5, seed=1)
+    samples = [provider.sample_latency() for _ in range(2000)]
+    assert min(samples) >= 0
+    assert abs(sum(samples) / len(samples) - 0.02) < 0.004
+    assert FakeProvider(latency_ms=0).sample_latency() == 0.0
+
+
+# ----- pooled Gemini client -----
+class _Model:
+    def __init__(self, name, error=None):
+        self.name, self.error = name, error
+
+    def generate_content(self, prompt, **kwargs):
+        if self.error:
+            raise RuntimeError(self.error)
+        return SimpleNamespace(text=f"{self.name}: {prompt}")
+
+
+def test_models_are_built_once_per_name_and_config(monkeypatch):
+    monkeypatch.setattr(gemini_client, "_models", {})
+    a = gemini_client.get_model("gemini-a", {"temperature": 0.2, "top_p": 0.9})
+    assert gemini_client.get_model("gemini-a", {"top_p": 0.9, "temperature": 0.2}) is a
+    assert gemini_client.get_model("gemini-a", {"temperature": 0.5}) is not a
+    assert gemini_client.get_model("gemini-b") is not a
+    assert len(gemini_client._models) == 3
+
+
+def test_not_found_falls_back_to_the_next_model(monkeypatch):
+    models = {"old": _Model("old", "404 models/old is not found"), "new": _Model("new"),
+              "broken": _Model("broken", "500 internal")}
+    monkeypatch.setattr(gemini_client, "get_model", lambda name, config=None: models[name])
+    monkeypatch.setattr(gemini_client, "stats", {"requests": 0, "fallbacks": 0, "errors": 0})
+    assert gemini_client.generate_text("hi", models=["old", "new"]) == "new: hi"
+    assert gemini_client.stats == {"requests": 2, "fallbacks": 1, "errors": 0}
+    # Only a 404 moves down the chain
+    with pytest.raises(RuntimeError):
+        gemini_client.generate_text("hi", models=["broken", "new"])
+    assert gemini_client.stats["errors"] == 1
+
+
+def test_stats_count_every_call_across_threads(monkeypatch):
+    monkeypatch.setattr(gemini_client, "get_model", lambda name, config=None: _Model(name))
+    monkeypatch.setattr(gemini_client, "stats", {"requests": 0, "fallbacks": 0, "errors": 0})
+
+    def caller():
+        for _ in range(500):
+            gemini_client.generate("hi", models=["m"])
+    threads = [threading.Thread(target=caller) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert gemini_client.get_stats()["requests"] == 4000
+
+
+def test_extract_text_falls_back_to_candidate_parts():
+    class Blocked:
+        @property
+        def text(self):
+            raise ValueError("no valid Part")
+        candidates = [SimpleNamespace(content=SimpleNamespace(parts=[SimpleNamespace(text="a"),
+                                                                    SimpleNamespace(text=""),
+                                                                    SimpleNamespace(text="b ")]))]
+
+    assert gemini_client.extract_text(Blocked()) == "a\nb"
+    assert gemini_client.extract_text(Blocked(), sep="", strip=False) == "ab "
+    assert gemini_client.extract_text(SimpleNamespace(text=None, candidates=[])) == ""
@@ -0,0 +1,93 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+
+from utils.metrics import MetricsRegistry
+
+
+def test_stage_timer_records_latency_in_flight_and_errors():
+    registry = MetricsRegistry(enabled=True, multiproc_dir="", flush_seconds=60)
+    with registry.track("researcher"):
+        pass
+    with pytest.raises(ValueError):
+        with registry.track("researcher"):
+            raise ValueError("boom")
+    registry.inc("supportai_llm_requests_total", provider="fake")
+    text = registry.render()
+    assert '# TYPE supportai_stage_seconds histogram' in text
+    assert 'supportai_stage_seconds_count{stage="researcher"} 2' in text
+    assert 'supportai_stage_seconds_bucket{stage="researcher",le="+Inf"} 2' in text
+    assert 'supportai_stage_in_flight{stage="researcher"} 0' in text
+    assert 'supportai_stage_errors_total{stage="researcher"} 1' in text
+    assert 'supportai_llm_requests_total{provider="fake"} 1' in text
+
+
+def test_disabled_registry_records_nothing():
+    registry = MetricsRegistry(enabled=False, multiproc_dir="", flush_seconds=60)
+    with registry.track("researcher"):
+        registry.inc("supportai_llm_requests_total", provider="fake")
+    assert "supportai_llm_requests_total{" not in registry.render()
+
+
+def _write_snapshot(directory, name, pid, requests):
+    path = os.path.join(directory, name)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "pid": pid,
+            "values": [["supportai_llm_requests_total", [["provider", "fake"]], requests],
+                       ["supportai_http_requests_in_flight", [], 3.0]],
+            "histograms": [],
+        }, f)
+    return path
+
+
+def _requests_total(text):
+    for line in text.splitlines():
+        if line.startswith("supportai_llm_requests_total{"):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def _in_flight(text):
+    return [line for line in text.splitlines() if line.startswith("supportai_http_requests_in_flight")]
+
+
+def test_dead_worker_snapshots_are_compacted_into_one_archive(tmp_path):
+    directory = str(tmp_path)
+    exited = subprocess.Popen([sys.executable, "-c", "pass"])
+    exited.wait()
+    dead = _write_snapshot(directory, f"metrics_{exited.pid}_1.json", exited.pid, 2.0)
+    # A live pid whose file stopped being refreshed: the pid was reused by another process
+    reused = _write_snapshot(directory, f"metrics_{os.getppid()}_1.json", os.getppid(), 5.0)
+    old = time.time() - 3600
+    os.utime(reused, (old, old))
+
+    registry = MetricsRegistry(enabled=True, multiproc_dir=directory, flush_seconds=60)
+    registry.inc("supportai_llm_requests_total", provider="fake")
+    first = registry.render()
+    assert _requests_total(first) == 8.0
+    # Gauges of exited workers are dropped
+    assert _in_flight(first) == []
+    assert not os.path.exists(dead) and not os.path.exists(reused)
+    assert os.path.exists(os.path.join(directory, "metrics-archive.json"))
+    snapshots = [n for n in os.listdir(directory) if n.startswith("metrics_") and n.endswith(".json")]
+    assert len(snapshots) == 1
+
+    # Scraping again, from this or another worker, does not count the archive twice
+    assert _requests_total(registry.render()) == 8.0
+    other = MetricsRegistry(enabled=True, multiproc_dir=directory, flush_seconds=60)
+    assert _requests_total(other.render()) == 8.0
+
+
+def test_live_worker_snapshot_is_kept(tmp_path):
+    directory = str(tmp_path)
+    live = _write_snapshot(directory, f"metrics_{os.getppid()}_1.json", os.getppid(), 4.0)
+    registry = MetricsRegistry(enabled=True, multiproc_dir=directory, flush_seconds=60)
+    text = registry.render()
+    assert _requests_total(text) == 4.0
+    assert _in_flight(text) == ["supportai_http_requests_in_flight 3"]
+    assert os.path.exists(live)
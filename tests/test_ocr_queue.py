@@ -0,0 +1,85 @@
+import time
+from concurrent.futures import Future
+
+import pytest
+
+from benchmarks.bench_pdf_extraction import make_pdf
+from database.ocr_queue import OCRQueue
+
+
+@pytest.fixture
+def queue(monkeypatch):
+    # Jobs get futures the test resolves, instead of running on the process pool
+    q = OCRQueue(workers=1, max_pending=2, pages_per_job=4)
+    q.jobs = []
+
+    def submit_job(fn, *args):
+        fut = Future()
+        q.jobs.append((args, fut))
+        return fut
+    monkeypatch.setattr(q, "_submit_job", submit_job)
+    return q
+
+
+def _recorder():
+    calls = {"pages": [], "done": []}
+    return calls, (lambda text, error, pages: calls["done"].append((text, error, pages))), calls["pages"].append
+
+
+def test_pdf_pages_run_in_chunks_and_land_as_they_finish(queue):
+    calls, on_done, on_pages = _recorder()
+    assert queue.submit("sha", b"%PDF", "application/pdf", "a.pdf", on_done, pages=list(range(1, 11)),
+                        on_pages=on_pages)
+    assert [args[1] for args, _ in queue.jobs] == [[1, 2, 3, 4], [5, 6, 7, 8], [9, 10]]
+    queue.jobs[1][1].set_result({5: "five", 6: "", 7: "seven", 8: ""})
+    assert calls["pages"] == [{5: "five", 6: "", 7: "seven", 8: ""}] and not calls["done"]
+    queue.jobs[0][1].set_result({1: "one", 2: "", 3: "", 4: ""})
+    queue.jobs[2][1].set_exception(RuntimeError("tesseract crashed"))
+    # One failed chunk does not fail the document when other pages have text
+    text, error, pages = calls["done"][0]
+    assert error is None and text == "one\nfive\nseven" and set(pages) == {1, 2, 3, 4, 5, 6, 7, 8}
+    assert queue.pending() == 0
+    assert queue.get_stats()["completed"] == 1 and queue.get_stats()["page_jobs"] == 3
+
+
+def test_same_key_in_flight_shares_one_job(queue):
+    first, on_done_a, _ = _recorder()
+    second, on_done_b, _ = _recorder()
+    queue.submit("sha", b"img", "image/png", "a.png", on_done_a)
+    queue.submit("sha", b"img", "image/png", "a.png", on_done_b)
+    assert len(queue.jobs) == 1 and queue.get_stats()["coalesced"] == 1
+    queue.jobs[0][1].set_result("receipt text")
+    assert first["done"] == second["done"] == [("receipt text", None, None)]
+    # Finished keys run again
+    queue.submit("sha", b"img", "image/png", "a.png", on_done_a)
+    assert len(queue.jobs) == 2
+
+
+def test_full_queue_rejects_and_failures_are_reported(queue):
+    calls, on_done, _ = _recorder()
+    assert queue.submit("a", b"1", "image/png", "a.png", on_done)
+    assert queue.submit("b", b"2", "image/png", "b.png", on_done)
+    assert not queue.submit("c", b"3", "image/png", "c.png", on_done)
+    assert queue.get_stats()["dropped"] == 1
+    queue.jobs[0][1].set_exception(ValueError("bad image"))
+    queue.jobs[1][1].cancel()
+    assert calls["done"] == [("", "bad image", None)]
+    assert queue.pending() == 0 and queue.get_stats()["failed"] == 1
+
+
+def test_pdf_extracted_on_the_process_pool():
+    queue = OCRQueue(workers=1, pages_per_job=2)
+    calls, on_done, on_pages = _recorder()
+    try:
+        queue.submit("pdf", make_pdf(3, lines_per_page=2), "application/pdf", "a.pdf", on_done,
+                     pages=[1, 2, 3], on_pages=on_pages)
+        for _ in range(600):
+            if calls["done"]:
+                break
+            time.sleep(0.05)
+    finally:
+        queue.shutdown()
+    text, error, pages = calls["done"][0]
+    assert error is None and sorted(pages) == [1, 2, 3]
+    assert "Page 1 line 1" in text and "Page 3 line 2" in text
+    assert len(calls["pages"]) == 2
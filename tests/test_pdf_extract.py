@@ -0,0 +1,95 @@
+import io
+
+import pytest
+
+from benchmarks.bench_pdf_extraction import make_pdf
+from database import attachment_store as store_module
+from database.attachment_store import MemoryAttachmentStore
+from database.pdf_extract import join_pages, page_excerpt, page_refs, pages_to_extract
+
+
+@pytest.fixture
+def jobs(monkeypatch):
+    # Capture OCR jobs instead of running them, so tests decide when each one lands
+    submitted = []
+
+    def submit(key, data, mime, name, on_done, pages=None, on_pages=None):
+        submitted.append({"key": key, "pages": pages, "on_done": on_done, "on_pages": on_pages})
+        return True
+    monkeypatch.setattr(store_module.ocr_queue, "submit", submit)
+    return submitted
+
+
+def _finish(job, text="intro"):
+    pages = {n: f"{text} page {n}" for n in job["pages"]}
+    job["on_pages"](pages)
+    job["on_done"](join_pages(pages), None, pages)
+
+
+def test_page_refs():
+    assert page_refs("what does page 12 say") == [12]
+    assert page_refs("see pages 40-42 and p. 3") == [3, 40, 41, 42]
+    assert page_refs("pp 5 to 3") == [3, 4, 5]
+    assert page_refs("no pages here") == []
+
+
+def test_pages_to_extract_skips_extracted_and_skipped_pages():
+    extracted = {n: "intro" for n in range(1, 11)}
+    assert pages_to_extract("page 5 and page 12", extracted, 40) == [12]
+    assert pages_to_extract("page 12", extracted, 40, skip=[12]) == []
+    assert pages_to_extract("page 99", extracted, 40) == []
+    # A term found in extracted pages needs nothing more
+    assert pages_to_extract("tell me the intro", extracted, 40) == []
+    lazy = pages_to_extract("explain warranty", extracted, 40, skip=[11])
+    assert lazy[0] == 12 and len(lazy) == 20
+
+
+def test_page_excerpt_prefers_referenced_then_matching_pages():
+    pages = {1: "shipping terms", 2: "refund policy", 3: "refund window"}
+    assert page_excerpt(pages, "page 2").startswith("[page 2] refund policy")
+    assert page_excerpt(pages, "refund window") == "[page 2] refund policy\n[page 3] refund window"
+    assert page_excerpt(pages, "hello") == "shipping terms\nrefund policy\nrefund window"
+
+
+def test_lazy_pages_wait_for_eager_job(jobs):
+    store = MemoryAttachmentStore()
+    saved = store.save(io.BytesIO(make_pdf(40, lines_per_page=1)), "manual.pdf", "application/pdf", "c1")
+    ids = [saved["id"]]
+    assert saved["status"] == "pending"
+    assert jobs[0]["pages"] == list(range(1, 11))
+
+    assert store.pending_count("c1", ids, page_jobs=False) == 1
+    # A question arriving while the eager pages are extracting queues nothing
+    assert store.ensure_pages("c1", ids, "explain the warranty on page 25") == 0
+    assert len(jobs) == 1
+    _finish(jobs[0])
+    assert store.status(saved["id"])["status"] == "done"
+
+    assert store.ensure_pages("c1", ids, "what does page 25 say") == 1
+    assert jobs[1]["pages"] == [25]
+    # Nothing else is queued, and the blob stays pending, until that page job lands
+    assert store.ensure_pages("c1", ids, "and page 30?") == 0
+    assert store.pending_count("c1", ids) == 1
+    # ...though the upload's own text is in
+    assert store.pending_count("c1", ids, page_jobs=False) == 0
+    _finish(jobs[1], "warranty")
+    status = store.status(saved["id"])
+    assert status["status"] == "done"
+    assert status["pages"] == {"total": 40, "extracted": 11}
+    assert "[page 25] warranty page 25" in store.snippets("c1", ids, query="page 25")
+
+    # A term miss queues the next pages, never the eager or extracted ones
+    assert store.ensure_pages("c1", ids, "subscription upgrade") == 1
+    assert jobs[2]["pages"] == list(range(11, 25)) + list(range(26, 32))
+
+
+def test_failed_page_job_releases_the_blob(jobs):
+    store = MemoryAttachmentStore()
+    saved = store.save(io.BytesIO(make_pdf(30, lines_per_page=1)), "manual.pdf", "application/pdf", "c1")
+    _finish(jobs[0])
+    assert store.ensure_pages("c1", [saved["id"]], "page 20") == 1
+    jobs[1]["on_done"]("", "worker died", {})
+    # Earlier pages keep the document usable; the page can be asked for again
+    assert store.status(saved["id"])["status"] == "done"
+    assert store.ensure_pages("c1", [saved["id"]], "page 20") == 1
+    assert jobs[2]["pages"] == [20]
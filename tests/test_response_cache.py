@@ -0,0 +1,55 @@
+import time
+
+from utils.response_cache import ResponseCache
+
+
+def test_make_key_covers_query_context_attachments_and_guidance():
+    key = ResponseCache.make_key("Reset my password", [], ["a"], None)
+    assert key == ResponseCache.make_key("  reset my PASSWORD ", [], ["a"], None)
+    assert key != ResponseCache.make_key("reset my password", [{"user": "hi", "bot": "hello"}], ["a"], None)
+    assert key != ResponseCache.make_key("reset my password", [], ["b"], None)
+    assert key != ResponseCache.make_key("reset my password", [], ["a"], "be brief")
+
+
+def test_ttl_and_lru_bounds():
+    cache = ResponseCache(max_entries=2, ttl_seconds=0.05, db_path="")
+    cache.set("a", {"summary": "A"})
+    cache.set("b", {"summary": "B"})
+    assert cache.get("a") == {"summary": "A"}
+    cache.set("c", {"summary": "C"})
+    # "b" was least recently used
+    assert cache.get("b") is None
+    time.sleep(0.06)
+    assert cache.get("a") is None
+    assert cache.get_stats()["expirations"] >= 1
+
+
+def test_update_merges_fields():
+    cache = ResponseCache(db_path="")
+    cache.update("missing", feedback="ignored")
+    assert cache.get("missing") is None
+    cache.set("k", {"summary": "answer"})
+    cache.update("k", feedback="Score: 5/5")
+    assert cache.get("k") == {"summary": "answer", "feedback": "Score: 5/5"}
+
+
+def test_invalidation_reaches_other_workers_memory_tier(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_a = ResponseCache(db_path=path)
+    worker_b = ResponseCache(db_path=path)
+    worker_a.set("k", {"summary": "disliked answer"})
+    worker_a.set("other", {"summary": "fine answer"})
+    # Worker B now holds both entries in its memory tier
+    assert worker_b.get("k") == {"summary": "disliked answer"}
+    assert worker_b.get("other") == {"summary": "fine answer"}
+
+    assert worker_a.invalidate_answer("disliked answer") >= 1
+    assert worker_a.get("k") is None
+    assert worker_b.get("k") is None
+    assert worker_b.get("other") == {"summary": "fine answer"}
+
+    # The same answer cached again later is served again
+    worker_b.set("k", {"summary": "disliked answer"})
+    assert worker_a.get("k") == {"summary": "disliked answer"}
+    # A worker started after the invalidation does not replay it
+    assert ResponseCache(db_path=path).get("k") == {"summary": "disliked answer"}
@@ -0,0 +1,102 @@
+import threading
+
+from config import settings
+from utils.semantic_cache import SemanticCache
+
+
+def _cache(**kw):
+    kw.setdefault("capacity", 8)
+    kw.setdefault("dim", 256)
+    kw.setdefault("threshold", 0.8)
+    return SemanticCache(path="", **kw)
+
+
+def test_near_duplicate_hits_within_scope_only():
+    cache = _cache()
+    cache.add("How do I reset my password?", "scope-a", {"summary": "Use the reset link."})
+    found = cache.lookup("how can I reset my password", "scope-a")
+    assert found and found[0] == {"summary": "Use the reset link."}
+    assert cache.lookup("how can I reset my password", "scope-b") is None
+    assert cache.lookup("where is my parcel", "scope-a") is None
+
+
+def test_default_threshold_rejects_negated_and_different_questions():
+    cache = SemanticCache(path="", capacity=8)
+    assert cache.threshold == settings.SEMANTIC_CACHE_THRESHOLD
+    cache.add("refund received", "", {"summary": "Glad it arrived."})
+    cache.add("how do I reset my password", "", {"summary": "Use the reset link."})
+    # Both score above the threshold on the vectors alone
+    assert cache.search(["refund not received"], [""])[0][0][1] >= cache.threshold
+    assert cache.lookup("refund not received", "") is None
+    assert cache.lookup("password reset not working", "") is None
+    assert cache.get_stats()["rejected"] >= 2
+
+    cache.add("refund not received", "", {"summary": "Refunds take 5-7 days."})
+    assert cache.lookup("refund received", "")[0] == {"summary": "Glad it arrived."}
+    assert cache.lookup("my refund is not received", "")[0] == {"summary": "Refunds take 5-7 days."}
+    # A paraphrase in other words misses and goes to the pipeline rather than taking the wrong answer
+    assert cache.lookup("I still haven't got my refund", "") is None
+    assert cache.lookup("how can I reset my pasword", "")[0] == {"summary": "Use the reset link."}
+
+
+def test_invalidate_answer_and_lru_eviction():
+    cache = _cache(capacity=2)
+    cache.add("reset my password", "", {"summary": "A"})
+    cache.add("cancel my subscription", "", {"summary": "B"})
+    assert cache.invalidate_answer("A") == 1
+    assert cache.lookup("reset my password", "") is None
+    cache.lookup("cancel my subscription", "")
+    cache.add("update billing address", "", {"summary": "C"})
+    cache.add("change delivery date", "", {"summary": "D"})
+    assert cache.get_stats()["evictions"] >= 1
+    assert cache.lookup("change delivery date", "")[0] == {"summary": "D"}
+
+
+def test_lookup_never_returns_another_querys_answer_under_concurrent_adds():
+    # Capacity 1: every add() reuses the row a lookup may have just found
+    cache = _cache(capacity=1, threshold=0.99)
+    stop = threading.Event()
+    wrong = []
+
+    def writer():
+        i = 0
+        while not stop.is_set():
+            i += 1
+            query = "track my order" if i % 2 else f"unrelated question number {i}"
+            cache.add(query, "", {"summary": query})
+
+    def reader():
+        for _ in range(3000):
+            found = cache.lookup("track my order", "")
+            if found and found[0]["summary"] != "track my order":
+                wrong.append(found[0]["summary"])
+
+    threads = [threading.Thread(target=writer) for _ in range(2)]
+    for t in threads:
+        t.start()
+    try:
+        reader()
+    finally:
+        stop.set()
+        for t in threads:
+            t.join()
+    assert not wrong
+
+
+def test_invalidation_reaches_other_workers(tmp_path):
+    path = str(tmp_path / "semantic")
+    # The first cache owns the memory-mapped file, the second runs memory-only like another worker
+    worker_a = SemanticCache(path=path, capacity=8, dim=256)
+    worker_b = SemanticCache(path=path, capacity=8, dim=256)
+    assert worker_b.get_stats()["memory_mapped"] is False
+    for worker in (worker_a, worker_b):
+        worker.add("reset my password", "", {"summary": "disliked answer"})
+        worker.add("cancel my subscription", "", {"summary": "fine answer"})
+
+    assert worker_a.invalidate_answer("disliked answer") == 1
+    assert worker_b.lookup("reset my password", "") is None
+    assert worker_b.lookup("cancel my subscription", "")[0] == {"summary": "fine answer"}
+
+    # The same answer cached again later is served again
+    worker_b.add("reset my password", "", {"summary": "disliked answer"})
+    assert worker_b.lookup("reset my password", "")[0] == {"summary": "disliked answer"}
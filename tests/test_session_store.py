@@ -0,0 +1,120 @@
+import threading
+import time
+
+import pytest
+
+import utils.session_store as session_store_module
+from utils.session_store import SessionStore
+
+
+def test_sqlite_mode_omits_the_per_worker_bytes_gauge(tmp_path, monkeypatch):
+    store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+    store.append("s1", "hello", "hi there")
+    monkeypatch.setattr(session_store_module, "session_store", store)
+    names = [name for name, _, _ in session_store_module._collect_metrics()]
+    assert "supportai_session_store_bytes" not in names
+    assert store.get_stats()["bytes"] > 0
+
+    memory = SessionStore(db_path="")
+    memory.append("s1", "hello", "hi there")
+    monkeypatch.setattr(session_store_module, "session_store", memory)
+    samples = {name: value for name, _, value in session_store_module._collect_metrics()}
+    assert samples["supportai_session_store_bytes"] == memory.get_stats()["bytes"] > 0
+
+
+def test_sqlite_prune_runs_every_hundredth_write_across_threads(tmp_path, monkeypatch):
+    store = SessionStore(db_path=str(tmp_path / "sessions.db"))
+    prunes = []
+    monkeypatch.setattr(store, "_db_prune", lambda conn, now: prunes.append(now))
+
+    def writer(n):
+        for i in range(50):
+            store.append(f"s{n}", f"q{i}", f"a{i}")
+
+    threads = [threading.Thread(target=writer, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert store._writes == 400
+    assert len(prunes) == 4
+    assert store.get_stats()["appends"] == 400
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        db_path = str(tmp_path / "sessions.db") if request.param == "sqlite" else ""
+        return SessionStore(db_path=db_path, **kwargs)
+    return make
+
+
+def test_keeps_only_the_last_max_turns(make_store):
+    store = make_store(max_turns=3)
+    for i in range(5):
+        store.append("s1", f"q{i}", f"a{i}")
+    assert store.get("s1") == [{"user": f"q{i}", "bot": f"a{i}"} for i in (2, 3, 4)]
+    assert store.get("unknown") == []
+
+
+def test_idle_sessions_expire(make_store, monkeypatch):
+    store = make_store(ttl_seconds=60)
+    now = [1000.0]
+    monkeypatch.setattr(session_store_module.time, "time", lambda: now[0])
+    store.append("s1", "hello", "hi")
+    now[0] += 59
+    assert store.get("s1") == [{"user": "hello", "bot": "hi"}]
+    # Reads slide the TTL window
+    now[0] += 59
+    assert store.get("s1") != []
+    now[0] += 61
+    assert store.get("s1") == []
+    assert store.get_stats()["expirations"] == 1
+
+
+def test_least_recently_used_sessions_are_evicted_over_the_count_cap():
+    store = SessionStore(max_sessions=2, db_path="")
+    store.append("a", "q", "a")
+    store.append("b", "q", "b")
+    store.get("a")
+    store.append("c", "q", "c")
+    assert store.get("b") == []
+    assert store.get("a") and store.get("c")
+    assert store.get_stats()["evictions"] == 1
+
+
+def test_byte_cap_evicts_oldest_sessions():
+    one = SessionStore._size("x" * 100, "y")
+    store = SessionStore(max_bytes=one * 3 // 2, db_path="")
+    store.append("a", "x" * 100, "y")
+    store.append("b", "x" * 100, "y")
+    assert store.get("a") == []
+    assert store.get("b") == [{"user": "x" * 100, "bot": "y"}]
+    assert store.get_stats()["bytes"] == one
+    store.clear()
+    assert store.get_stats()["bytes"] == 0
+
+
+def test_sqlite_prune_enforces_the_byte_cap(tmp_path):
+    store = SessionStore(max_bytes=450, db_path=str(tmp_path / "sessions.db"))
+    for sid in ("a", "b", "c"):
+        store.append(sid, "x" * 100, "y" * 100)
+    store.get("a")
+    assert store.get_stats()["bytes"] == 600
+    conn = store._conn()
+    store._db_prune(conn, time.time())
+    conn.commit()
+    # "b" was least recently used
+    assert store.get("b") == []
+    assert store.get("a") and store.get("c")
+    stats = store.get_stats()
+    assert stats["bytes"] == 400 and stats["evictions"] == 1
+
+
+def test_sqlite_history_is_shared_between_store_instances(tmp_path):
+    path = str(tmp_path / "sessions.db")
+    SessionStore(db_path=path).append("s1", "hello", "hi")
+    other = SessionStore(db_path=path)
+    assert other.get("s1") == [{"user": "hello", "bot": "hi"}]
+    other.clear("s1")
+    assert SessionStore(db_path=path).get("s1") == []
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from utils.singleflight import SingleFlight
+
+
+def test_concurrent_calls_share_one_run():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def main():
+        return await asyncio.gather(*(flights.do("k", work) for _ in range(5)))
+
+    assert asyncio.run(main()) == ["answer"] * 5
+    assert len(runs) == 1
+    assert flights.get_stats()["followers"] == 4
+    assert flights.in_flight() == 0
+
+
+def test_leader_error_reaches_followers():
+    flights = SingleFlight()
+
+    async def work():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def main():
+        return await asyncio.gather(flights.do("k", work), flights.do("k", work), return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, ValueError) for r in results)
+
+
+def test_followers_rerun_when_leader_is_cancelled():
+    flights = SingleFlight()
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return len(runs)
+
+    async def main():
+        leader = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await follower
+
+    assert asyncio.run(main()) == 2
+
+
+def test_closed_streaming_leader_does_not_fail_followers():
+    flights = SingleFlight()
+
+    async def stream():
+        # Same shape as the /query/stream leader: holds the flight across yields
+        fut, leader = flights.begin("k")
+        assert leader
+        try:
+            yield "token"
+            yield "token"
+        except BaseException as e:
+            flights.finish("k", fut, error=e)
+            raise
+        flights.finish("k", fut, result="streamed")
+
+    async def work():
+        return "rerun"
+
+    async def main():
+        gen = stream()
+        await gen.__anext__()
+        follower = asyncio.create_task(flights.do("k", work))
+        await asyncio.sleep(0)
+        # Client disconnects: the server closes the generator, raising GeneratorExit inside it
+        await gen.aclose()
+        return await follower
+
+    assert asyncio.run(main()) == "rerun"
@@ -0,0 +1,99 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from database.write_behind import WriteBehind
+
+
+def _queue(mode="async", **kwargs):
+    q = WriteBehind(mode=mode, flush_interval=kwargs.pop("flush_interval", 0.01), **kwargs)
+    applied = []
+    q.register("chat", lambda items: applied.append(("chat", list(items))))
+    q.register("feedback", lambda items: applied.append(("feedback", list(items))))
+    return q, applied
+
+
+def test_writes_are_batched_in_order_and_kinds_in_registration_order():
+    q, applied = _queue(batch_size=4, flush_interval=5)
+    futures = [q.put("feedback", "f1"), q.put("chat", 1), q.put("chat", 2), q.put("feedback", "f2")]
+    for fut in futures:
+        fut.result(timeout=2)
+    # A full batch does not wait for the flush interval
+    assert applied == [("chat", [1, 2]), ("feedback", ["f1", "f2"])]
+    for i in range(3, 6):
+        q.put("chat", i)
+    assert q.flush(timeout=2)
+    assert [i for kind, items in applied if kind == "chat" for i in items] == [1, 2, 3, 4, 5]
+    stats = q.get_stats()
+    assert stats["applied"] == 7 and stats["pending"] == 0
+    q.close()
+    with pytest.raises(RuntimeError):
+        q.put("chat", 6)
+
+
+def test_failed_batch_retries_each_write_and_fails_only_the_bad_one():
+    q = WriteBehind(mode="async", batch_size=10, flush_interval=0.01)
+    applied = []
+
+    def handler(items):
+        if "bad" in items:
+            raise ValueError("constraint failed")
+        applied.extend(items)
+
+    q.register("chat", handler)
+    good, bad, other = q.put("chat", "a"), q.put("chat", "bad"), q.put("chat", "b")
+    assert good.result(timeout=2) is None and other.result(timeout=2) is None
+    with pytest.raises(ValueError):
+        bad.result(timeout=2)
+    assert applied == ["a", "b"]
+    assert q.get_stats()["failed"] == 1
+    q.close()
+
+
+def test_full_queue_applies_backpressure():
+    q = WriteBehind(mode="async", batch_size=1, flush_interval=0, max_pending=2)
+    release = threading.Event()
+    applied = []
+    q.register("chat", lambda items: (release.wait(2), applied.extend(items)))
+    q.put("chat", 0)
+    # Wait until the flusher holds item 0, then fill the queue
+    for _ in range(200):
+        if q.get_stats()["pending"] == 0:
+            break
+        time.sleep(0.005)
+    q.put("chat", 1)
+    q.put("chat", 2)
+    assert q.put("chat", "dropped", block=False) is None
+
+    blocked = threading.Thread(target=q.put, args=("chat", 3))
+    blocked.start()
+    blocked.join(0.05)
+    assert blocked.is_alive()
+    release.set()
+    blocked.join(2)
+    assert not blocked.is_alive()
+    assert q.flush(timeout=2)
+    assert applied == [0, 1, 2, 3]
+    assert q.get_stats()["backpressure_waits"] == 1
+    q.close()
+
+
+def test_sync_mode_applies_in_the_callers_thread():
+    q, applied = _queue(mode="sync")
+    fut = q.put("chat", "now")
+    assert fut.done() and applied == [("chat", ["now"])]
+    assert q._thread is None
+
+
+def test_batched_submit_waits_for_the_commit():
+    q, applied = _queue(mode="batched", batch_size=50, flush_interval=0.02)
+
+    async def scenario():
+        await asyncio.gather(*(q.submit("chat", i) for i in range(5)))
+        # Every submit returned only after its batch committed; they shared one batch
+        assert applied == [("chat", [0, 1, 2, 3, 4])]
+
+    asyncio.run(scenario())
+    q.close()
@@ -0,0 +1,93 @@
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from config import settings
+
+# Bounded pools so blocking Gemini calls and file/DB I/O never run on the event loop
+_llm_executor = None
+_io_executor = None
+_lock = threading.Lock()
+
+
+def get_llm_executor() -> ThreadPoolExecutor:
+    global _llm_executor
+    if _llm_executor is None:
+        with _lock:
+            if _llm_executor is None:
+                _llm_executor = ThreadPoolExecutor(
+                    max_workers=settings.LLM_MAX_CONCURRENCY, thread_name_prefix="llm")
+    return _llm_executor
+
+
+def get_io_executor() -> ThreadPoolExecutor:
+    global _io_executor
+    if _io_executor is None:
+        with _lock:
+            if _io_executor is None:
+                _io_executor = ThreadPoolExecutor(
+                    max_workers=settings.STORAGE_MAX_WORKERS, thread_name_prefix="storage")
+    return _io_executor
+
+
+async def run_llm(func, *args, **kwargs):
+    """
+    Run a blocking LLM call on the bounded LLM pool and await its result
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_llm_executor(), functools.partial(func, *args, **kwargs))
+
+
+async def run_io(func, *args, **kwargs):
+    """
+    Run a blocking storage call (files, DB) on the bounded storage pool
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_executor(), functools.partial(func, *args, **kwargs))
+
+
+def shutdown_executors(wait: bool = True) -> None:
+    global _llm_executor, _io_executor
+    with _lock:
+        for ex in (_llm_executor, _io_executor):
+            if ex is not None:
+                ex.shutdown(wait=wait)
+        _llm_executor = None
+        _io_executor = None
+
+
+async def stream_llm(func, *args, **kwargs):
+    """
+    Drive a blocking generator (e.g. a streamed Gemini response) on the LLM pool
+    and yield its items on the event loop as they arrive
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+    stop = threading.Event()
+    end = object()
+
+    def pump():
+        try:
+            for item in func(*args, **kwargs):
+                if stop.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (end, e))
+            return
+        loop.call_soon_threadsafe(queue.put_nowait, (end, None))
+
+    fut = loop.run_in_executor(get_llm_executor(), pump)
+    try:
+        while True:
+            item, err = await queue.get()
+            if item is end:
+                if err is not None:
+                    raise err
+                break
+            yield item
+    finally:
+        # Client went away or we finished: let the producer thread wind down
+        stop.set()
+        if fut.done():
+            fut.result()
@@ -1,3 +1,4 @@
+import hashlib
 import re
 
 def sanitize_text(text):
@@ -13,3 +14,11 @@ def extract_keywords(text):
 
 def format_response(text):
     return text.strip().capitalize()
+
+def normalize_query(text):
+    # Case/whitespace-insensitive form of a query, used for cache keys and lookups
+    text = re.sub(r'\s+', ' ', (text or '').strip().lower())
+    return text.rstrip('?.! ')
+
+def hash_text(text):
+    return hashlib.sha256((text or '').encode('utf-8')).hexdigest()
@@ -0,0 +1,405 @@
+import bisect
+import glob
+import json
+import os
+import threading
+import time
+from config import settings
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # Windows: no multi-worker gunicorn, compaction runs in-process only
+    fcntl = None
+
+# Histogram buckets: seconds for latencies, characters for prompt/response sizes
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+SIZE_BUCKETS = (64, 256, 1024, 4096, 16384, 65536, 262144)
+BATCH_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024)
+
+# name -> (type, help, buckets)
+METRICS = {
+    "supportai_stage_seconds": ("histogram", "Latency of pipeline stages and storage calls", LATENCY_BUCKETS),
+    "supportai_stage_in_flight": ("gauge", "Stage executions currently running", None),
+    "supportai_stage_errors_total": ("counter", "Stage executions that raised", None),
+    "supportai_http_request_seconds": ("histogram", "HTTP request latency by route", LATENCY_BUCKETS),
+    "supportai_http_requests_in_flight": ("gauge", "HTTP requests currently being served", None),
+    "supportai_llm_requests_total": ("counter", "LLM provider calls", None),
+    "supportai_llm_errors_total": ("counter", "LLM provider calls that failed, by kind", None),
+    "supportai_llm_fallbacks_total": ("counter", "Model fallbacks after a 404 from the preferred model", None),
+    "supportai_llm_prompt_chars": ("histogram", "Prompt size sent to the LLM", SIZE_BUCKETS),
+    "supportai_llm_response_chars": ("histogram", "Response size returned by the LLM", SIZE_BUCKETS),
+    "supportai_cache_requests_total": ("counter", "Answer cache lookups by cache and result (hit/miss)", None),
+    "supportai_critic_queue_pending": ("gauge", "Critiques queued or running in the background", None),
+    "supportai_title_queue_pending": ("gauge", "Chats waiting for a background LLM title", None),
+    "supportai_ocr_queue_pending": ("gauge", "Attachment text extractions queued or running", None),
+    "supportai_session_store_bytes": ("gauge", "Approximate memory held by in-process session history", None),
+    "supportai_session_evictions_total": ("counter", "Sessions dropped from the history store, by reason", None),
+    "supportai_write_queue_depth": ("gauge", "Writes waiting in the write-behind queue", None),
+    "supportai_write_batch_size": ("histogram", "Writes committed per write-behind batch", BATCH_BUCKETS),
+    "supportai_write_backpressure_total": ("counter", "Writers that waited because the write queue was full", None),
+}
+
+
+def _label_key(labels: dict) -> tuple:
+    return tuple(sorted((k, str(v)) for k, v in labels.items())) if labels else ()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(key, extra: tuple = ()) -> str:
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    __slots__ = ("registry", "key", "start")
+
+    def __init__(self, registry, stage: str):
+        self.registry = registry
+        self.key = (("stage", stage),)
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        self.registry._add("supportai_stage_in_flight", self.key, 1)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        # Cancellation and client disconnects (BaseException) are not stage errors
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        self.registry._finish_stage(self.key, time.perf_counter() - self.start, failed)
+        return False
+
+
+class MetricsRegistry:
+    """
+    In-process counters, gauges and histograms rendered in the Prometheus text format.
+    With multiproc_dir set, each worker writes a snapshot file and a scrape merges them all.
+    """
+
+    def __init__(self, enabled: bool = None, multiproc_dir: str = None, flush_seconds: float = None):
+        self.enabled = settings.METRICS_ENABLED if enabled is None else enabled
+        self.multiproc_dir = settings.METRICS_MULTIPROC_DIR if multiproc_dir is None else multiproc_dir
+        self.flush_seconds = settings.METRICS_FLUSH_SECONDS if flush_seconds is None else flush_seconds
+        self._lock = threading.Lock()
+        self._values = {}      # (name, label key) -> float
+        self._histograms = {}  # (name, label key) -> [bucket counts..., sum, count]
+        self._collectors = []
+        self._flusher = None
+        self._path = None  # (pid, snapshot path); a new process, even with a reused pid, gets a new file
+
+    # ----- recording -----
+    def _add(self, name: str, key: tuple, delta: float) -> None:
+        with self._lock:
+            self._values[(name, key)] = self._values.get((name, key), 0.0) + delta
+        self._start_flusher()
+
+    def _observe(self, name: str, key: tuple, value: float) -> None:
+        buckets = METRICS[name][2]
+        idx = bisect.bisect_left(buckets, value)
+        with self._lock:
+            h = self._histograms.get((name, key))
+            if h is None:
+                h = self._histograms[(name, key)] = [0] * (len(buckets) + 1) + [0.0, 0]
+            h[idx] += 1
+            h[-2] += value
+            h[-1] += 1
+        self._start_flusher()
+
+    def _finish_stage(self, key: tuple, elapsed: float, failed: bool) -> None:
+        # One lock round-trip for everything recorded when a stage ends
+        buckets = METRICS["supportai_stage_seconds"][2]
+        idx = bisect.bisect_left(buckets, elapsed)
+        values = self._values
+        with self._lock:
+            values[("supportai_stage_in_flight", key)] -= 1
+            if failed:
+                values[("supportai_stage_errors_total", key)] = values.get(("supportai_stage_errors_total", key), 0.0) + 1
+            h = self._histograms.get(("supportai_stage_seconds", key))
+            if h is None:
+                h = self._histograms[("supportai_stage_seconds", key)] = [0] * (len(buckets) + 1) + [0.0, 0]
+            h[idx] += 1
+            h[-2] += elapsed
+            h[-1] += 1
+
+    def inc(self, name: str, value: float = 1.0, **labels) -> None:
+        if not self.enabled:
+            return
+        self._add(name, _label_key(labels), value)
+
+    def gauge_add(self, name: str, delta: float, **labels) -> None:
+        if not self.enabled:
+            return
+        self._add(name, _label_key(labels), delta)
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        if not self.enabled:
+            return
+        self._observe(name, _label_key(labels), value)
+
+    def track(self, stage: str):
+        """
+        Context manager timing one stage: latency histogram, in-flight gauge and error counter
+        """
+        if not self.enabled:
+            return _NOOP_TIMER
+        return _StageTimer(self, stage)
+
+    def register_collector(self, fn) -> None:
+        """
+        fn() returns [(gauge name, labels dict, value)] sampled at scrape/snapshot time
+        """
+        self._collectors.append(fn)
+
+    # ----- snapshots and exposition -----
+    def snapshot(self) -> dict:
+        with self._lock:
+            values = {name_key: v for name_key, v in self._values.items()}
+            hists = {name_key: list(h) for name_key, h in self._histograms.items()}
+        for fn in self._collectors:
+            try:
+                for name, labels, value in fn():
+                    values[(name, _label_key(labels))] = float(value)
+            except Exception as e:
+                logger.warning(f"Metrics collector failed: {e}")
+        return {
+            "pid": os.getpid(),
+            "values": [[name, list(map(list, key)), v] for (name, key), v in values.items()],
+            "histograms": [[name, list(map(list, key)), h] for (name, key), h in hists.items()],
+        }
+
+    def _snapshot_path(self) -> str:
+        pid = os.getpid()
+        if self._path is None or self._path[0] != pid:
+            self._path = (pid, os.path.join(self.multiproc_dir, f"metrics_{pid}_{time.time_ns()}.json"))
+        return self._path[1]
+
+    def write_snapshot(self) -> None:
+        if not (self.enabled and self.multiproc_dir):
+            return
+        try:
+            os.makedirs(self.multiproc_dir, exist_ok=True)
+            path = self._snapshot_path()
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.warning(f"Failed to write metrics snapshot: {e}")
+
+    def _start_flusher(self) -> None:
+        # is_alive() is False in a forked worker, which must start its own flusher
+        if (self._flusher is not None and self._flusher.is_alive()) or not self.multiproc_dir:
+            return
+        with self._lock:
+            if self._flusher is not None and self._flusher.is_alive():
+                return
+
+            def loop():
+                while True:
+                    time.sleep(self.flush_seconds)
+                    self.write_snapshot()
+
+            self._flusher = threading.Thread(target=loop, name="metrics-flush", daemon=True)
+            self._flusher.start()
+
+    @staticmethod
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+            return True
+        except ProcessLookupError:
+            return False
+        except Exception:
+            return True
+
+    def _is_dead(self, path: str, snap: dict) -> bool:
+        # A live worker rewrites its file every flush_seconds; a stale file outlived its
+        # process even when the pid has since been reused by another one
+        if path == self._snapshot_path():
+            return False
+        try:
+            stale = time.time() - os.path.getmtime(path) > max(10 * self.flush_seconds, 60)
+        except OSError:
+            return False
+        return stale or not self._pid_alive(snap.get("pid", 0))
+
+    @staticmethod
+    def _merge(values: dict, hists: dict, snap: dict, gauges: bool = True) -> None:
+        for name, key, v in snap.get("values", []):
+            if name not in METRICS or (METRICS[name][0] == "gauge" and not gauges):
+                continue
+            k = (name, tuple(map(tuple, key)))
+            values[k] = values.get(k, 0.0) + v
+        for name, key, h in snap.get("histograms", []):
+            if name not in METRICS:
+                continue
+            k = (name, tuple(map(tuple, key)))
+            cur = hists.get(k)
+            hists[k] = list(h) if cur is None else [a + b for a, b in zip(cur, h)]
+
+    def _compact(self, archive: dict, dead: list) -> dict:
+        """
+        Fold exited workers' counters and histograms into the archive file, then unlink their snapshots
+        """
+        values, hists = {}, {}
+        self._merge(values, hists, archive)
+        for _, snap in dead:
+            self._merge(values, hists, snap, gauges=False)
+        archive = {
+            "values": [[name, list(map(list, key)), v] for (name, key), v in values.items()],
+            "histograms": [[name, list(map(list, key)), h] for (name, key), h in hists.items()],
+        }
+        path = os.path.join(self.multiproc_dir, "metrics-archive.json")
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(archive, f)
+        os.replace(tmp_path, path)
+        for snap_path, _ in dead:
+            try:
+                os.unlink(snap_path)
+            except FileNotFoundError:
+                pass
+        return archive
+
+    def _read_multiproc(self) -> list:
+        """
+        The archive plus every live worker's snapshot; dead workers are compacted into the archive
+        """
+        archive_path = os.path.join(self.multiproc_dir, "metrics-archive.json")
+        fd = None
+        try:
+            if fcntl is not None:
+                # Scrapes in different workers must not compact the same snapshot twice
+                fd = os.open(os.path.join(self.multiproc_dir, "metrics.lock"), os.O_CREAT | os.O_RDWR, 0o644)
+                fcntl.flock(fd, fcntl.LOCK_EX)
+            archive = {}
+            if os.path.exists(archive_path):
+                with open(archive_path, "r", encoding="utf-8") as f:
+                    archive = json.load(f)
+            live, dead = [], []
+            for path in glob.glob(os.path.join(self.multiproc_dir, "metrics_*.json")):
+                try:
+                    with open(path, "r", encoding="utf-8") as f:
+                        snap = json.load(f)
+                except Exception:
+                    continue
+                (dead if self._is_dead(path, snap) else live).append((path, snap))
+            if dead:
+                try:
+                    archive = self._compact(archive, dead)
+                except Exception as e:
+                    logger.warning(f"Failed to compact metrics snapshots: {e}")
+                    live.extend(dead)
+            return [archive] + [snap for _, snap in live]
+        finally:
+            if fd is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                os.close(fd)
+
+    def _collect(self) -> tuple:
+        """
+        Merged (values, histograms) for this worker, or for all workers in multiproc mode
+        """
+        if not self.multiproc_dir:
+            snapshots = [self.snapshot()]
+        else:
+            self.write_snapshot()
+            self._start_flusher()
+            try:
+                snapshots = self._read_multiproc()
+            except Exception as e:
+                logger.warning(f"Failed to read metrics snapshots: {e}")
+                snapshots = [self.snapshot()]
+        values, hists = {}, {}
+        for snap in snapshots:
+            # The archive holds only counters and histograms of exited workers
+            self._merge(values, hists, snap)
+        return values, hists
+
+    def render(self) -> str:
+        values, hists = self._collect()
+        lines = []
+        for name, (kind, help_text, buckets) in METRICS.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            if kind == "histogram":
+                for (n, key), h in sorted(hists.items()):
+                    if n != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(list(buckets) + [float("inf")], h[:-2]):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(key, (('le', _format_value(bound)),))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(key)} {_format_value(h[-2])}")
+                    lines.append(f"{name}_count{_format_labels(key)} {int(h[-1])}")
+            else:
+                for (n, key), v in sorted(values.items()):
+                    if n == name:
+                        lines.append(f"{name}{_format_labels(key)} {_format_value(v)}")
+        return "\n".join(lines) + "\n"
+
+    def reset(self) -> None:
+        with self._lock:
+            self._values.clear()
+            self._histograms.clear()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware recording per-route latency; labels use the route template, not the raw path
+    """
+
+    def __init__(self, app, registry: MetricsRegistry = None):
+        self.app = app
+        self.registry = registry or metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        reg = self.registry
+        start = time.perf_counter()
+        reg.gauge_add("supportai_http_requests_in_flight", 1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            reg.gauge_add("supportai_http_requests_in_flight", -1)
+            route = scope.get("route")
+            reg.observe("supportai_http_request_seconds", time.perf_counter() - start,
+                        method=scope.get("method", ""),
+                        route=getattr(route, "path", None) or "unmatched",
+                        status=str(status["code"]))
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,274 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from config import settings
+from utils.helpers import normalize_query, hash_text
+from utils.logger import logger
+
+
+class ResponseCache:
+    """
+    Exact-match cache for pipeline answers: bounded in-memory LRU with TTL,
+    optionally backed by a SQLite file shared across worker processes. With the
+    SQLite tier, invalidations are logged there so every worker drops them from
+    its memory tier too.
+    """
+
+    def __init__(self, max_entries: int = None, max_bytes: int = None, ttl_seconds: float = None,
+                 db_path: str = None, db_max_entries: int = None):
+        self.max_entries = max_entries or settings.RESPONSE_CACHE_MAX_ENTRIES
+        self.max_bytes = max_bytes or settings.RESPONSE_CACHE_MAX_BYTES
+        self.ttl = settings.RESPONSE_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.db_path = settings.RESPONSE_CACHE_DB_PATH if db_path is None else db_path
+        self.db_max_entries = db_max_entries or settings.RESPONSE_CACHE_DB_MAX_ENTRIES
+        self._lock = threading.Lock()
+        # key -> (expires_at, value, answer_hash, size)
+        self._entries = OrderedDict()
+        self._by_answer = {}
+        self._bytes = 0
+        self._local = threading.local()
+        self._writes = 0
+        # Last row of the shared invalidation log this worker has applied
+        self._invalidation_id = 0
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "sets": 0,
+                      "evictions": 0, "expirations": 0, "invalidations": 0}
+        if self.db_path:
+            self._init_db()
+
+    # ----- keys -----
+    @staticmethod
+    def make_key(query: str, history: list = None, attachment_ids: list = None,
+                 guidance: str = None, context_turns: int = None) -> str:
+        turns = settings.RESPONSE_CACHE_CONTEXT_TURNS if context_turns is None else context_turns
+        recent = (history or [])[-turns:] if turns > 0 else []
+        context = "\n".join(f"{h.get('user', '')}\x1f{h.get('bot', '')}" for h in recent)
+        parts = [
+            normalize_query(query),
+            hash_text(context) if context else "",
+            ",".join(sorted(str(a) for a in (attachment_ids or []) if a)),
+            hash_text(guidance) if guidance else "",
+        ]
+        return hash_text("\x1e".join(parts))
+
+    @staticmethod
+    def answer_hash(answer: str) -> str:
+        return hash_text((answer or "").strip())
+
+    # ----- SQLite tier -----
+    def _init_db(self) -> None:
+        try:
+            conn = self._conn()
+            conn.execute("""CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                answer_hash TEXT,
+                expires_at REAL,
+                last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_answer ON response_cache(answer_hash)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_response_cache_access ON response_cache(last_access)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS response_cache_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                answer_hash TEXT NOT NULL,
+                invalidated_at REAL)""")
+            conn.commit()
+            row = conn.execute("SELECT MAX(id) FROM response_cache_invalidations").fetchone()
+            self._invalidation_id = row[0] or 0
+        except Exception as e:
+            logger.error(f"Response cache DB init failed; continuing memory-only: {e}")
+            self.db_path = None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            d = os.path.dirname(self.db_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _db_get(self, key: str, now: float):
+        try:
+            conn = self._conn()
+            row = conn.execute("SELECT value, answer_hash, expires_at FROM response_cache WHERE key = ?",
+                               (key,)).fetchone()
+            if not row:
+                return None
+            if row[2] and row[2] < now:
+                conn.execute("DELETE FROM response_cache WHERE key = ?", (key,))
+                conn.commit()
+                return None
+            conn.execute("UPDATE response_cache SET last_access = ? WHERE key = ?", (now, key))
+            conn.commit()
+            return json.loads(row[0]), row[1], row[2]
+        except Exception as e:
+            logger.warning(f"Response cache disk read failed: {e}")
+            return None
+
+    def _db_set(self, key: str, value: dict, answer_hash: str, expires_at: float, now: float) -> None:
+        try:
+            conn = self._conn()
+            conn.execute("INSERT OR REPLACE INTO response_cache(key, value, answer_hash, expires_at, last_access) "
+                         "VALUES (?, ?, ?, ?, ?)",
+                         (key, json.dumps(value, ensure_ascii=False), answer_hash, expires_at, now))
+            self._writes += 1
+            # Prune periodically rather than on every write
+            if self._writes % 100 == 0:
+                conn.execute("DELETE FROM response_cache WHERE expires_at < ?", (now,))
+                # Entries cached before an invalidation have expired after one TTL
+                conn.execute("DELETE FROM response_cache_invalidations WHERE invalidated_at < ?",
+                             (now - max(self.ttl, 3600),))
+                conn.execute("DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                             "ORDER BY last_access DESC LIMIT -1 OFFSET ?)", (self.db_max_entries,))
+            conn.commit()
+        except Exception as e:
+            logger.warning(f"Response cache disk write failed: {e}")
+
+    def _sync_invalidations(self) -> None:
+        # Apply invalidations made by other workers since the last check (one indexed range read)
+        try:
+            rows = self._conn().execute(
+                "SELECT id, answer_hash FROM response_cache_invalidations WHERE id > ? ORDER BY id",
+                (self._invalidation_id,)).fetchall()
+        except Exception as e:
+            logger.warning(f"Response cache invalidation sync failed: {e}")
+            return
+        if not rows:
+            return
+        with self._lock:
+            for row_id, answer_hash in rows:
+                for key in list(self._by_answer.get(answer_hash, ())):
+                    self._drop(key)
+                    self.stats["invalidations"] += 1
+                self._invalidation_id = max(self._invalidation_id, row_id)
+
+    # ----- memory tier -----
+    def _drop(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry[3]
+        keys = self._by_answer.get(entry[2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                self._by_answer.pop(entry[2], None)
+
+    def _store(self, key: str, value: dict, answer_hash: str, expires_at: float) -> None:
+        size = sum(len(str(v)) for v in value.values())
+        self._drop(key)
+        self._entries[key] = (expires_at, value, answer_hash, size)
+        self._by_answer.setdefault(answer_hash, set()).add(key)
+        self._bytes += size
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            oldest = next(iter(self._entries))
+            self._drop(oldest)
+            self.stats["evictions"] += 1
+
+    # ----- public API -----
+    def get(self, key: str):
+        now = time.time()
+        if self.db_path:
+            self._sync_invalidations()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[0] and entry[0] < now:
+                    self._drop(key)
+                    self.stats["expirations"] += 1
+                else:
+                    self._entries.move_to_end(key)
+                    self.stats["hits"] += 1
+                    return dict(entry[1])
+        if self.db_path:
+            found = self._db_get(key, now)
+            if found:
+                value, answer_hash, expires_at = found
+                with self._lock:
+                    self._store(key, value, answer_hash, expires_at)
+                    self.stats["hits"] += 1
+                    self.stats["disk_hits"] += 1
+                return dict(value)
+        with self._lock:
+            self.stats["misses"] += 1
+        return None
+
+    def set(self, key: str, value: dict) -> None:
+        now = time.time()
+        expires_at = now + self.ttl if self.ttl else 0
+        answer_hash = self.answer_hash(value.get("summary", ""))
+        with self._lock:
+            self._store(key, dict(value), answer_hash, expires_at)
+            self.stats["sets"] += 1
+        if self.db_path:
+            self._db_set(key, value, answer_hash, expires_at, now)
+
+    def update(self, key: str, **fields) -> None:
+        """
+        Merge fields (e.g. a late critique) into an existing entry without touching its TTL
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return
+            value = dict(entry[1], **fields)
+            self._store(key, value, entry[2], entry[0])
+            self._entries.move_to_end(key)
+        if self.db_path:
+            self._db_set(key, value, entry[2], entry[0], time.time())
+
+    def invalidate_answer(self, answer: str) -> int:
+        """
+        Drop every cached entry whose answer matches (e.g. after a dislike); returns entries removed
+        """
+        answer_hash = self.answer_hash(answer)
+        with self._lock:
+            keys = list(self._by_answer.get(answer_hash, ()))
+            for key in keys:
+                self._drop(key)
+        removed = len(keys)
+        if self.db_path:
+            try:
+                conn = self._conn()
+                cur = conn.execute("DELETE FROM response_cache WHERE answer_hash = ?", (answer_hash,))
+                conn.execute("INSERT INTO response_cache_invalidations(answer_hash, invalidated_at) VALUES (?, ?)",
+                             (answer_hash, time.time()))
+                conn.commit()
+                removed = max(removed, cur.rowcount or 0)
+            except Exception as e:
+                logger.warning(f"Response cache disk invalidation failed: {e}")
+        with self._lock:
+            self.stats["invalidations"] += removed
+        return removed
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_answer.clear()
+            self._bytes = 0
+        if self.db_path:
+            try:
+                conn = self._conn()
+                conn.execute("DELETE FROM response_cache")
+                conn.execute("DELETE FROM response_cache_invalidations")
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"Response cache disk clear failed: {e}")
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = len(self._entries)
+            stats["bytes"] = self._bytes
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["disk_tier"] = bool(self.db_path)
+        return stats
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,389 @@
+import difflib
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import zlib
+import numpy as np
+from config import settings
+from utils.helpers import hash_text
+from utils.logger import logger
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - non-POSIX
+    fcntl = None
+
+_STOP_WORDS = frozenset(
+    "a an and are as at be but by can do does for from how i i'm is it its me my of on or "
+    "please the this to was what when where why will with you your".split()
+)
+# Used only by the match guard: a negation flips the meaning of otherwise identical words,
+# and auxiliaries vanish into contractions ("has not" / "hasn't")
+_NEGATIONS = frozenset("no not never nothing none nobody nowhere cannot without".split())
+_AUXILIARIES = frozenset("am been being did had has have is were".split())
+
+
+class HashingVectorizer:
+    """
+    Local, network-free text embedding: word unigrams/bigrams plus character
+    trigrams, hashed into a fixed number of signed buckets and L2-normalized
+    """
+
+    def __init__(self, dim: int = None):
+        self.dim = dim or settings.SEMANTIC_CACHE_DIM
+
+    @staticmethod
+    def features(text: str) -> list:
+        # Same tokenization as utils.helpers.extract_keywords, minus stop words, order kept
+        words = [w for w in re.findall(r'\b\w+\b', (text or "").lower()) if w not in _STOP_WORDS]
+        feats = list(words)
+        feats.extend(f"{a} {b}" for a, b in zip(words, words[1:]))
+        for w in words:
+            padded = f"<{w}>"
+            feats.extend("#" + padded[i:i + 3] for i in range(len(padded) - 2))
+        return feats
+
+    def transform(self, texts: list) -> np.ndarray:
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            counts = {}
+            for feat in self.features(text):
+                h = zlib.crc32(feat.encode("utf-8"))
+                idx = h % self.dim
+                sign = 1.0 if (h >> 31) & 1 else -1.0
+                counts[idx] = counts.get(idx, 0.0) + sign
+            if counts:
+                idx = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+                vals = np.fromiter(counts.values(), dtype=np.float32, count=len(counts))
+                # Sublinear term frequency keeps repeated words from dominating
+                out[row, idx] = np.sign(vals) * (1.0 + np.log(np.abs(vals) + 1e-9)) * (vals != 0)
+            norm = np.linalg.norm(out[row])
+            if norm > 0:
+                out[row] /= norm
+        return out
+
+
+def _scope_id(scope: str) -> int:
+    return int(hash_text(scope or "")[:15], 16)
+
+
+def guard_terms(text: str) -> tuple:
+    """
+    (negated, content terms) of a query, for the match guard
+    """
+    negated = False
+    terms = set()
+    for word in re.findall(r"[a-z0-9]+(?:'[a-z]+)?", (text or "").lower()):
+        if word.endswith("n't") or word in _NEGATIONS:
+            negated = True
+            continue
+        word = word.split("'")[0]
+        if word in _STOP_WORDS or word in _AUXILIARIES:
+            continue
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.add(word)
+    return negated, frozenset(terms)
+
+
+def _terms_cover(terms: frozenset, others: frozenset) -> bool:
+    # Every term has an equal or near-equal (typo) counterpart on the other side
+    for term in terms - others:
+        if len(term) < 4 or not any(difflib.SequenceMatcher(None, term, o).ratio() >= 0.85 for o in others):
+            return False
+    return True
+
+
+def same_meaning(a: tuple, b: tuple) -> bool:
+    """
+    Whether two guard_terms() results may share an answer: same negation and the same
+    content words. A close vector alone is not enough: "refund received" and "refund
+    not received" share most features.
+    """
+    return a[0] == b[0] and _terms_cover(a[1], b[1]) and _terms_cover(b[1], a[1])
+
+
+class SemanticCache:
+    """
+    Near-duplicate answer cache: query vectors live in a fixed-capacity NumPy
+    matrix (optionally a memory-mapped .npy file) searched by cosine similarity.
+    Entries only match within the same scope (conversation context, attachments, guidance)
+    and when negation and content words agree. With a path, invalidations are logged
+    next to it so every worker drops them.
+    """
+
+    def __init__(self, capacity: int = None, dim: int = None, threshold: float = None, path: str = None):
+        self.capacity = capacity or settings.SEMANTIC_CACHE_CAPACITY
+        self.threshold = settings.SEMANTIC_CACHE_THRESHOLD if threshold is None else threshold
+        self.vectorizer = HashingVectorizer(dim)
+        self.dim = self.vectorizer.dim
+        self.path = settings.SEMANTIC_CACHE_PATH if path is None else path
+        self._lock = threading.Lock()
+        self._lock_file = None
+        self._local = threading.local()
+        # Last row of the shared invalidation log this worker has applied
+        self._invalidation_id = 0
+        self._dirty = 0
+        self.size = 0
+        self.scopes = np.zeros(self.capacity, dtype=np.int64)
+        self.last_used = np.zeros(self.capacity, dtype=np.float64)
+        self.valid = np.zeros(self.capacity, dtype=bool)
+        self.entries = [None] * self.capacity
+        self.stats = {"hits": 0, "misses": 0, "rejected": 0, "adds": 0, "evictions": 0, "invalidations": 0}
+        self.matrix = None
+        if self.path and self._acquire_file():
+            self._open_mmap()
+        self._log_enabled = bool(self.path) and self._init_log()
+        if self.matrix is None:
+            self.matrix = np.zeros((self.capacity, self.dim), dtype=np.float32)
+
+    # ----- persistence -----
+    def _acquire_file(self) -> bool:
+        # Only one process may own the memory-mapped file; others run memory-only
+        if fcntl is None:
+            return True
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            self._lock_file = open(self.path + ".lock", "w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            logger.info("Semantic cache file owned by another worker; using memory only")
+            if self._lock_file:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+
+    def _open_mmap(self) -> None:
+        npy_path = self.path + ".npy"
+        meta_path = self.path + ".meta.json"
+        try:
+            if os.path.exists(npy_path):
+                mat = np.lib.format.open_memmap(npy_path, mode="r+")
+                if mat.shape == (self.capacity, self.dim) and mat.dtype == np.float32:
+                    self.matrix = mat
+                    self._load_meta(meta_path)
+                    return
+                del mat
+                logger.warning("Semantic cache file shape changed; rebuilding")
+            self.matrix = np.lib.format.open_memmap(npy_path, mode="w+", dtype=np.float32,
+                                                    shape=(self.capacity, self.dim))
+        except Exception as e:
+            logger.error(f"Semantic cache mmap failed; using memory only: {e}")
+            self.matrix = None
+
+    def _load_meta(self, meta_path: str) -> None:
+        try:
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.size = min(int(meta.get("size", 0)), self.capacity)
+            for i, entry in enumerate(meta.get("entries", [])[:self.size]):
+                self.entries[i] = entry
+                if entry:
+                    self.valid[i] = True
+                    self.scopes[i] = _scope_id(entry.get("scope", ""))
+                    self.last_used[i] = float(entry.get("last_used", 0))
+        except FileNotFoundError:
+            self.size = 0
+        except Exception as e:
+            logger.warning(f"Semantic cache metadata unreadable; starting empty: {e}")
+            self.size = 0
+
+    def flush(self) -> None:
+        """
+        Persist the matrix and row metadata (no-op when running memory-only)
+        """
+        if not isinstance(self.matrix, np.memmap):
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            for i in range(self.size):
+                if self.entries[i]:
+                    self.entries[i]["last_used"] = float(self.last_used[i])
+            meta = {"size": self.size, "dim": self.dim, "entries": self.entries[:self.size]}
+            self._dirty = 0
+            self.matrix.flush()
+        tmp = f"{self.path}.meta.json.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(meta, f, ensure_ascii=False)
+            os.replace(tmp, self.path + ".meta.json")
+        except Exception as e:
+            logger.warning(f"Semantic cache flush failed: {e}")
+
+    # ----- shared invalidation log -----
+    def _log_conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path + ".invalidations.db", timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _init_log(self) -> bool:
+        try:
+            d = os.path.dirname(self.path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            conn = self._log_conn()
+            conn.execute("""CREATE TABLE IF NOT EXISTS semantic_cache_invalidations (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                answer_hash TEXT NOT NULL,
+                invalidated_at REAL)""")
+            conn.commit()
+            return True
+        except Exception as e:
+            logger.error(f"Semantic cache invalidation log unavailable; invalidations stay local: {e}")
+            return False
+
+    def _drop_answer(self, answer_hash: str, before: float = None) -> int:
+        # Caller holds self._lock; entries added after `before` are newer than the invalidation
+        removed = 0
+        for i in range(self.size):
+            entry = self.entries[i]
+            if entry and entry.get("answer_hash") == answer_hash and (
+                    before is None or entry.get("added_at", 0) <= before):
+                self.entries[i] = None
+                self.valid[i] = False
+                self.last_used[i] = 0
+                removed += 1
+        if removed:
+            self.stats["invalidations"] += removed
+            self._dirty += 1
+        return removed
+
+    def _sync_invalidations(self) -> None:
+        # Apply invalidations made by other workers since the last check (one indexed range read).
+        # Starting from the first row also covers entries loaded from the memory-mapped file.
+        try:
+            rows = self._log_conn().execute(
+                "SELECT id, answer_hash, invalidated_at FROM semantic_cache_invalidations WHERE id > ? ORDER BY id",
+                (self._invalidation_id,)).fetchall()
+        except Exception as e:
+            logger.warning(f"Semantic cache invalidation sync failed: {e}")
+            return
+        if not rows:
+            return
+        with self._lock:
+            for row_id, answer_hash, invalidated_at in rows:
+                self._drop_answer(answer_hash, invalidated_at)
+                self._invalidation_id = max(self._invalidation_id, row_id)
+
+    # ----- search -----
+    def search(self, queries: list, scopes: list, k: int = 1) -> list:
+        """
+        Batched top-k search; returns, per query, a list of (row, score) best first
+        """
+        if not queries:
+            return []
+        vecs = self.vectorizer.transform(queries)
+        scope_ids = np.array([_scope_id(s) for s in scopes], dtype=np.int64)
+        with self._lock:
+            return self._search(vecs, scope_ids, k)
+
+    def _search(self, vecs: np.ndarray, scope_ids: np.ndarray, k: int) -> list:
+        # Caller holds self._lock: row numbers are only meaningful until the next add()
+        n = self.size
+        if n == 0:
+            return [[] for _ in range(len(vecs))]
+        sims = vecs @ self.matrix[:n].T
+        mask = (self.scopes[:n][None, :] == scope_ids[:, None]) & self.valid[:n][None, :]
+        sims = np.where(mask, sims, -np.inf)
+        k = min(k, n)
+        top = np.argpartition(-sims, k - 1, axis=1)[:, :k]
+        results = []
+        for qi in range(len(vecs)):
+            rows = sorted(top[qi], key=lambda r: -sims[qi, r])
+            results.append([(int(r), float(sims[qi, r])) for r in rows if np.isfinite(sims[qi, r])])
+        return results
+
+    def lookup(self, query: str, scope: str = ""):
+        """
+        Return (value, score) for the closest cached answer above the threshold that passes
+        the negation/content-word guard, else None
+        """
+        if self._log_enabled:
+            self._sync_invalidations()
+        vecs = self.vectorizer.transform([query])
+        scope_ids = np.array([_scope_id(scope)], dtype=np.int64)
+        terms = guard_terms(query)
+        # Search and read the entry in one critical section, so a concurrent add() cannot
+        # evict or reuse the row in between
+        with self._lock:
+            for row, score in self._search(vecs, scope_ids, 3)[0]:
+                entry = self.entries[row]
+                if score < self.threshold or entry is None:
+                    break
+                if not same_meaning(terms, guard_terms(entry["query"])):
+                    self.stats["rejected"] += 1
+                    continue
+                self.last_used[row] = time.time()
+                self.stats["hits"] += 1
+                return dict(entry["value"]), score
+            self.stats["misses"] += 1
+        return None
+
+    def add(self, query: str, scope: str, value: dict) -> None:
+        vec = self.vectorizer.transform([query])[0]
+        with self._lock:
+            if self.size < self.capacity:
+                row = self.size
+                self.size += 1
+            else:
+                # Evict the least recently used row
+                row = int(np.argmin(self.last_used[:self.size]))
+                self.stats["evictions"] += 1
+            self.matrix[row] = vec
+            self.valid[row] = True
+            self.scopes[row] = _scope_id(scope)
+            self.last_used[row] = time.time()
+            self.entries[row] = {
+                "query": query,
+                "scope": scope,
+                "value": dict(value),
+                "answer_hash": hash_text((value.get("summary") or "").strip()),
+                "added_at": time.time(),
+            }
+            self.stats["adds"] += 1
+            self._dirty += 1
+            should_flush = self._dirty >= settings.SEMANTIC_CACHE_FLUSH_EVERY
+        if should_flush:
+            self.flush()
+
+    def invalidate_answer(self, answer: str) -> int:
+        answer_hash = hash_text((answer or "").strip())
+        now = time.time()
+        with self._lock:
+            removed = self._drop_answer(answer_hash)
+        if self._log_enabled:
+            try:
+                conn = self._log_conn()
+                conn.execute("INSERT INTO semantic_cache_invalidations(answer_hash, invalidated_at) VALUES (?, ?)",
+                             (answer_hash, now))
+                # Bound the log; a worker idle for a week could miss an older invalidation
+                conn.execute("DELETE FROM semantic_cache_invalidations WHERE invalidated_at < ?", (now - 7 * 86400,))
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"Semantic cache invalidation log write failed: {e}")
+        return removed
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["entries"] = int(self.valid[:self.size].sum())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        stats["capacity"] = self.capacity
+        stats["threshold"] = self.threshold
+        stats["memory_mapped"] = isinstance(self.matrix, np.memmap)
+        return stats
+
+
+semantic_cache = SemanticCache() if settings.SEMANTIC_CACHE_ENABLED else None
@@ -0,0 +1,271 @@
+import os
+import sqlite3
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+from config import settings
+from utils.logger import logger
+from utils.metrics import metrics
+
+
+# Size of the stored text; what SESSION_MAX_BYTES caps in SQLite mode
+_TEXT_BYTES = "SELECT SUM(length(user) + length(bot)) FROM session_history"
+
+
+class SessionStore:
+    """
+    Recent exchanges per session_id (last max_turns), with sliding TTL, LRU eviction and
+    a memory cap. With db_path set, history lives in a SQLite file shared by all workers.
+    """
+
+    def __init__(self, max_turns: int = None, ttl_seconds: float = None, max_sessions: int = None,
+                 max_bytes: int = None, db_path: str = None):
+        self.max_turns = max_turns or settings.SESSION_MAX_TURNS
+        self.ttl = settings.SESSION_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+        self.max_sessions = max_sessions or settings.SESSION_MAX_SESSIONS
+        self.max_bytes = max_bytes or settings.SESSION_MAX_BYTES
+        self.db_path = settings.SESSION_DB_PATH if db_path is None else db_path
+        self._lock = threading.Lock()
+        # session_id -> [last_access, deque of (user, bot) tuples, size in bytes]
+        self._sessions = OrderedDict()
+        self._bytes = 0
+        self._local = threading.local()
+        self._writes = 0
+        self.stats = {"appends": 0, "evictions": 0, "expirations": 0}
+        if self.db_path:
+            self._init_db()
+
+    @staticmethod
+    def _to_dicts(turns) -> list:
+        return [{"user": u, "bot": b} for u, b in turns]
+
+    # ----- SQLite backend -----
+    def _init_db(self) -> None:
+        try:
+            conn = self._conn()
+            conn.execute("""CREATE TABLE IF NOT EXISTS session_history (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                user TEXT,
+                bot TEXT)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_session_history_sid ON session_history(session_id, seq)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                session_id TEXT PRIMARY KEY,
+                last_access REAL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_access ON sessions(last_access)")
+            conn.commit()
+        except Exception as e:
+            logger.error(f"Session store DB init failed; continuing in-process: {e}")
+            self.db_path = None
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            d = os.path.dirname(self.db_path)
+            if d:
+                os.makedirs(d, exist_ok=True)
+            conn = sqlite3.connect(self.db_path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _db_get(self, session_id: str, now: float) -> list:
+        conn = self._conn()
+        row = conn.execute("SELECT last_access FROM sessions WHERE session_id = ?", (session_id,)).fetchone()
+        if not row:
+            return []
+        if self.ttl and row[0] < now - self.ttl:
+            self._db_delete(conn, [session_id])
+            conn.commit()
+            with self._lock:
+                self.stats["expirations"] += 1
+            return []
+        rows = conn.execute("SELECT user, bot FROM session_history WHERE session_id = ? "
+                            "ORDER BY seq DESC LIMIT ?", (session_id, self.max_turns)).fetchall()
+        conn.execute("UPDATE sessions SET last_access = ? WHERE session_id = ?", (now, session_id))
+        conn.commit()
+        return list(reversed(rows))
+
+    @staticmethod
+    def _db_delete(conn, session_ids: list) -> None:
+        for sid in session_ids:
+            conn.execute("DELETE FROM session_history WHERE session_id = ?", (sid,))
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (sid,))
+
+    def _db_append(self, session_id: str, user: str, bot: str, now: float) -> None:
+        conn = self._conn()
+        conn.execute("INSERT INTO session_history(session_id, user, bot) VALUES (?, ?, ?)", (session_id, user, bot))
+        # Keep only the last max_turns exchanges for this session
+        conn.execute("DELETE FROM session_history WHERE session_id = ? AND seq <= ("
+                     "SELECT seq FROM session_history WHERE session_id = ? ORDER BY seq DESC LIMIT 1 OFFSET ?)",
+                     (session_id, session_id, self.max_turns))
+        conn.execute("INSERT OR REPLACE INTO sessions(session_id, last_access) VALUES (?, ?)", (session_id, now))
+        with self._lock:
+            self._writes += 1
+            prune = self._writes % 100 == 0
+        # Prune expired and least-recently-used sessions periodically rather than on every write
+        if prune:
+            self._db_prune(conn, now)
+        conn.commit()
+
+    def _db_prune(self, conn, now: float) -> None:
+        expired = []
+        if self.ttl:
+            expired = [r[0] for r in conn.execute("SELECT session_id FROM sessions WHERE last_access < ?",
+                                                  (now - self.ttl,))]
+        over = [r[0] for r in conn.execute("SELECT session_id FROM sessions ORDER BY last_access DESC "
+                                           "LIMIT -1 OFFSET ?", (self.max_sessions,))]
+        expired_set = set(expired)
+        over = [sid for sid in over if sid not in expired_set]
+        self._db_delete(conn, expired + over)
+        # Then least-recently-used sessions while the stored text is over the byte cap
+        total = conn.execute(_TEXT_BYTES).fetchone()[0] or 0
+        if total > self.max_bytes:
+            for sid, size in conn.execute(
+                    "SELECT s.session_id, COALESCE(SUM(length(h.user) + length(h.bot)), 0) FROM sessions s "
+                    "LEFT JOIN session_history h ON h.session_id = s.session_id "
+                    "GROUP BY s.session_id ORDER BY s.last_access").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._db_delete(conn, [sid])
+                over.append(sid)
+                total -= size
+        with self._lock:
+            self.stats["expirations"] += len(expired)
+            self.stats["evictions"] += len(over)
+
+    # ----- in-process backend -----
+    @staticmethod
+    def _size(user: str, bot: str) -> int:
+        return sys.getsizeof(user or "") + sys.getsizeof(bot or "")
+
+    def _drop(self, session_id: str) -> None:
+        entry = self._sessions.pop(session_id, None)
+        if entry is not None:
+            self._bytes -= entry[2]
+
+    def _evict(self, now: float) -> None:
+        # Oldest-accessed first: expired sessions, then LRU while over the count or byte cap
+        while self._sessions:
+            sid, entry = next(iter(self._sessions.items()))
+            if self.ttl and entry[0] < now - self.ttl:
+                self._drop(sid)
+                self.stats["expirations"] += 1
+            elif len(self._sessions) > self.max_sessions or self._bytes > self.max_bytes:
+                self._drop(sid)
+                self.stats["evictions"] += 1
+            else:
+                break
+
+    # ----- public API -----
+    def get(self, session_id: str) -> list:
+        """
+        The session's recent exchanges, oldest first, as [{"user": ..., "bot": ...}]
+        """
+        now = time.time()
+        if self.db_path:
+            try:
+                return self._to_dicts(self._db_get(session_id, now))
+            except Exception as e:
+                logger.warning(f"Session store read failed: {e}")
+                return []
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                return []
+            if self.ttl and entry[0] < now - self.ttl:
+                self._drop(session_id)
+                self.stats["expirations"] += 1
+                return []
+            entry[0] = now
+            self._sessions.move_to_end(session_id)
+            return self._to_dicts(entry[1])
+
+    def append(self, session_id: str, user: str, bot: str) -> None:
+        now = time.time()
+        if self.db_path:
+            try:
+                self._db_append(session_id, user, bot, now)
+                with self._lock:
+                    self.stats["appends"] += 1
+            except Exception as e:
+                logger.warning(f"Session store write failed: {e}")
+            return
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = [now, deque(), 0]
+            turns = entry[1]
+            turns.append((user, bot))
+            size = self._size(user, bot)
+            entry[2] += size
+            self._bytes += size
+            while len(turns) > self.max_turns:
+                old = turns.popleft()
+                old_size = self._size(*old)
+                entry[2] -= old_size
+                self._bytes -= old_size
+            entry[0] = now
+            self._sessions.move_to_end(session_id)
+            self.stats["appends"] += 1
+            self._evict(now)
+
+    def clear(self, session_id: str = None) -> None:
+        if self.db_path:
+            try:
+                conn = self._conn()
+                if session_id is None:
+                    conn.execute("DELETE FROM session_history")
+                    conn.execute("DELETE FROM sessions")
+                else:
+                    self._db_delete(conn, [session_id])
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"Session store clear failed: {e}")
+            return
+        with self._lock:
+            if session_id is None:
+                self._sessions.clear()
+                self._bytes = 0
+            else:
+                self._drop(session_id)
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            stats = dict(self.stats)
+            stats["backend"] = "sqlite" if self.db_path else "memory"
+            if not self.db_path:
+                stats["sessions"] = len(self._sessions)
+                stats["exchanges"] = sum(len(e[1]) for e in self._sessions.values())
+                stats["bytes"] = self._bytes
+        if self.db_path:
+            try:
+                conn = self._conn()
+                stats["sessions"] = conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+                stats["exchanges"] = conn.execute("SELECT COUNT(*) FROM session_history").fetchone()[0]
+                stats["bytes"] = conn.execute(_TEXT_BYTES).fetchone()[0] or 0
+            except Exception as e:
+                logger.warning(f"Session store stats failed: {e}")
+        stats["max_sessions"] = self.max_sessions
+        stats["max_bytes"] = self.max_bytes
+        return stats
+
+
+session_store = SessionStore()
+
+
+def _collect_metrics() -> list:
+    stats = session_store.stats
+    samples = [
+        ("supportai_session_evictions_total", {"reason": "lru"}, stats["evictions"]),
+        ("supportai_session_evictions_total", {"reason": "ttl"}, stats["expirations"]),
+    ]
+    # In SQLite mode every worker shares one file, so a per-worker size gauge would be summed N times
+    if not session_store.db_path:
+        samples.append(("supportai_session_store_bytes", {}, session_store._bytes))
+    return samples
+
+
+metrics.register_collector(_collect_metrics)
@@ -0,0 +1,83 @@
+import asyncio
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent work on the same key within this process: the first
+    caller (leader) runs it, later callers (followers) await the leader's result
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self.stats = {"leaders": 0, "followers": 0, "leader_failures": 0}
+
+    def begin(self, key):
+        """
+        Returns (future, is_leader). A leader must call finish() exactly once.
+        """
+        fut = self._calls.get(key)
+        if fut is not None:
+            self.stats["followers"] += 1
+            return fut, False
+        fut = asyncio.get_running_loop().create_future()
+        # Mark the outcome as retrieved even when nobody else joined
+        fut.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._calls[key] = fut
+        self.stats["leaders"] += 1
+        return fut, True
+
+    def finish(self, key, fut, result=None, error: BaseException = None) -> None:
+        if self._calls.get(key) is fut:
+            del self._calls[key]
+        if fut.done():
+            return
+        if error is None:
+            fut.set_result(result)
+        elif not isinstance(error, Exception):
+            # Cancellation, or a streaming leader closed by a client disconnect (GeneratorExit):
+            # followers must not get it raised; they re-run the work themselves
+            fut.cancel()
+        else:
+            self.stats["leader_failures"] += 1
+            fut.set_exception(error)
+
+    async def do(self, key, fn):
+        """
+        Run fn() (a coroutine factory) once per key across concurrent callers.
+        Followers re-run fn() themselves if the leader was cancelled.
+        """
+        if key is None:
+            return await fn()
+        fut, leader = self.begin(key)
+        if not leader:
+            found, result = await self.follow(fut)
+            return result if found else await fn()
+        try:
+            result = await fn()
+        except BaseException as e:
+            self.finish(key, fut, error=e)
+            raise
+        self.finish(key, fut, result=result)
+        return result
+
+    @staticmethod
+    async def follow(fut) -> tuple:
+        """
+        Await a leader's result: (True, result), or (False, None) when the leader was
+        cancelled and the caller should do the work itself
+        """
+        try:
+            return True, await asyncio.shield(fut)
+        except asyncio.CancelledError:
+            if not fut.cancelled():
+                raise
+            return False, None
+
+    def in_flight(self) -> int:
+        return len(self._calls)
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        stats["in_flight"] = self.in_flight()
+        stats["calls_saved"] = stats["followers"]
+        return stats